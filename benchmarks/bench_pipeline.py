@@ -0,0 +1,412 @@
+# benchmarks/bench_pipeline.py
+"""
+Tiempo y memoria pico por etapa del flujo de cruce, a varios tamaños:
+
+  build         armar SQL + parámetros (_build_full_sql_and_params) para todas
+                las combinaciones de filtros (no depende del tamaño)
+  fetch         lectura por lotes del query contra la base local SQLite
+                (db.local_fixtures, generada una vez por tamaño y reutilizada)
+  postprocess   finalize_cruce + apply_dtype_policy (lo que hace la importación)
+  filter_index  construir FilterIndex
+  filter        búsquedas de MainView.buscar_datos (índice + take + recompute_totals)
+  render        VirtualTreeview.set_data + primer dibujo
+  scroll        200 páginas hacia abajo en la grilla virtual
+  export_csv / export_xlsx / export_parquet
+
+Salida legible por consola y, con --json, un archivo con los resultados.
+Con --base compara contra un resultado guardado y termina con código 1 si
+alguna etapa empeora más que --umbral (tiempo o memoria).
+
+Uso:
+  python -m benchmarks.bench_pipeline [--tamanos 10000 100000 1000000]
+      [--etapas fetch filter ...] [--repeticiones 3] [--json res.json]
+      [--base benchmarks/baseline.json] [--guardar-base] [--umbral 0.2]
+
+Render/scroll necesitan display: sin $DISPLAY se levanta Xvfb si está
+instalado; si no, esas etapas se omiten con una nota. La memoria pico es
+la de tracemalloc (Python/numpy/pandas); no incluye memoria propia de
+SQLite ni de Tk.
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from db.postprocess import DISPLAY_FORMATTERS, finalize_cruce, recompute_totals
+from db.schema import apply_dtype_policy
+from utils.filter_index import FilterIndex
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# El query devuelve ~1 fila por cada 3 líneas de transferencia sintéticas
+FETCH_MOVIMIENTOS_POR_FILA = 3
+# Sobre este tamaño export_xlsx se omite salvo con --xlsx-completo (minutos por corrida)
+XLSX_MAX_ROWS = 200_000
+# Diferencias menores no cuentan como regresión (ruido del reloj / del asignador)
+MIN_DELTA_S = 0.005
+MIN_DELTA_MB = 1.0
+
+class Skipped(Exception):
+    """La etapa no puede medirse en este entorno (falta display, dependencia, etc.)."""
+
+# ----------------- Datos sintéticos -----------------
+def synthetic_cruce(n_rows, seed=0) -> pd.DataFrame:
+    """
+    Resultado del query "lean" (antes del post-proceso) con cardinalidades
+    parecidas a las reales: ~8 filas por código, 3 códigos por referencia.
+    """
+    rng = np.random.default_rng(seed)
+    n_codes = max(1, n_rows // 8)
+    codes = rng.integers(0, n_codes, n_rows)
+    cat = rng.integers(0, 400, n_codes)
+    fab = np.minimum(rng.zipf(1.3, n_codes), 300)
+    marca = rng.integers(0, 150, n_codes)
+
+    def per_code(prefix, values):
+        return np.asarray(prefix + pd.Index(values).astype(str), dtype=object)[codes]
+
+    return pd.DataFrame({
+        "CodigoBarra": np.asarray(pd.Index(np.arange(n_codes)).astype(str).str.zfill(13), dtype=object)[codes],
+        "Referencia": per_code("REF", np.arange(n_codes) // 3),
+        "CodigoMarca": per_code("M", marca),
+        "Marca": per_code("Marca ", marca),
+        "Nombre": per_code("Producto ", np.arange(n_codes)),
+        "Nombre_Fabricante": per_code("Fabricante ", fab),
+        "CodigoFabricante": per_code("", fab),
+        "CategoriaCodigo": per_code("", cat),
+        "CategoriaNombre": per_code("Categoria ", cat),
+        "Linea": per_code("Linea ", cat // 10),
+        "CantidadInicial": rng.integers(2, 60, n_rows),
+        "ExistenciaActual": rng.integers(0, 200, n_codes)[codes],
+        "correccion": (rng.random(n_rows) < 0.05).astype(int),
+        "NumeroTransferencia": rng.integers(1, max(2, n_rows // 12), n_rows),
+        "FechaLlegada": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 600, n_rows), unit="D"),
+        "observacion": np.where(rng.random(n_rows) < 0.15, "Obs", ""),
+    })
+
+def imported_cruce(n_rows, seed=0) -> pd.DataFrame:
+    """Como queda df_cruce en MainView tras importar (totales, % y tipos compactos)."""
+    return apply_dtype_policy(finalize_cruce(synthetic_cruce(n_rows, seed), "pandas"))
+
+def _filter_queries(df) -> list:
+    """Búsquedas típicas tomadas de los propios datos: un código, una referencia, etc."""
+    first = df.iloc[0]
+    top_fab = df["CodigoFabricante"].value_counts().index[0]
+    return [
+        ({"CodigoBarra": first["CodigoBarra"]}, False),
+        ({"Referencia": f" {str(first['Referencia']).upper()} "}, False),
+        ({"CodigoFabricante": top_fab}, False),
+        ({"CategoriaNombre": first["CategoriaNombre"]}, True),
+        ({"Linea": first["Linea"]}, False),
+        ({"Linea": first["Linea"], "CodigoFabricante": top_fab}, True),
+        ({"CodigoBarra": "no-existe"}, False),
+        ({}, True),
+    ]
+
+def _fixtures_dir(movimientos, seed) -> str:
+    """Base local sintética por tamaño (se genera una sola vez; ROTACION_BENCH_DIR cambia la carpeta)."""
+    root = os.environ.get("ROTACION_BENCH_DIR") or os.path.join(tempfile.gettempdir(), "rotacion_bench")
+    directory = os.path.join(root, f"mov_{movimientos}_s{seed}")
+    marker = os.path.join(directory, "fixtures.json")
+    if not os.path.exists(marker):
+        from db.local_fixtures import generate_fixtures
+        from db.local_schema import create_local_engine
+        print(f"  generando base local ({movimientos:,} movimientos) en {directory} ...", file=sys.stderr)
+        engine = create_local_engine(directory)
+        counts = generate_fixtures(engine, movimientos, seed)
+        engine.dispose()
+        with open(marker, "w", encoding="utf-8") as f:
+            json.dump(counts, f, indent=2)
+    return directory
+
+# ----------------- Display virtual -----------------
+def ensure_display():
+    """Si no hay $DISPLAY, levanta Xvfb (si existe). Devuelve el proceso a terminar o None."""
+    if os.environ.get("DISPLAY") or not shutil.which("Xvfb"):
+        return None
+    display = ":97"
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = display
+    time.sleep(0.5)
+    return proc
+
+def _tk_grid(columns):
+    import tkinter as tk
+    from views.virtual_tree import VirtualTreeview
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        raise Skipped(f"sin display ({e}); ejecutar con Xvfb o xvfb-run")
+    root.geometry("1200x700")
+    grid = VirtualTreeview(root, columns, formatters=DISPLAY_FORMATTERS)
+    grid.frame.pack(fill="both", expand=True)
+    root.update()
+    return root, grid
+
+# ----------------- Etapas -----------------
+# Cada etapa prepara lo que no se mide y devuelve (medir, limpiar);
+# medir() devuelve la cantidad de filas procesadas.
+
+def stage_build(ctx, n):
+    from db.connection import _build_full_sql_and_params
+    combos = []
+    for mask in itertools.product((None, "x"), repeat=5):
+        for corr, excl in itertools.product((False, True), (None, "999999")):
+            codigo, referencia, categoria, linea, fabrica = mask
+            combos.append(dict(fecha_option=1, codigo_filter=codigo, referencia_filter=referencia,
+                               categoria_filter=categoria, linea_filter=linea, fabrica_filter=fabrica,
+                               correccion_solo_01=corr, excluir_codigorecibe=excl))
+
+    def run():
+        for filters in combos:
+            _build_full_sql_and_params(**filters)
+        return len(combos)
+    return run, None
+
+def stage_fetch(ctx, n):
+    from db.connection import _fetch_dataframe, _get_cruce_template, _shape_and_params
+    from db.local_schema import create_local_engine
+    engine = create_local_engine(_fixtures_dir(n * FETCH_MOVIMIENTOS_POR_FILA, ctx["seed"]))
+    shape, params = _shape_and_params(fecha_start=date(2000, 1, 1))
+    statement = _get_cruce_template(shape, engine.dialect.name)
+
+    def run():
+        return len(_fetch_dataframe(engine, statement, params))
+    return run, engine.dispose
+
+def stage_postprocess(ctx, n):
+    raw = synthetic_cruce(n, ctx["seed"])
+
+    def run():
+        return len(apply_dtype_policy(finalize_cruce(raw.copy(), "pandas")))
+    return run, None
+
+def stage_filter_index(ctx, n):
+    df = ctx["imported"](n)
+
+    def run():
+        FilterIndex(df)
+        return len(df)
+    return run, None
+
+def stage_filter(ctx, n):
+    df = ctx["imported"](n)
+    index = FilterIndex(df)
+    queries = _filter_queries(df)
+
+    def run():
+        rows = 0
+        for filters, correccion_cero in queries:
+            positions = index.search(filters, correccion_cero=correccion_cero)
+            rows += len(recompute_totals(df.take(positions)))
+        return rows
+    return run, None
+
+def stage_render(ctx, n):
+    df = ctx["imported"](n)
+    root, grid = _tk_grid(list(df.columns))
+
+    def run():
+        grid.set_data(df)
+        root.update_idletasks()
+        return len(df)
+    return run, root.destroy
+
+def stage_scroll(ctx, n):
+    df = ctx["imported"](n)
+    root, grid = _tk_grid(list(df.columns))
+    grid.set_data(df)
+    root.update_idletasks()
+    page = grid._visible_rows()
+
+    def run():
+        grid._set_top(0)
+        for _ in range(200):
+            grid.scroll_rows(page)
+            root.update_idletasks()
+        return min(len(df), 200 * page)
+    return run, root.destroy
+
+def _stage_export(fn_name, ext):
+    def stage(ctx, n):
+        from utils import helpers
+        if ext == "xlsx" and n > XLSX_MAX_ROWS and not ctx["xlsx_completo"]:
+            raise Skipped(f"más de {XLSX_MAX_ROWS:,} filas (usar --xlsx-completo)")
+        if ext == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            raise Skipped("pyarrow no está instalado")
+        df = ctx["imported"](n)
+        path = os.path.join(ctx["tmp"], f"bench_{n}.{ext}")
+
+        def run():
+            getattr(helpers, fn_name)(df, path)
+            return len(df)
+        return run, lambda: os.path.exists(path) and os.remove(path)
+    return stage
+
+STAGES = {
+    "build": stage_build,
+    "fetch": stage_fetch,
+    "postprocess": stage_postprocess,
+    "filter_index": stage_filter_index,
+    "filter": stage_filter,
+    "render": stage_render,
+    "scroll": stage_scroll,
+    "export_csv": _stage_export("export_to_csv", "csv"),
+    "export_xlsx": _stage_export("export_to_excel", "xlsx"),
+    "export_parquet": _stage_export("export_to_parquet", "parquet"),
+}
+# Etapas que no dependen del tamaño: se miden una sola vez
+SIZE_INDEPENDENT = {"build"}
+
+# ----------------- Medición -----------------
+def measure(run, repeat):
+    """Una corrida con tracemalloc (memoria pico) y `repeat` sin él (mejor tiempo)."""
+    tracemalloc.start()
+    try:
+        rows = run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - t0)
+    return rows, best, peak / 2**20
+
+def run_suite(sizes, stages, repeat=3, seed=0, xlsx_completo=False) -> dict:
+    imported = {}
+
+    def imported_for(n):
+        if n not in imported:
+            imported[n] = imported_cruce(n, seed)
+        return imported[n]
+
+    ctx = {
+        "seed": seed,
+        "xlsx_completo": xlsx_completo,
+        "tmp": tempfile.mkdtemp(prefix="rotacion_bench_"),
+        # df_cruce importado por tamaño, compartido entre etapas
+        "imported": imported_for,
+    }
+    xvfb = ensure_display() if {"render", "scroll"} & set(stages) else None
+    results = []
+    try:
+        for name in stages:
+            for n in ([None] if name in SIZE_INDEPENDENT else sizes):
+                entry = {"stage": name, "size": n}
+                cleanup = None
+                try:
+                    run, cleanup = STAGES[name](ctx, n)
+                    rows, seconds, peak_mb = measure(run, repeat)
+                    entry.update(rows=rows, seconds=round(seconds, 6), peak_mb=round(peak_mb, 2))
+                except Skipped as e:
+                    entry["skipped"] = str(e)
+                finally:
+                    if cleanup:
+                        cleanup()
+                results.append(entry)
+                _print_entry(entry)
+    finally:
+        shutil.rmtree(ctx["tmp"], ignore_errors=True)
+        if xvfb is not None:
+            xvfb.terminate()
+
+    return {
+        "meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "plataforma": platform.platform(),
+            "repeticiones": repeat,
+            "semilla": seed,
+        },
+        "results": results,
+    }
+
+# ----------------- Comparación con la base -----------------
+def compare(current: dict, baseline: dict, threshold=0.2) -> list:
+    """
+    Lista de (entrada, base, motivos) para las etapas que empeoran más que
+    `threshold` (proporción) en tiempo o memoria pico respecto de la base.
+    """
+    base = {(e["stage"], e["size"]): e for e in baseline.get("results", []) if "seconds" in e}
+    regressions = []
+    for entry in current["results"]:
+        old = base.get((entry["stage"], entry["size"]))
+        if old is None or "seconds" not in entry:
+            continue
+        reasons = []
+        if entry["seconds"] > old["seconds"] * (1 + threshold) and entry["seconds"] - old["seconds"] > MIN_DELTA_S:
+            reasons.append(f"tiempo {old['seconds']:.3f}s -> {entry['seconds']:.3f}s")
+        if entry["peak_mb"] > old["peak_mb"] * (1 + threshold) and entry["peak_mb"] - old["peak_mb"] > MIN_DELTA_MB:
+            reasons.append(f"memoria {old['peak_mb']:.1f}MB -> {entry['peak_mb']:.1f}MB")
+        if reasons:
+            regressions.append((entry, old, reasons))
+    return regressions
+
+def _print_entry(entry):
+    size = "-" if entry["size"] is None else f"{entry['size']:,}"
+    if "skipped" in entry:
+        print(f"{entry['stage']:<15} {size:>10}   omitida: {entry['skipped']}")
+    else:
+        print(f"{entry['stage']:<15} {size:>10} {entry['rows']:>10,} {entry['seconds']:>10.3f} {entry['peak_mb']:>10.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por etapas del flujo de cruce.")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--etapas", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--repeticiones", type=int, default=3, help="Corridas cronometradas por etapa (se toma la mejor)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    parser.add_argument("--base", default=DEFAULT_BASELINE, help="Resultados de referencia para comparar")
+    parser.add_argument("--guardar-base", action="store_true", help="Escribir los resultados como nueva base")
+    parser.add_argument("--umbral", type=float, default=0.2, help="Empeoramiento tolerado (0.2 = 20%%)")
+    parser.add_argument("--xlsx-completo", action="store_true", help=f"Medir export_xlsx también sobre {XLSX_MAX_ROWS:,} filas")
+    args = parser.parse_args(argv)
+    # Los mensajes INFO de cada exportación se repiten en cada corrida
+    logging.disable(logging.INFO)
+
+    print(f"{'etapa':<15} {'tamaño':>10} {'filas':>10} {'s':>10} {'MB pico':>10}")
+    current = run_suite(args.tamanos, args.etapas, args.repeticiones, args.semilla, args.xlsx_completo)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+    if args.guardar_base:
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"Base guardada en {args.base}")
+        return 0
+
+    if not os.path.exists(args.base):
+        return 0
+    with open(args.base, encoding="utf-8") as f:
+        regressions = compare(current, json.load(f), args.umbral)
+    if not regressions:
+        print(f"Sin regresiones respecto de {args.base} (umbral {args.umbral:.0%}).")
+        return 0
+    print(f"\nREGRESIONES respecto de {args.base} (umbral {args.umbral:.0%}):")
+    for entry, _old, reasons in regressions:
+        size = "-" if entry["size"] is None else f"{entry['size']:,}"
+        print(f"  {entry['stage']:<15} {size:>10}  " + "; ".join(reasons))
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# benchmarks/bench_postprocess.py
+"""
+Compara el post-proceso anterior (ventanas en SQL + pivot/merge en
+db.connection + recálculo en MainView, con formato por fila) contra la
+etapa única actual (db.postprocess.finalize_cruce).
+
+Uso:  python -m benchmarks.bench_postprocess [filas ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from db.postprocess import finalize_cruce
+
+def _synthetic(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    n_codes = max(1, n_rows // 8)
+    codes = rng.integers(0, n_codes, n_rows)
+    return pd.DataFrame({
+        "CodigoBarra": pd.Index(codes).astype(str).str.zfill(13),
+        "CantidadInicial": rng.integers(2, 60, n_rows),
+        "ExistenciaActual": rng.integers(0, 200, n_codes)[codes],
+        "FechaLlegada": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 600, n_rows), unit="D"),
+    })
+
+def _legacy(df):
+    """Cadena anterior: pivot_table + merge + map por fila, y otra vez en la vista."""
+    fmt = lambda s: s.round(2).astype(float).map(lambda v: f"{v:.2f}".replace(".", ",") + "%")
+    df = df.copy()
+    for col in ["CantidadInicial", "ExistenciaActual"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    pivot = pd.pivot_table(df, index="CodigoBarra", values="CantidadInicial", aggfunc="sum", fill_value=0)
+    pivot = pivot.reset_index().rename(columns={"CantidadInicial": "Cantidad_Inicial_Agrupada"})
+    df = df.drop(columns=["Cantidad_Inicial_Agrupada"], errors="ignore").merge(pivot, on="CodigoBarra", how="left")
+    total = df["Cantidad_Inicial_Agrupada"].replace(0, np.nan)
+    queda = (df["ExistenciaActual"] * 100.0 / total).fillna(0)
+    df["Queda"], df["Vendido"] = fmt(queda), fmt(100.0 - queda)
+    # MainView._recalc_visible_totals(df.copy()) sobre el mismo conjunto
+    df = df.copy()
+    tot = df.groupby("CodigoBarra")["CantidadInicial"].transform("sum")
+    df["Cantidad_Inicial_Agrupada"] = tot
+    queda = (df["ExistenciaActual"] * 100 / tot.replace(0, np.nan)).fillna(0).round(2)
+    df["Queda"], df["Vendido"] = fmt(queda), fmt((100 - queda).round(2))
+    return df
+
+def _single_pass(df):
+    return finalize_cruce(df.copy(), "pandas")
+
+def _time(fn, df, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(df)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main(sizes):
+    print(f"{'filas':>10} {'anterior (s)':>14} {'una pasada (s)':>16} {'x':>6}")
+    for n in sizes:
+        df = _synthetic(n)
+        old, new = _time(_legacy, df), _time(_single_pass, df)
+        print(f"{n:>10,} {old:>14.3f} {new:>16.3f} {old / new:>6.1f}")
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
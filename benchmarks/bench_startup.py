@@ -0,0 +1,141 @@
+# benchmarks/bench_startup.py
+"""
+Perfil de arranque: cuánto tarda `import main` (lo que ejecuta el .exe antes
+de crear la ventana), qué módulos pesados carga y, si hay display, cuánto
+tarda MainView en dibujarse. Cada medición corre en un proceso nuevo.
+
+La regla es que al abrir la ventana no se carguen pandas, numpy, SQLAlchemy,
+pyodbc ni openpyxl (se importan al consultar/exportar o en la precarga de
+utils.warmup). Termina con código 1 si alguno aparece o si el tiempo
+empeora más que --umbral respecto de --base.
+
+Uso:
+  python -m benchmarks.bench_startup [--repeticiones 5] [--top 15]
+      [--json res.json] [--base benchmarks/startup_baseline.json]
+      [--guardar-base] [--umbral 0.2]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "startup_baseline.json")
+
+# No deben importarse antes de mostrar la ventana
+HEAVY_MODULES = ("pandas", "numpy", "sqlalchemy", "pyodbc", "openpyxl", "xlsxwriter", "pyarrow")
+
+_IMPORT_MAIN = """
+import sys, time
+t0 = time.perf_counter()
+import main
+elapsed = time.perf_counter() - t0
+print(elapsed)
+print(",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+_SHOW_WINDOW = """
+import time
+t0 = time.perf_counter()
+import main
+from views.main_view import MainView
+try:
+    app = MainView(refresh_callback=lambda: None)
+except Exception as e:
+    print("skip", e)
+    raise SystemExit(0)
+app.update()
+print(time.perf_counter() - t0)
+app.destroy()
+"""
+
+def _run(code):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+               ROTACION_WARMUP="0")
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True).stdout.split("\n")
+
+def measure_import(repeat):
+    """Mejor tiempo de `import main` y módulos pesados cargados."""
+    best, heavy = float("inf"), []
+    for _ in range(repeat):
+        out = _run(_IMPORT_MAIN.format(heavy=HEAVY_MODULES))
+        best = min(best, float(out[0]))
+        heavy = [m for m in out[1].split(",") if m]
+    return best, heavy
+
+def measure_window(repeat):
+    """Mejor tiempo hasta la ventana dibujada, o (None, motivo) sin display."""
+    best = float("inf")
+    for _ in range(repeat):
+        out = _run(_SHOW_WINDOW)
+        if out[0].startswith("skip"):
+            return None, out[0][5:]
+        best = min(best, float(out[0]))
+    return best, None
+
+def import_profile(top=15):
+    """Módulos de primer nivel con mayor tiempo acumulado según -X importtime (µs)."""
+    env = dict(os.environ, PYTHONPATH=ROOT, ROTACION_WARMUP="0")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self, cumulative, name = line[len("import time:"):].split("|")
+        # Sangría = profundidad; se listan los módulos importados directamente
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            rows.append({"module": name.strip(), "cumulative_us": int(cumulative)})
+    rows.sort(key=lambda r: -r["cumulative_us"])
+    return rows[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perfil de arranque de la aplicación.")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    parser.add_argument("--base", default=DEFAULT_BASELINE)
+    parser.add_argument("--guardar-base", action="store_true")
+    parser.add_argument("--umbral", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    import_s, heavy = measure_import(args.repeticiones)
+    window_s, window_skip = measure_window(args.repeticiones)
+    profile = import_profile(args.top)
+    result = {"import_main_s": round(import_s, 4), "heavy_modules": heavy,
+              "window_s": None if window_s is None else round(window_s, 4), "profile": profile}
+
+    print(f"import main:        {import_s:.3f} s")
+    print("ventana dibujada:   " + (f"{window_s:.3f} s" if window_s is not None else f"omitida ({window_skip})"))
+    print(f"módulos pesados:    {', '.join(heavy) or 'ninguno'}")
+    print(f"\n{'módulo':<40} {'ms acumulados':>14}")
+    for row in profile:
+        print(f"{row['module']:<40} {row['cumulative_us'] / 1000:>14.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.guardar_base:
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nBase guardada en {args.base}")
+
+    problems = []
+    if heavy:
+        problems.append(f"módulos pesados cargados al arrancar: {', '.join(heavy)}")
+    if not args.guardar_base and os.path.exists(args.base):
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        for key, label in (("import_main_s", "import main"), ("window_s", "ventana")):
+            old, new = base.get(key), result[key]
+            if old and new and new > old * (1 + args.umbral) and new - old > 0.02:
+                problems.append(f"{label}: {old:.3f} s -> {new:.3f} s")
+    for p in problems:
+        print("REGRESIÓN:", p)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+# db/cache.py
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import pandas as pd
+
+class CacheKey(NamedTuple):
+    """Identifica un resultado: instancia + rango de fechas + filtros normalizados."""
+    instance: str
+    fecha_start: object
+    fecha_end: object
+    filters: tuple
+
+class _Entry(NamedTuple):
+    df: pd.DataFrame
+    nbytes: int
+    created: float
+    fetched: float  # cuándo se consultaron los datos (<= created si vienen de disco o de otra entrada)
+
+class ResultCache:
+    """
+    Caché en memoria de DataFrames con:
+      - TTL (segundos) por entrada.
+      - Presupuesto de memoria (bytes) con expulsión LRU.
+      - Contadores de aciertos/fallos e invalidación explícita.
+      - Nivel opcional en disco (Parquet/Feather) que sobrevive a reinicios.
+    Es seguro usarla desde hilos de trabajo.
+    """
+
+    def __init__(self, ttl_seconds=900, max_bytes=512 * 1024 * 1024,
+                 disk_dir=None, disk_format="parquet", disk_ttl_seconds=12 * 3600):
+        if disk_format not in ("parquet", "feather"):
+            raise ValueError(f"Formato de disco no soportado: {disk_format}")
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_format = disk_format
+        self.disk_ttl_seconds = disk_ttl_seconds
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    # ---------------------------- memoria ---------------------------------
+
+    def get(self, key):
+        """Devuelve el DataFrame cacheado (vigente) o None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry.created, self.ttl_seconds):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.df
+            if entry is not None:
+                self._drop(key)
+
+        loaded = self._disk_get(key)
+        with self._lock:
+            if loaded is not None:
+                df, fetched = loaded
+                self.disk_hits += 1
+                self._store(key, df, fetched)
+                return df
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """Devuelve el DataFrame en memoria aunque haya vencido su TTL (sin contar acierto)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.df if entry is not None else None
+
+    def put(self, key, df: pd.DataFrame, fetched=None):
+        """
+        Guarda el DataFrame (y su copia en disco si está habilitada).
+        fetched: time.time() de la consulta si los datos son anteriores
+        (p. ej., derivados de otra entrada); por defecto, ahora.
+        """
+        with self._lock:
+            self._store(key, df, fetched)
+        self._disk_put(key, df, fetched)
+
+    def fetched_at(self, key):
+        """time.time() en que se consultaron los datos de la entrada en memoria (o None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.fetched if entry is not None else None
+
+    def items(self):
+        """Pares (clave, DataFrame) vigentes en memoria, del más reciente al más antiguo."""
+        with self._lock:
+            return [(k, e.df) for k, e in reversed(self._entries.items())
+                    if not self._expired(e.created, self.ttl_seconds)]
+
+    def invalidate(self, predicate=None):
+        """
+        Elimina entradas (memoria y disco). Sin predicado, vacía la caché;
+        con predicado, elimina las claves para las que devuelva True.
+        """
+        with self._lock:
+            keys = [k for k in self._entries if predicate is None or predicate(k)]
+            for k in keys:
+                self._drop(k)
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            if predicate is None:
+                for name in os.listdir(self.disk_dir):
+                    if name.endswith(f".{self.disk_format}"):
+                        self._remove_file(os.path.join(self.disk_dir, name))
+            else:
+                for k in keys:
+                    self._remove_file(self._disk_path(k))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+            }
+
+    def _store(self, key, df, fetched=None):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if key in self._entries:
+            self._drop(key)
+        if nbytes > self.max_bytes:
+            logging.info("Resultado de %d bytes excede el presupuesto de caché; no se guarda.", nbytes)
+            return
+        now = time.time()
+        self._entries[key] = _Entry(df, nbytes, now, now if fetched is None else fetched)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    @staticmethod
+    def _expired(created, ttl):
+        return ttl is not None and (time.time() - created) > ttl
+
+    # ---------------------------- disco -----------------------------------
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(tuple(key)).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"cruce_{digest}.{self.disk_format}")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if not os.path.exists(path):
+                return None
+            # La fecha del archivo es la de la consulta (ver _disk_put)
+            fetched = os.path.getmtime(path)
+            if self._expired(fetched, self.disk_ttl_seconds):
+                return None
+            if self.disk_format == "parquet":
+                return pd.read_parquet(path), fetched
+            return pd.read_feather(path), fetched
+        except Exception as e:
+            logging.warning("No se pudo leer la caché en disco %s: %s", path, e)
+            return None
+
+    def _disk_put(self, key, df, fetched=None):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp = path + ".tmp"
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            out = df.reset_index(drop=True)
+            if self.disk_format == "parquet":
+                out.to_parquet(tmp, index=False)
+            else:
+                out.to_feather(tmp)
+            os.replace(tmp, path)
+            if fetched is not None:
+                os.utime(path, (fetched, fetched))
+        except Exception as e:
+            # Sin pyarrow u otro problema de E/S: la caché en memoria sigue funcionando
+            logging.warning("No se pudo escribir la caché en disco %s: %s", path, e)
+            self._remove_file(tmp)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,256 +1,762 @@
 # db/connection.py
+import logging
+import os
 import re
+import threading
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from typing import NamedTuple
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from tkinter import messagebox
 from urllib.parse import quote_plus
-from queries.query_cruce import get_query_cruce
+from queries.pushdown import Predicate, apply_pushdown, strip_markers
+from queries.query_cruce import REGION_SOURCES, STOCK_SOURCES, get_query_bodega_sum, get_query_cruce
+from db.cache import CacheKey, ResultCache
+from db.postprocess import AGGREGATION_MODES, finalize_cruce, recompute_totals
+from db.schema import apply_dtype_policy
+from db.instances import PREDEFINED_INSTANCES
+from db.local_schema import create_local_engine, to_sqlite_sql
+from utils import instrumentation
 
 # ----------------- Configuración de conexión -----------------
 DEFAULT_CONNECTION_STR = None
-
-PREDEFINED_INSTANCES = {
-    "Servidor DOS": {
-        "server_name": "SERVERDOS\\SERVERSQL_DOS",
-        "login": "sa",
-        "password": "j2094l,."
-    },
-    "Analista Local": {
-        "server_name": "DESKTOP-POHBVL8\\ANALISTA",
-        "login": "sa",
-        "password": "123456"
-    }
-}
-
-def set_default_instance(alias):
-    """Configura la cadena de conexión usando un alias predefinido."""
-    global DEFAULT_CONNECTION_STR
-    if alias not in PREDEFINED_INSTANCES:
-        raise ValueError(f"Alias '{alias}' no reconocido.")
+CURRENT_ALIAS = None
+
+# Opciones del pool (se aplican al crear cada engine del registro)
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+POOL_PRE_PING = False
+POOL_RECYCLE = -1
+
+# Dónde se calculan Cantidad_Inicial_Agrupada/Queda/Vendido: "pandas" (query
+# sin ventanas, una sola pasada en pandas) o "sql" (ventanas en el servidor)
+AGGREGATION_MODE = os.environ.get("ROTACION_AGGREGATION", "pandas")
+
+# Registrar memoria antes/después de compactar tipos (db.schema)
+DTYPE_REPORT = os.environ.get("ROTACION_DTYPE_REPORT", "0") == "1"
+
+def set_aggregation_mode(mode):
+    global AGGREGATION_MODE
+    if mode not in AGGREGATION_MODES:
+        raise ValueError(f"Modo de agregación no reconocido: {mode}")
+    AGGREGATION_MODE = mode
+
+# Existencias: "live" (agregado de tbHecInventario) o "snapshot" (foto
+# materializada, ver db.stock_snapshot); mapeo de regiones "inline" o "table"
+STOCK_SOURCE = os.environ.get("ROTACION_STOCK_SOURCE", "live")
+REGION_SOURCE = os.environ.get("ROTACION_REGION_SOURCE", "inline")
+
+# Predicados "sargables" (opt-in): los valores se normalizan en Python y el SQL
+# compara columnas sin envolverlas en LTRIM/RTRIM/LOWER/UPPER (permite index
+# seek). Solo es correcto si CodigoBarra/Referencia/CodigoRecibe están
+# guardados sin espacios al inicio y la intercalación es CI; con datos sucios
+# un filtro deja fuera filas, por eso la forma normalizada es la predeterminada.
+SARGABLE_PREDICATES = os.environ.get("ROTACION_SARGABLE", "0") == "1"
+
+# Modo diagnóstico (opt-in): las consultas de cruce que van al servidor se
+# leen con SET STATISTICS IO, TIME (y el plan real con ..._PLAN=1) y cada
+# corrida se guarda con sus filtros (ver db.diagnostics)
+DIAGNOSTICS_MODE = os.environ.get("ROTACION_DIAGNOSTICS", "0") == "1"
+DIAGNOSTICS_PLAN = os.environ.get("ROTACION_DIAGNOSTICS_PLAN", "0") == "1"
+
+def set_bodega_sources(stock_source=None, region_source=None):
+    global STOCK_SOURCE, REGION_SOURCE
+    if stock_source is not None:
+        if stock_source not in STOCK_SOURCES:
+            raise ValueError(f"Origen de existencias no reconocido: {stock_source}")
+        STOCK_SOURCE = stock_source
+    if region_source is not None:
+        if region_source not in REGION_SOURCES:
+            raise ValueError(f"Origen de regiones no reconocido: {region_source}")
+        REGION_SOURCE = region_source
+
+# Registro de engines: connection string -> Engine (un pool por instancia)
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+def _build_connection_str(alias):
     config = PREDEFINED_INSTANCES[alias]
+    if "local_dir" in config:
+        return "sqlite:///" + os.path.join(os.path.abspath(config["local_dir"]), "main.sqlite")
     password_enc = quote_plus(config['password'])
-    DEFAULT_CONNECTION_STR = (
+    return (
         f"mssql+pyodbc://{config['login']}:{password_enc}"
         f"@{config['server_name']}/BODEGA_DATOS?driver=SQL+Server"
     )
 
+def set_default_instance(alias):
+    """
+    Configura la cadena de conexión usando un alias predefinido.
+    Si el alias cambia, se libera el pool de la instancia anterior.
+    """
+    global DEFAULT_CONNECTION_STR, CURRENT_ALIAS
+    if alias not in PREDEFINED_INSTANCES:
+        raise ValueError(f"Alias '{alias}' no reconocido.")
+    new_str = _build_connection_str(alias)
+    if DEFAULT_CONNECTION_STR and DEFAULT_CONNECTION_STR != new_str:
+        dispose_engine(DEFAULT_CONNECTION_STR)
+    DEFAULT_CONNECTION_STR = new_str
+    CURRENT_ALIAS = alias
+
+def configure_pool(pool_size=None, max_overflow=None, pool_pre_ping=None, pool_recycle=None):
+    """
+    Ajusta las opciones del pool. Solo afecta a engines creados después;
+    llame a dispose_engine() para reconstruir uno ya existente.
+    """
+    global POOL_SIZE, MAX_OVERFLOW, POOL_PRE_PING, POOL_RECYCLE
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if max_overflow is not None:
+        MAX_OVERFLOW = max_overflow
+    if pool_pre_ping is not None:
+        POOL_PRE_PING = pool_pre_ping
+    if pool_recycle is not None:
+        POOL_RECYCLE = pool_recycle
+
+def _get_or_create_engine(connection_str):
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(connection_str)
+        if engine is None:
+            if connection_str.startswith("sqlite:///"):
+                # Backend local: adjunta una base SQLite por cada base del servidor
+                engine = create_local_engine(os.path.dirname(connection_str[len("sqlite:///"):]))
+            else:
+                kwargs = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE,
+                          "pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW}
+                engine = create_engine(connection_str, **kwargs)
+            _ENGINES[connection_str] = engine
+        return engine
+
 def get_db_connection(connection_str=None):
-    """Retorna una instancia de engine para la conexión a la base de datos."""
+    """
+    Retorna el engine de la instancia activa (o del connection string dado).
+    El engine se reutiliza entre importaciones: el pool y sus conexiones ODBC
+    ya abiertas sobreviven de un clic a otro.
+    """
     try:
         connection_str = connection_str or DEFAULT_CONNECTION_STR
         if not connection_str:
             raise ValueError("No se ha configurado el connection string.")
-        return create_engine(connection_str, pool_size=10, max_overflow=20)
+        with instrumentation.track("engine"):
+            return _get_or_create_engine(connection_str)
     except Exception as e:
         messagebox.showerror("Error de conexión", f"No se pudo crear el engine: {e}")
         return None
 
-# ----------------- Utilidades de SQL dinámico -----------------
-def ensure_final_where(query_base: str, final_alias: str = "Final2") -> str:
+def dispose_engine(connection_str=None):
+    """Cierra el pool de un connection string (o de la instancia activa) y lo saca del registro."""
+    connection_str = connection_str or DEFAULT_CONNECTION_STR
+    with _ENGINES_LOCK:
+        engine = _ENGINES.pop(connection_str, None)
+    if engine is not None:
+        engine.dispose()
+
+def dispose_all_engines():
+    """Cierra todos los pools registrados (p. ej., al cerrar la aplicación)."""
+    with _ENGINES_LOCK:
+        engines = list(_ENGINES.values())
+        _ENGINES.clear()
+    for engine in engines:
+        engine.dispose()
+
+def get_pool_stats(connection_str=None):
     """
-    Inserta (si hace falta) un WHERE 1=1 en el bloque que comienza en
-    'FROM <final_alias>' y antes de GROUP BY / ORDER BY / HAVING.
+    Estadísticas del pool de la instancia activa (o del connection string dado):
+    tamaño, conexiones en uso (checked out), libres y overflow actual.
+    Devuelve None si todavía no existe engine para esa cadena.
     """
-    m = re.search(rf"(FROM\s+{re.escape(final_alias)}\b.*)$",
-                  query_base, flags=re.IGNORECASE | re.DOTALL)
-    if not m:
-        return query_base.rstrip() + " WHERE 1=1 "
-
-    tail = m.group(1)
-    split = re.split(r"\b(GROUP\s+BY|ORDER\s+BY|HAVING)\b",
-                     tail, maxsplit=1, flags=re.IGNORECASE)
-    head = split[0]
-    rest = "" if len(split) == 1 else "".join(split[1:])
-
-    if re.search(r"\bWHERE\b", head, flags=re.IGNORECASE):
-        head = head.rstrip() + " "
-    else:
-        head = head.rstrip() + " WHERE 1=1 "
-
-    return query_base[:m.start()] + head + rest
+    connection_str = connection_str or DEFAULT_CONNECTION_STR
+    engine = _ENGINES.get(connection_str)
+    if engine is None:
+        return None
+    pool = engine.pool
+    stats = {"alias": CURRENT_ALIAS if connection_str == DEFAULT_CONNECTION_STR else None,
+             "status": pool.status()}
+    # QueuePool expone contadores; otros pools (p. ej., SQLite) no
+    for name in ("size", "checkedout", "checkedin", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            stats[name] = fn()
+    return stats
 
-def _add_excluir_codigorecibe_condition(conditions, params, excluir_codigorecibe, final_alias="Final2"):
-    """Agrega NOT IN parametrizado para Final2.CodigoRecibe."""
+# ----------------- Utilidades de SQL dinámico -----------------
+def _parse_excluir_codigorecibe(excluir_codigorecibe) -> list:
+    """Normaliza la lista 'A, b ,C' de CodigoRecibe a excluir -> ['A', 'B', 'C']."""
     if not excluir_codigorecibe:
-        return
-    codes = [c.strip().upper() for c in excluir_codigorecibe.split(",") if c.strip()]
-    if not codes:
-        return
-    placeholders = []
-    for i, c in enumerate(codes):
-        key = f"cr_exc_{i}"
-        placeholders.append(f":{key}")
-        params[key] = c
-    clause = f"UPPER(LTRIM(RTRIM({final_alias}.CodigoRecibe))) NOT IN ({', '.join(placeholders)})"
-    conditions.append(clause)
-
-def _inject_ref_filter(base_query: str, referencia_filter) -> tuple[str, dict]:
-    """
-    Reemplaza el marcador /*__REF_FILTER__*/ dentro de CreacionCTE.
-    - Si NO hay referencia (None o cadena vacía tras strip), elimina el marcador.
-    - Si hay, añade LIKE con :refLike. Si no trae %/_, se asume prefijo (se agrega %).
-    """
-    marker = "/*__REF_FILTER__*/"
-    params = {}
-    ref = (referencia_filter or "")
-    ref = ref.strip().lower()
+        return []
+    return [c.strip().upper() for c in excluir_codigorecibe.split(",") if c.strip()]
+
+def _normalize_ref_like(referencia_filter):
+    """
+    Valor para :refLike. None si no hay referencia (None o cadena vacía tras strip).
+    Si no trae %/_, se asume prefijo (se agrega %).
+    """
+    ref = (referencia_filter or "").strip().lower()
     if not ref:
-        return base_query.replace(marker, ""), params
+        return None
     if "%" not in ref and "_" not in ref:
         ref = ref + "%"
-    clause = " AND LOWER(LTRIM(RTRIM(I.Referencia))) LIKE :refLike"
-    params["refLike"] = ref
-    return base_query.replace(marker, clause), params
+    return ref
+
+# ----------------- Rango de fechas -----------------
+# Opciones del selector de la vista -> fecha de inicio
+FECHA_OPTIONS = {
+    1: date(2023, 1, 1),
+    2: date(2024, 1, 1),
+}
+
+def _to_date(value):
+    """Acepta date, datetime o 'YYYY-MM-DD' y devuelve date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip())
+
+def _resolve_fechas(fecha_option=2, fecha_start=None, fecha_end=None):
+    """
+    Devuelve (inicio, fin) como date. fecha_start tiene prioridad sobre
+    fecha_option; fecha_end es inclusivo y None significa "hasta ahora".
+    """
+    if fecha_start is not None:
+        start = _to_date(fecha_start)
+    else:
+        start = FECHA_OPTIONS.get(fecha_option, FECHA_OPTIONS[2])
+    end = _to_date(fecha_end) if fecha_end is not None else None
+    if end is not None and end < start:
+        raise ValueError(f"Rango de fechas inválido: {start} > {end}")
+    return start, end
 
-def _strip_unbound_ref_like(sql: str, params: dict) -> str:
+def _fecha_preamble(with_end: bool) -> str:
     """
-    Si quedó ':refLike' en el SQL pero no existe en params, elimina esa cláusula.
+    Declara @fechaStart/@fechaEnd con tipo explícito a partir de los
+    parámetros :fechaStart/:fechaEnd. El valor viaja como parámetro (no como
+    literal), así SQL Server reutiliza el mismo plan para cualquier rango,
+    y pyodbc no tiene que inferir el tipo dentro de los CTE (origen del HY000).
+    @fechaEnd es exclusivo: día siguiente al fin pedido, o GETDATE().
     """
-    if "refLike" in params:
-        return sql
-    pattern = re.compile(
-        r"\s+AND\s+LOWER\s*\(\s*LTRIM\s*\(\s*RTRIM\s*\(\s*I\.Referencia\s*\)\s*\)\s*\)\s*LIKE\s*:refLike",
-        flags=re.IGNORECASE
+    end_expr = "DATEADD(day, 1, CAST(:fechaEnd AS DATE))" if with_end else "GETDATE()"
+    return (
+        "SET NOCOUNT ON;\n"
+        "DECLARE @fechaStart DATETIME = CAST(CAST(:fechaStart AS DATE) AS DATETIME);\n"
+        f"DECLARE @fechaEnd DATETIME = {end_expr};\n"
     )
-    return re.sub(pattern, "", sql)
 
-def _build_full_sql_and_params(
-    fecha_option: int,
-    codigo_filter=None, referencia_filter=None,
-    categoria_filter=None, linea_filter=None, fabrica_filter=None,
-    excluir_codigorecibe=None, correccion_solo_01: bool = False
-):
+# ----------------- Plantillas de SQL por "forma" de filtros -----------------
+class _QueryShape(NamedTuple):
+    """Qué filtros están presentes (no sus valores): determina el texto del SQL."""
+    lean: bool
+    sargable: bool
+    stock_source: str
+    region_source: str
+    fecha_end: bool
+    codigo: bool
+    referencia: bool
+    categoria: bool
+    linea: bool
+    fabrica: bool
+    correccion_solo_01: bool
+    n_excluir: int
+    existencias: bool = True
+
+def _shape_predicates(shape: _QueryShape) -> list:
+    """Filtros presentes en la forma, como predicados sobre columnas de Final2."""
+    predicates = []
+    if shape.codigo:
+        predicates.append(Predicate("CodigoBarra", "{col} = :codigoFilter"))
+    if shape.referencia:
+        predicates.append(Predicate("Referencia", "{col} LIKE :refLike"))
+    if shape.fabrica:
+        predicates.append(Predicate("CodigoFabricante", "{col} = :fabricaFilter"))
+    if shape.categoria:
+        predicates.append(Predicate("CategoriaNombre", "{col} = :categoriaFilter"))
+    if shape.linea:
+        predicates.append(Predicate("Linea", "{col} = :lineaFilter"))
+    if shape.correccion_solo_01:
+        predicates.append(Predicate("correccion", "{col} = 0"))
+    if shape.n_excluir:
+        # Parametrizado: :cr_exc_0 .. :cr_exc_{n-1} (ya en mayúsculas y sin espacios)
+        placeholders = ", ".join(f":cr_exc_{i}" for i in range(shape.n_excluir))
+        predicates.append(Predicate("CodigoRecibe", f"{{col}} NOT IN ({placeholders})"))
+    return predicates
+
+@lru_cache(maxsize=64)
+def _render_cruce_sql(shape: _QueryShape) -> str:
     """
-    Arma el SQL final y el diccionario de parámetros.
-    - :fechaStart se sustituye por literal (evita HY000).
-    - La referencia se inyecta dentro de CreacionCTE.
-    - El resto de filtros se aplica en el bloque Final2.
+    Arma el texto SQL para una forma de filtros. Todo el trabajo de
+    reemplazos se hace una sola vez por forma.
+    - Las fechas llegan como parámetros y se declaran en el preámbulo.
+    - Cada filtro se ubica con queries.pushdown en el CTE más bajo posible:
+      atributos del código (código de barras, referencia, fábrica, categoría,
+      línea) en CreacionCTE, y el código de barras también en BodegaCTE; los
+      valores por fila agregada (correccion, CodigoRecibe) en FilteredFinal,
+      antes de las ventanas, así Cantidad_Inicial_Agrupada suma las mismas
+      filas que se devuelven.
     """
-    fecha_start = '2023-01-01' if fecha_option == 1 else '2024-01-01'
-    sql = get_query_cruce().strip().rstrip(';')
+    sql = get_query_cruce(
+        lean=shape.lean, region_source=shape.region_source,
+        stock_source=shape.stock_source, existencias=shape.existencias,
+    ).strip().rstrip(';')
+
+    sql = apply_pushdown(sql, _shape_predicates(shape), sargable=shape.sargable)
 
-    # Sustituir :fechaStart por literal
-    sql = sql.replace(":fechaStart", f"'{fecha_start}'")
+    if not re.search(r"\bORDER\s+BY\b", sql, flags=re.IGNORECASE):
+        sql += " ORDER BY Final2.FechaLlegada ASC"
+
+    return _fecha_preamble(shape.fecha_end) + sql
 
-    # Inyectar (o quitar) filtro de referencia
-    sql, ref_params = _inject_ref_filter(sql, referencia_filter)
-    sql = _strip_unbound_ref_like(sql, ref_params)
+def _dialect_sql(sql: str, dialect: str) -> str:
+    """El SQL de queries/ es T-SQL; para el backend local se traduce a SQLite."""
+    return to_sqlite_sql(sql) if dialect == "sqlite" else sql
 
-    # Asegurar WHERE 1=1 en el bloque Final2
-    sql = ensure_final_where(sql, "Final2")
+@lru_cache(maxsize=64)
+def _get_cruce_template(shape: _QueryShape, dialect: str = "mssql"):
+    """TextClause precompilado (y reutilizable) para una forma de filtros y un dialecto."""
+    return text(_dialect_sql(_render_cruce_sql(shape), dialect))
 
-    # Filtros finales
-    conditions = []
-    params: dict[str, object] = {}
+def _shape_and_params(
+    fecha_option: int = 2,
+    codigo_filter=None, referencia_filter=None,
+    categoria_filter=None, linea_filter=None, fabrica_filter=None,
+    excluir_codigorecibe=None, correccion_solo_01: bool = False,
+    fecha_start=None, fecha_end=None
+):
+    """Normaliza los filtros: devuelve la forma del query y los valores de sus parámetros."""
+    start, end = _resolve_fechas(fecha_option, fecha_start, fecha_end)
+    # Fechas como 'YYYY-MM-DD': formato independiente del idioma al castear a DATE
+    params: dict[str, object] = {"fechaStart": start.isoformat()}
+    if end is not None:
+        params["fechaEnd"] = end.isoformat()
 
     if codigo_filter:
-        conditions.append("Final2.CodigoBarra = :codigoFilter")
         params["codigoFilter"] = str(codigo_filter).strip()
     if categoria_filter:
-        conditions.append("Final2.CategoriaNombre = :categoriaFilter")
         params["categoriaFilter"] = str(categoria_filter).strip()
     if linea_filter:
-        conditions.append("Final2.Linea = :lineaFilter")
         params["lineaFilter"] = str(linea_filter).strip()
     if fabrica_filter:
-        conditions.append("Final2.CodigoFabricante = :fabricaFilter")
         params["fabricaFilter"] = str(fabrica_filter).strip()
-    if correccion_solo_01:
-        conditions.append("Final2.correccion = 0")
 
-    _add_excluir_codigorecibe_condition(conditions, params, excluir_codigorecibe, final_alias="Final2")
-
-    if conditions:
-        sql = sql + " AND " + " AND ".join(conditions)
+    codes = _parse_excluir_codigorecibe(excluir_codigorecibe)
+    for i, c in enumerate(codes):
+        params[f"cr_exc_{i}"] = c
+
+    ref_like = _normalize_ref_like(referencia_filter)
+    if ref_like is not None:
+        params["refLike"] = ref_like
+
+    shape = _QueryShape(
+        lean=AGGREGATION_MODE == "pandas",
+        sargable=SARGABLE_PREDICATES,
+        stock_source=STOCK_SOURCE,
+        region_source=REGION_SOURCE,
+        fecha_end=end is not None,
+        codigo=bool(codigo_filter),
+        referencia=ref_like is not None,
+        categoria=bool(categoria_filter),
+        linea=bool(linea_filter),
+        fabrica=bool(fabrica_filter),
+        correccion_solo_01=bool(correccion_solo_01),
+        n_excluir=len(codes),
+    )
+    return shape, params
 
-    if not re.search(r"\bORDER\s+BY\b", sql, flags=re.IGNORECASE):
-        sql += " ORDER BY Final2.FechaLlegada ASC"
+def _build_full_sql_and_params(
+    fecha_option: int,
+    codigo_filter=None, referencia_filter=None,
+    categoria_filter=None, linea_filter=None, fabrica_filter=None,
+    excluir_codigorecibe=None, correccion_solo_01: bool = False,
+    fecha_start=None, fecha_end=None
+):
+    """Arma el SQL final (texto, desde la caché de plantillas) y el diccionario de parámetros."""
+    shape, params = _shape_and_params(
+        fecha_option=fecha_option,
+        fecha_start=fecha_start,
+        fecha_end=fecha_end,
+        codigo_filter=codigo_filter,
+        referencia_filter=referencia_filter,
+        categoria_filter=categoria_filter,
+        linea_filter=linea_filter,
+        fabrica_filter=fabrica_filter,
+        excluir_codigorecibe=excluir_codigorecibe,
+        correccion_solo_01=correccion_solo_01,
+    )
+    return _render_cruce_sql(shape), params
 
-    params.update(ref_params)
-    return sql, params
+# ----------------- Lectura por lotes -----------------
+class QueryCancelled(Exception):
+    """La consulta fue cancelada por el usuario."""
 
-# ----------------- Post-proceso con PIVOT (pandas) -----------------
-def _recompute_with_pivot(df: pd.DataFrame) -> pd.DataFrame:
+class CancelToken:
     """
-    Recalcula:
-      - Cantidad_Inicial_Agrupada = suma de CantidadInicial por CodigoBarra
-        (pivot_table sobre el dataframe ya filtrado).
-      - Queda y Vendido a partir de ese total, con formato 'N2' y coma decimal.
+    Permite cancelar desde otro hilo una consulta en curso: marca la
+    cancelación y llama cursor.cancel() (SQLCancel en pyodbc) sobre el
+    cursor DBAPI activo, tanto durante el execute como durante el fetch.
     """
-    if df is None or df.empty:
-        return df.copy() if df is not None else df
-
-    df = df.copy()
-
-    # Asegurar tipos numéricos
-    for col in ["CantidadInicial", "ExistenciaActual"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
 
-    # --- PIVOT: suma por CodigoBarra ---
-    # (equivalente: df.groupby('CodigoBarra')['CantidadInicial'].sum())
-    pivot = pd.pivot_table(
-        df,
-        index="CodigoBarra",
-        values="CantidadInicial",
-        aggfunc="sum",
-        fill_value=0
-    ).reset_index().rename(columns={"CantidadInicial": "Cantidad_Inicial_Agrupada"})
-
-    # Quitar columna antigua si viene desde SQL y fusionar la nueva
-    df = df.drop(columns=["Cantidad_Inicial_Agrupada"], errors="ignore")
-    df = df.merge(pivot, on="CodigoBarra", how="left")
-
-    # --- Recalcular Queda/Vendido con el nuevo total ---
-    if "ExistenciaActual" in df.columns and "Cantidad_Inicial_Agrupada" in df.columns:
-        total = df["Cantidad_Inicial_Agrupada"].replace(0, pd.NA)
-        queda = (df["ExistenciaActual"] * 100.0 / total).fillna(0)
-        vendido = 100.0 - queda
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._cursor = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            cursor = self._cursor
+        if cursor is None:
+            return
+        try:
+            if hasattr(cursor, "cancel"):
+                cursor.cancel()
+            elif hasattr(getattr(cursor, "connection", None), "interrupt"):
+                # sqlite3 (backend local) no tiene cursor.cancel()
+                cursor.connection.interrupt()
+        except Exception as e:
+            logging.warning("No se pudo cancelar el cursor: %s", e)
+
+    def attach(self, cursor):
+        with self._lock:
+            self._cursor = cursor
+
+    def detach(self):
+        with self._lock:
+            self._cursor = None
+
+    def check(self):
+        if self.cancelled:
+            raise QueryCancelled("Consulta cancelada.")
+
+def _fetch_dataframe(engine, statement, params, chunksize=50000, progress=None, cancel_token=None):
+    """
+    Ejecuta el statement con cursor de servidor (stream_results) y lee por
+    lotes con fetchmany. Cada lote se vuelca en listas por columna y el
+    DataFrame se construye una sola vez a partir de esas columnas, sin
+    pasar por Row -> dict ni por DataFrames intermedios por chunk.
+    (Con pyodbc, si el dialecto no soporta cursores de servidor, el cursor
+    normal ya trae las filas del servidor a medida que se piden.)
+    - progress(filas, lotes) se llama tras cada lote.
+    - cancel_token (CancelToken) permite abortar desde otro hilo.
+    """
+    if cancel_token is not None:
+        cancel_token.check()
+
+    def _track_cursor(conn, cursor, *args):
+        cancel_token.attach(cursor)
+
+    rows = chunks = 0
+    with instrumentation.track("conexion"):
+        conn = engine.connect()
+    with conn:
+        if cancel_token is not None:
+            event.listen(conn, "before_cursor_execute", _track_cursor)
+        try:
+            with instrumentation.track("consulta"):
+                result = conn.execution_options(stream_results=True).execute(statement, params)
+            columns = list(result.keys())
+            buffers = [[] for _ in columns]
+            with instrumentation.track("lectura") as st:
+                while True:
+                    if cancel_token is not None:
+                        cancel_token.check()
+                    batch = result.fetchmany(chunksize)
+                    if not batch:
+                        break
+                    for buf, values in zip(buffers, zip(*batch)):
+                        buf.extend(values)
+                    rows += len(batch)
+                    chunks += 1
+                    if progress is not None:
+                        progress(rows, chunks)
+                st.set(rows=rows, lotes=chunks)
+        except QueryCancelled:
+            raise
+        except Exception as e:
+            # El driver suele responder al SQLCancel con un error (HY008)
+            if cancel_token is not None and cancel_token.cancelled:
+                raise QueryCancelled("Consulta cancelada.") from e
+            raise
+        finally:
+            if cancel_token is not None:
+                cancel_token.detach()
+                event.remove(conn, "before_cursor_execute", _track_cursor)
+
+    with instrumentation.track("dataframe") as st:
+        df = pd.DataFrame(dict(zip(columns, buffers)), columns=columns)
+        del buffers
+        st.set(rows=len(df))
+    return df
 
-        def fmt_pct(series: pd.Series) -> pd.Series:
-            # Formato 'N2' con coma decimal (p. ej., 33,33%)
-            return series.round(2).astype(float).map(lambda v: f"{v:.2f}".replace(".", ",") + "%")
+# ----------------- Caché de resultados -----------------
+# TTL/presupuesto ajustables con configure_cruce_cache; el nivel en disco
+# se habilita con ROTACION_CACHE_DIR (o configure_cruce_cache(disk_dir=...)).
+CRUCE_CACHE = ResultCache(
+    ttl_seconds=900,
+    max_bytes=512 * 1024 * 1024,
+    disk_dir=os.environ.get("ROTACION_CACHE_DIR") or None,
+)
+
+def configure_cruce_cache(ttl_seconds=None, max_bytes=None, disk_dir=None, disk_format=None):
+    """Ajusta TTL, presupuesto de memoria y nivel en disco de la caché de cruce."""
+    if ttl_seconds is not None:
+        CRUCE_CACHE.ttl_seconds = ttl_seconds
+    if max_bytes is not None:
+        CRUCE_CACHE.max_bytes = max_bytes
+    if disk_dir is not None:
+        CRUCE_CACHE.disk_dir = disk_dir or None
+    if disk_format is not None:
+        CRUCE_CACHE.disk_format = disk_format
+
+def invalidate_cruce_cache(alias=None):
+    """Invalida los resultados cacheados (todos, o solo los de un alias/instancia)."""
+    if alias is None:
+        CRUCE_CACHE.invalidate()
+    else:
+        CRUCE_CACHE.invalidate(lambda key: key.instance == alias)
+
+def get_cache_stats():
+    """Aciertos, fallos, expulsiones y memoria usada por la caché de cruce."""
+    return CRUCE_CACHE.stats()
+
+def _instance_key(engine) -> str:
+    """Alias de la instancia si el engine es el activo; si no, su URL (sin contraseña)."""
+    if DEFAULT_CONNECTION_STR and _ENGINES.get(DEFAULT_CONNECTION_STR) is engine:
+        return CURRENT_ALIAS
+    return engine.url.render_as_string(hide_password=True)
+
+def _cache_key(engine, shape, params) -> CacheKey:
+    filters = tuple(sorted((k, v) for k, v in params.items() if k not in ("fechaStart", "fechaEnd")))
+    filters += (("correccion_solo_01", shape.correccion_solo_01), ("stock_source", shape.stock_source),
+                ("region_source", shape.region_source), ("sargable", shape.sargable),
+                ("aggregation", "pandas" if shape.lean else "sql"))
+    return CacheKey(
+        instance=_instance_key(engine),
+        fecha_start=params["fechaStart"],
+        fecha_end=params.get("fechaEnd"),
+        filters=filters,
+    )
 
-        df["Queda"] = fmt_pct(queda)
-        df["Vendido"] = fmt_pct(vendido)
+def _age(fetched):
+    """Segundos desde fetched (time.time()), o None si la entrada ya no está."""
+    return None if fetched is None else max(0.0, time.time() - fetched)
 
+def _narrow_from_cache(key: CacheKey):
+    """
+    Busca en caché un resultado con la misma instancia, filtros y fin de rango
+    pero con inicio anterior, y deriva el rango pedido filtrando FechaLlegada.
+    FinalCTE agrupa por (CodigoBarra, FechaLlegada), así que cada fila con
+    FechaLlegada >= inicio es idéntica en ambos rangos; lo único que depende
+    del rango (Cantidad_Inicial_Agrupada, Queda, Vendido) se recalcula con
+    recompute_totals, igual que tras una consulta nueva.
+    Devuelve (DataFrame, momento de la consulta original) o None.
+    """
+    for cached_key, cached_df in CRUCE_CACHE.items():
+        if (cached_key.instance != key.instance or cached_key.filters != key.filters
+                or cached_key.fecha_end != key.fecha_end
+                or cached_key.fecha_start >= key.fecha_start):
+            continue
+        if cached_df.empty or "FechaLlegada" not in cached_df.columns:
+            continue
+        fechas = pd.to_datetime(cached_df["FechaLlegada"])
+        subset = cached_df[fechas >= pd.Timestamp(key.fecha_start)].reset_index(drop=True)
+        return apply_dtype_policy(recompute_totals(subset)), CRUCE_CACHE.fetched_at(cached_key)
+    return None
+
+def verify_narrowed_range(engine, **filters) -> bool:
+    """
+    Diagnóstico: compara el resultado derivado de caché con una consulta nueva
+    para los mismos filtros. Ignora el orden entre filas de una misma fecha
+    (el ORDER BY del query solo fija FechaLlegada). Lanza AssertionError si difieren.
+    """
+    shape, params = _shape_and_params(**filters)
+    found = _narrow_from_cache(_cache_key(engine, shape, params))
+    if found is None:
+        raise ValueError("No hay en caché un rango más amplio para estos filtros.")
+    narrowed, _ = found
+    fresh = _fetch_dataframe(engine, _get_cruce_template(shape, engine.dialect.name), params)
+    # Mismo post-proceso y tipos que una importación (categorías, datetime64)
+    fresh = apply_dtype_policy(finalize_cruce(fresh, "pandas" if shape.lean else "sql"))
+
+    def _canonical(df):
+        return df.sort_values(["FechaLlegada", "CodigoBarra"], kind="mergesort").reset_index(drop=True)
+
+    # El rango derivado conserva las categorías del rango amplio: se comparan valores
+    pd.testing.assert_frame_equal(_canonical(narrowed), _canonical(fresh), check_dtype=False,
+                                  check_categorical=False)
+    return True
+
+# ----------------- Refresco incremental -----------------
+# Marca de agua por clave de caché: última FechaLlegada importada (date)
+_WATERMARKS = {}
+
+def _compute_watermark(df: pd.DataFrame):
+    if df is None or df.empty or "FechaLlegada" not in df.columns:
+        return None
+    return pd.to_datetime(df["FechaLlegada"]).max().date()
+
+def get_watermark(engine, **filters):
+    """Marca de agua de la última importación para esos filtros (o None)."""
+    shape, params = _shape_and_params(**filters)
+    return _WATERMARKS.get(_cache_key(engine, shape, params))
+
+@lru_cache(maxsize=8)
+def _get_bodega_sum_template(region_source="inline", stock_source="live", dialect="mssql"):
+    sql = strip_markers(get_query_bodega_sum(region_source, stock_source)).strip().rstrip(';')
+    return text(_dialect_sql(sql, dialect))
+
+def _fetch_existencias(engine, cancel_token=None) -> pd.Series:
+    """Foto fresca de BodegaSum: ExistenciaActual indexada por código de barras limpio."""
+    snap = _fetch_dataframe(engine, _get_bodega_sum_template(REGION_SOURCE, STOCK_SOURCE, engine.dialect.name), {},
+                            cancel_token=cancel_token)
+    if snap.empty:
+        return pd.Series(dtype="float64")
+    snap["CodigoBarra"] = snap["CodigoBarra"].astype(str).str.strip()
+    return pd.to_numeric(snap.set_index("CodigoBarra")["ExistenciaActual"], errors="coerce").fillna(0)
+
+def _recompute_for_barcodes(df: pd.DataFrame, barcodes) -> pd.DataFrame:
+    """Recalcula Cantidad_Inicial_Agrupada/Queda/Vendido solo para los códigos dados."""
+    mask = df["CodigoBarra"].isin(barcodes)
+    if not mask.any():
+        return df
+    part = recompute_totals(df.loc[mask].copy())
+    for col in ("Cantidad_Inicial_Agrupada", "Queda", "Vendido"):
+        if col in part.columns:
+            df.loc[mask, col] = part[col].to_numpy()
     return df
 
+def refresh_cruce_incremental(engine, chunksize=50000, progress=None, cancel_token=None, **filters):
+    """
+    Refresca el resultado cacheado trayendo solo lo nuevo desde la marca de agua:
+      1) Re-consulta únicamente los días >= última FechaLlegada importada, con
+         el query sin BodegaCTE/BodegaSum (existencias=False). FinalCTE agrupa
+         por día, así que ese día se reemplaza completo: no quedan sumas
+         parciales y entran las transferencias tardías del mismo día.
+      2) Toma una sola foto de BodegaSum para la ExistenciaActual de todas
+         las filas (las del delta y las ya cacheadas).
+      3) Une por (CodigoBarra, FechaLlegada) y recalcula Cantidad_Inicial_Agrupada,
+         Queda y Vendido solo para los códigos afectados.
+    Sin resultado previo en caché (o con fecha_end fija) hace una importación normal.
+    progress(filas, lotes) informa la lectura del delta; cancel_token (CancelToken)
+    cancela cualquiera de las dos consultas.
+    """
+    shape, params = _shape_and_params(**filters)
+    key = _cache_key(engine, shape, params)
+    cached = CRUCE_CACHE.peek(key)
+    watermark = _WATERMARKS.get(key) or _compute_watermark(cached)
+    if filters.get("fecha_end") is not None or cached is None or watermark is None:
+        return get_cruce_data_df(engine, chunksize=chunksize, use_cache=False,
+                                 progress=progress, cancel_token=cancel_token, **filters)
+
+    # 1) Delta desde el día de la marca de agua (mismos filtros, sin existencias)
+    delta_shape, delta_params = _shape_and_params(**dict(filters, fecha_start=watermark))
+    delta_shape = delta_shape._replace(lean=True, existencias=False)
+    delta = _fetch_dataframe(engine, _get_cruce_template(delta_shape, engine.dialect.name), delta_params,
+                             chunksize=chunksize, progress=progress, cancel_token=cancel_token)
+
+    fechas = pd.to_datetime(cached["FechaLlegada"])
+    base = cached[fechas < pd.Timestamp(watermark)]
+    if not delta.empty:
+        # Mismos tipos que la base cacheada (FechaLlegada datetime64, enteros
+        # compactos); si no, el concat mezcla Timestamp con date/str
+        delta = apply_dtype_policy(delta.reindex(columns=cached.columns))
+    df = pd.concat([base, delta], ignore_index=True) if not delta.empty else base.reset_index(drop=True)
+
+    # 2) Existencias actuales (una sola foto) para todos los códigos
+    affected = set(delta["CodigoBarra"]) if not delta.empty else set()
+    if not df.empty:
+        existencias = _fetch_existencias(engine, cancel_token)
+        clean = df["CodigoBarra"].astype(str).str.strip()
+        nueva = clean.map(existencias).fillna(0)
+        actual = pd.to_numeric(df["ExistenciaActual"], errors="coerce").fillna(0)
+        cambiados = nueva.to_numpy() != actual.to_numpy()
+        affected.update(df.loc[cambiados, "CodigoBarra"])
+        df["ExistenciaActual"] = nueva.to_numpy()
+
+        # 3) Recalcular solo los códigos afectados
+        df = _recompute_for_barcodes(df, affected)
+        df = df.sort_values("FechaLlegada", kind="mergesort").reset_index(drop=True)
+        # concat de categorías distintas vuelve a object: recompactar
+        df = apply_dtype_policy(df)
+
+    CRUCE_CACHE.put(key, df)
+    _WATERMARKS[key] = _compute_watermark(df) or watermark
+    return df.copy()
+
 # ----------------- API públicas -----------------
 def get_cruce_data(
     engine,
     codigo_filter=None, referencia_filter=None,
     categoria_filter=None, linea_filter=None, fabrica_filter=None,
-    fecha_option=2, excluir_codigorecibe=None, correccion_solo_01: bool = False
+    fecha_option=2, excluir_codigorecibe=None, correccion_solo_01: bool = False,
+    fecha_start=None, fecha_end=None
 ):
-    """Ejecuta el query con filtros y devuelve lista de dicts (post-procesado con pivot)."""
-    full_sql, params = _build_full_sql_and_params(
-        fecha_option=fecha_option,
+    """
+    Ejecuta el query con filtros y devuelve lista de dicts (post-procesado).
+    fecha_start/fecha_end (date o 'YYYY-MM-DD', fin inclusivo) sustituyen a fecha_option.
+    Para conjuntos grandes use get_cruce_data_df, que evita la conversión a registros.
+    """
+    df = get_cruce_data_df(
+        engine,
         codigo_filter=codigo_filter,
         referencia_filter=referencia_filter,
         categoria_filter=categoria_filter,
         linea_filter=linea_filter,
         fabrica_filter=fabrica_filter,
+        fecha_option=fecha_option,
         excluir_codigorecibe=excluir_codigorecibe,
         correccion_solo_01=correccion_solo_01,
+        fecha_start=fecha_start,
+        fecha_end=fecha_end,
     )
-    with engine.connect() as conn:
-        rows = conn.execute(text(full_sql), params).fetchall()
-
-    df = pd.DataFrame([dict(r._mapping) for r in rows])
-    df = _recompute_with_pivot(df)
     return df.to_dict(orient="records")
 
+# ----------------- Diagnóstico en el servidor -----------------
+def _fetch_with_diagnostics(engine, shape, params, filters, plan=False, **fetch_kwargs):
+    """Lee el cruce con estadísticas del servidor y guarda el reporte junto con los filtros."""
+    from db.diagnostics import fetch_with_statistics, store_report
+    df, report = fetch_with_statistics(engine, _get_cruce_template(shape, engine.dialect.name), params,
+                                       plan=plan, **fetch_kwargs)
+    store_report(report, filters, instance=_instance_key(engine), shape=shape)
+    return df, report
+
+def diagnose_cruce(engine, plan=False, **filters):
+    """
+    Ejecuta el cruce (sin caché) con SET STATISTICS IO, TIME y, con plan=True,
+    el plan real; guarda y devuelve el reporte (lecturas lógicas por tabla y
+    por CTE, CPU y tiempo transcurrido en el servidor).
+    """
+    shape, params = _shape_and_params(**filters)
+    _, report = _fetch_with_diagnostics(engine, shape, params, filters, plan)
+    return report
+
 def get_cruce_data_df(
     engine,
     codigo_filter=None, referencia_filter=None,
     categoria_filter=None, linea_filter=None, fabrica_filter=None,
     fecha_option=2, chunksize=50000, excluir_codigorecibe=None,
-    correccion_solo_01: bool = False
+    correccion_solo_01: bool = False, fecha_start=None, fecha_end=None,
+    use_cache: bool = True, progress=None, cancel_token=None, cache_info=None
 ):
-    """Devuelve DataFrame con los mismos filtros (post-procesado con pivot)."""
-    full_sql, params = _build_full_sql_and_params(
+    """
+    Devuelve DataFrame con los mismos filtros, leído por lotes y post-procesado
+    en una sola pasada según AGGREGATION_MODE.
+    Con use_cache, reutiliza un resultado vigente para la misma instancia,
+    rango y filtros (ver CRUCE_CACHE), o lo deriva sin consultar de un rango
+    cacheado más amplio (p. ej., 2024 a partir de 2023); con use_cache=False
+    siempre consulta y refresca la caché.
+    progress(filas, lotes) y cancel_token se pasan a la lectura por lotes.
+    cache_info (dict, opcional) se completa con hit ("exacto", "rango" o None)
+    y age_s (segundos desde la consulta de los datos devueltos; None si no se sabe).
+    """
+    shape, params = _shape_and_params(
         fecha_option=fecha_option,
+        fecha_start=fecha_start,
+        fecha_end=fecha_end,
         codigo_filter=codigo_filter,
         referencia_filter=referencia_filter,
         categoria_filter=categoria_filter,
@@ -259,6 +765,44 @@ def get_cruce_data_df(
         excluir_codigorecibe=excluir_codigorecibe,
         correccion_solo_01=correccion_solo_01,
     )
-    df_iter = pd.read_sql(text(full_sql), con=engine, params=params, chunksize=chunksize)
-    df = pd.concat(df_iter, ignore_index=True)
-    return _recompute_with_pivot(df)
+    key = _cache_key(engine, shape, params)
+    if cache_info is None:
+        cache_info = {}
+    cache_info.update(hit=None, age_s=0.0)
+    if use_cache:
+        with instrumentation.track("cache") as st:
+            cached = CRUCE_CACHE.get(key)
+            if cached is not None:
+                st.set(hit="exacto", rows=len(cached))
+                cache_info.update(hit="exacto", age_s=_age(CRUCE_CACHE.fetched_at(key)))
+                return cached.copy()
+            found = _narrow_from_cache(key)
+            if found is not None:
+                narrowed, fetched = found
+                st.set(hit="rango", rows=len(narrowed))
+                CRUCE_CACHE.put(key, narrowed, fetched=fetched)
+                cache_info.update(hit="rango", age_s=_age(fetched))
+                return narrowed.copy()
+            st.set(hit=None)
+
+    if DIAGNOSTICS_MODE:
+        filters = dict(
+            fecha_option=fecha_option, fecha_start=fecha_start, fecha_end=fecha_end,
+            codigo_filter=codigo_filter, referencia_filter=referencia_filter,
+            categoria_filter=categoria_filter, linea_filter=linea_filter, fabrica_filter=fabrica_filter,
+            excluir_codigorecibe=excluir_codigorecibe, correccion_solo_01=correccion_solo_01,
+        )
+        df, _ = _fetch_with_diagnostics(engine, shape, params, filters, DIAGNOSTICS_PLAN, chunksize=chunksize,
+                                        progress=progress, cancel_token=cancel_token)
+    else:
+        df = _fetch_dataframe(engine, _get_cruce_template(shape, engine.dialect.name), params, chunksize=chunksize,
+                              progress=progress, cancel_token=cancel_token)
+    with instrumentation.track("postproceso", rows=len(df)) as st:
+        df = finalize_cruce(df, "pandas" if shape.lean else "sql")
+        df = apply_dtype_policy(df, report=DTYPE_REPORT)
+        if instrumentation.ENABLED:
+            # memory_usage(deep=True) recorre los textos: solo si se está midiendo
+            st.set(bytes=int(df.memory_usage(deep=True).sum()))
+    CRUCE_CACHE.put(key, df)
+    _WATERMARKS[key] = _compute_watermark(df)
+    return df.copy()
@@ -0,0 +1,315 @@
+# db/diagnostics.py
+import argparse
+import json
+import logging
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import pandas as pd
+
+from db.connection import QueryCancelled
+
+# Diagnóstico del query de cruce: lecturas lógicas por tabla y CPU/tiempo
+# del servidor (SET STATISTICS IO, TIME) y, opcionalmente, el plan real
+# (SET STATISTICS XML). Cada corrida se guarda con los filtros que la
+# produjeron para comparar CTEs entre combinaciones de filtros y en el tiempo.
+DIAG_DIR = os.environ.get("ROTACION_DIAG_DIR", "diagnosticos")
+REPORTS_FILE = "diagnostico_cruce.jsonl"
+
+# Tabla -> CTE del query de cruce donde se lee (ver queries/query_cruce.py).
+# Worktable/Workfile son los temporales de GROUP BY/ventanas de FinalCTE y Final2.
+TABLE_CTE = {
+    "tbDimInventario": "BodegaCTE",
+    "tbHecInventario": "BodegaCTE",
+    "tbDimTiendas": "BodegaCTE",
+    "tbRegionTienda": "BodegaCTE",
+    "tbExistenciaCodigoBarra": "BodegaSum",
+    "MOVTRANSFERENCIAS": "CreacionCTE",
+    "INVENTARIO": "CreacionCTE",
+    "CATEGORIAS": "CreacionCTE",
+    "MARCAS": "CreacionCTE",
+    "TRANSFERENCIAS": "CreacionCTE",
+    "FABRICANTES": "CreacionCTE",
+    "Worktable": "FinalCTE",
+    "Workfile": "FinalCTE",
+}
+
+_SHOWPLAN_NS = {"s": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+# ----------------- Parsers -----------------
+_TABLE_IO = re.compile(
+    r"Table '(?P<table>[^']+)'\. Scan count (?P<scans>\d+), logical reads (?P<logical>\d+), "
+    r"physical reads (?P<physical>\d+)(?:[^\n]*?read-ahead reads (?P<read_ahead>\d+))?",
+    re.IGNORECASE,
+)
+_TIMES = re.compile(
+    r"SQL Server (?P<kind>Execution Times|parse and compile time):\s*"
+    r"CPU time = (?P<cpu>\d+) ms,\s*elapsed time = (?P<elapsed>\d+) ms",
+    re.IGNORECASE,
+)
+
+def parse_statistics(messages) -> dict:
+    """
+    Interpreta los mensajes de SET STATISTICS IO, TIME (texto de SSMS o los
+    mensajes del driver, con o sin el prefijo '[Microsoft][ODBC ...]').
+    Lecturas por tabla sumadas entre sentencias; tiempos sumados por tipo.
+    """
+    text = "\n".join(m[1] if isinstance(m, tuple) else str(m) for m in messages)
+    tables = {}
+    for m in _TABLE_IO.finditer(text):
+        table = m.group("table").strip("[]")
+        # Worktable/Workfile no llevan esquema; las demás sí pueden traerlo ('dbo.X')
+        table = table.rsplit(".", 1)[-1]
+        entry = tables.setdefault(table, {"scans": 0, "logical_reads": 0, "physical_reads": 0, "read_ahead_reads": 0})
+        entry["scans"] += int(m.group("scans"))
+        entry["logical_reads"] += int(m.group("logical"))
+        entry["physical_reads"] += int(m.group("physical"))
+        entry["read_ahead_reads"] += int(m.group("read_ahead") or 0)
+
+    times = {"cpu_ms": 0, "elapsed_ms": 0, "compile_cpu_ms": 0, "compile_elapsed_ms": 0}
+    for m in _TIMES.finditer(text):
+        prefix = "compile_" if m.group("kind").lower().startswith("parse") else ""
+        times[f"{prefix}cpu_ms"] += int(m.group("cpu"))
+        times[f"{prefix}elapsed_ms"] += int(m.group("elapsed"))
+    return {"tables": tables, **times}
+
+def parse_plan(plan_xml: str) -> dict:
+    """
+    Del plan real (showplan XML) extrae lecturas lógicas por tabla
+    (ActualLogicalReads de cada operador, sumadas entre hilos), filas reales
+    por tabla y el costo estimado de la sentencia principal.
+    """
+    root = ET.fromstring(plan_xml)
+    tables = {}
+    for relop in root.iter(f"{{{_SHOWPLAN_NS['s']}}}RelOp"):
+        runtime = relop.find("s:RunTimeInformation", _SHOWPLAN_NS)
+        obj = None
+        for child in relop:
+            obj = child.find("s:Object", _SHOWPLAN_NS)
+            if obj is not None:
+                break
+        if runtime is None or obj is None or not obj.get("Table"):
+            continue
+        table = obj.get("Table").strip("[]")
+        entry = tables.setdefault(table, {"logical_reads": 0, "actual_rows": 0, "operators": []})
+        for counters in runtime.findall("s:RunTimeCountersPerThread", _SHOWPLAN_NS):
+            entry["logical_reads"] += int(counters.get("ActualLogicalReads", 0))
+            entry["actual_rows"] += int(counters.get("ActualRows", 0))
+        if relop.get("PhysicalOp") not in entry["operators"]:
+            entry["operators"].append(relop.get("PhysicalOp"))
+
+    costs = [float(s.get("StatementSubTreeCost", 0)) for s in root.iter(f"{{{_SHOWPLAN_NS['s']}}}StmtSimple")]
+    return {"tables": tables, "statement_cost": max(costs, default=0.0)}
+
+def reads_by_cte(tables: dict) -> dict:
+    """Lecturas lógicas agrupadas por CTE (tablas fuera del mapeo quedan como 'otras')."""
+    ctes = {}
+    for table, entry in tables.items():
+        cte = TABLE_CTE.get(table, "otras")
+        ctes[cte] = ctes.get(cte, 0) + entry["logical_reads"]
+    return dict(sorted(ctes.items(), key=lambda kv: -kv[1]))
+
+# ----------------- Captura -----------------
+def _driver_sql(engine, statement, params):
+    """SQL y parámetros posicionales tal como los envía SQLAlchemy al driver."""
+    compiled = statement.compile(dialect=engine.dialect)
+    values = compiled.construct_params(params)
+    positional = [values[name] for name in compiled.positiontup or ()]
+    return compiled.string, positional
+
+def _messages(cursor) -> list:
+    # pyodbc >= 4.0.31 expone los mensajes informativos; sqlite3 no
+    return list(getattr(cursor, "messages", None) or [])
+
+def fetch_with_statistics(engine, statement, params, chunksize=50000, progress=None,
+                          cancel_token=None, plan=False):
+    """
+    Igual que la lectura por lotes de db.connection, pero en una conexión
+    con SET STATISTICS IO, TIME (y XML si plan=True) activado; devuelve
+    (DataFrame, reporte). Las opciones se desactivan antes de devolver la
+    conexión al pool. En SQLite solo se registra el tiempo del cliente.
+    """
+    is_mssql = engine.dialect.name == "mssql"
+    sql, positional = _driver_sql(engine, statement, params)
+    messages, plan_xml = [], None
+    t0 = time.perf_counter()
+
+    raw = engine.raw_connection()
+    cursor = raw.cursor()
+    try:
+        if is_mssql:
+            cursor.execute("SET STATISTICS IO ON; SET STATISTICS TIME ON;" + (" SET STATISTICS XML ON;" if plan else ""))
+        if cancel_token is not None:
+            cancel_token.check()
+            cancel_token.attach(cursor)
+        cursor.execute(sql, positional)
+        messages += _messages(cursor)
+        # Las sentencias del preámbulo (SET NOCOUNT/DECLARE) no devuelven filas
+        while cursor.description is None and cursor.nextset():
+            messages += _messages(cursor)
+
+        columns = [d[0] for d in cursor.description]
+        buffers = [[] for _ in columns]
+        rows = chunks = 0
+        while True:
+            if cancel_token is not None:
+                cancel_token.check()
+            batch = cursor.fetchmany(chunksize)
+            if not batch:
+                break
+            for buf, values in zip(buffers, zip(*batch)):
+                buf.extend(values)
+            rows += len(batch)
+            chunks += 1
+            if progress is not None:
+                progress(rows, chunks)
+        fetched = time.perf_counter() - t0
+
+        # STATISTICS IO/TIME de la sentencia llegan al pasar al siguiente conjunto;
+        # el plan real es un conjunto más con una sola celda XML
+        while is_mssql and cursor.nextset():
+            messages += _messages(cursor)
+            if plan and cursor.description:
+                row = cursor.fetchone()
+                if row and isinstance(row[0], str) and row[0].lstrip().startswith("<ShowPlanXML"):
+                    plan_xml = row[0]
+    except QueryCancelled:
+        raise
+    except Exception as e:
+        if cancel_token is not None and cancel_token.cancelled:
+            raise QueryCancelled("Consulta cancelada.") from e
+        raise
+    finally:
+        if cancel_token is not None:
+            cancel_token.detach()
+        try:
+            if is_mssql:
+                cursor.execute("SET STATISTICS IO OFF; SET STATISTICS TIME OFF; SET STATISTICS XML OFF;")
+        finally:
+            cursor.close()
+            raw.close()
+
+    df = pd.DataFrame(dict(zip(columns, buffers)), columns=columns)
+    report = parse_statistics(messages)
+    report.update(rows=rows, client_seconds=round(fetched, 3), dialect=engine.dialect.name)
+    if plan_xml is not None:
+        report["plan"] = parse_plan(plan_xml)
+        report["plan_xml"] = plan_xml
+    report["ctes"] = reads_by_cte(report["tables"])
+    return df, report
+
+# ----------------- Almacenamiento -----------------
+def store_report(report: dict, filters: dict, instance=None, shape=None, directory=None) -> str:
+    """
+    Agrega el reporte (con sus filtros, instancia y forma del query) a
+    <directorio>/diagnostico_cruce.jsonl; el plan XML, si hay, va a un
+    .sqlplan aparte (se abre en SSMS). Devuelve la ruta del .jsonl.
+    """
+    directory = directory or DIAG_DIR
+    os.makedirs(directory, exist_ok=True)
+    ts = datetime.now()
+    entry = {
+        "ts": ts.isoformat(timespec="seconds"),
+        "instance": instance,
+        "filters": {k: v for k, v in filters.items() if v not in (None, "", False)},
+        "shape": shape._asdict() if hasattr(shape, "_asdict") else shape,
+        **{k: v for k, v in report.items() if k != "plan_xml"},
+    }
+    if report.get("plan_xml"):
+        plan_file = os.path.join(directory, f"plan_{ts:%Y%m%d_%H%M%S}.sqlplan")
+        with open(plan_file, "w", encoding="utf-8") as f:
+            f.write(report["plan_xml"])
+        entry["plan_file"] = plan_file
+
+    path = os.path.join(directory, REPORTS_FILE)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, default=str, ensure_ascii=False) + "\n")
+    logging.info("Diagnóstico de cruce: %s lecturas lógicas por CTE, CPU %s ms, %s ms transcurridos.",
+                 entry["ctes"], entry["cpu_ms"], entry["elapsed_ms"])
+    return path
+
+def load_reports(directory=None) -> pd.DataFrame:
+    """
+    Reportes guardados, una fila por corrida: fecha, filtros (como texto),
+    CPU/tiempo y una columna de lecturas lógicas por CTE.
+    """
+    path = os.path.join(directory or DIAG_DIR, REPORTS_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            row = {
+                "ts": pd.Timestamp(entry["ts"]),
+                "instance": entry.get("instance"),
+                # Combinación de filtros (sin el rango de fechas, común a todas)
+                "filters": ", ".join(sorted(k for k in entry.get("filters", {}) if not k.startswith("fecha"))) or "(sin filtros)",
+                "rows": entry.get("rows"),
+                "cpu_ms": entry.get("cpu_ms"),
+                "elapsed_ms": entry.get("elapsed_ms"),
+            }
+            row.update({f"reads_{cte}": reads for cte, reads in entry.get("ctes", {}).items()})
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+def dominant_cte_by_filters(directory=None) -> pd.DataFrame:
+    """Promedio de lecturas por CTE para cada combinación de filtros y la CTE que domina."""
+    df = load_reports(directory)
+    if df.empty:
+        return df
+    reads = [c for c in df.columns if c.startswith("reads_")]
+    summary = df.groupby("filters")[reads + ["cpu_ms", "elapsed_ms"]].mean().round(0)
+    summary["corridas"] = df.groupby("filters").size()
+    if reads:
+        filled = summary[reads].fillna(0)
+        # Corridas sin estadísticas del servidor (p. ej., SQLite) no tienen CTE dominante
+        summary["domina"] = filled.idxmax(axis=1).str.removeprefix("reads_").where(filled.sum(axis=1) > 0)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estadísticas del servidor para el query de cruce.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("capturar", help="Ejecuta el cruce con STATISTICS IO/TIME y guarda el reporte")
+    run.add_argument("--instancia", required=True)
+    run.add_argument("--fecha-option", type=int, default=2)
+    run.add_argument("--codigo")
+    run.add_argument("--referencia")
+    run.add_argument("--categoria")
+    run.add_argument("--linea")
+    run.add_argument("--fabrica")
+    run.add_argument("--plan", action="store_true", help="Capturar también el plan real (XML)")
+    parse = sub.add_parser("interpretar", help="Interpreta una salida guardada (texto de mensajes o .sqlplan)")
+    parse.add_argument("archivo")
+    sub.add_parser("resumen", help="CTE dominante por combinación de filtros")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "capturar":
+        from db import connection
+        connection.set_default_instance(args.instancia)
+        engine = connection.get_db_connection()
+        report = connection.diagnose_cruce(
+            engine, fecha_option=args.fecha_option, codigo_filter=args.codigo,
+            referencia_filter=args.referencia, categoria_filter=args.categoria,
+            linea_filter=args.linea, fabrica_filter=args.fabrica, plan=args.plan,
+        )
+        print(json.dumps({k: v for k, v in report.items() if k != "plan_xml"}, indent=2, default=str))
+    elif args.cmd == "interpretar":
+        with open(args.archivo, encoding="utf-8") as f:
+            content = f.read()
+        parsed = parse_plan(content) if content.lstrip().startswith("<") else parse_statistics(content.splitlines())
+        parsed["ctes"] = reads_by_cte(parsed["tables"])
+        print(json.dumps(parsed, indent=2))
+    else:
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(dominant_cte_by_filters())
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    raise SystemExit(main())
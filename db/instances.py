@@ -0,0 +1,23 @@
+# db/instances.py
+import os
+
+# Instancias de SQL Server disponibles en el selector. Está aparte de
+# db.connection para que la ventana pueda armarse sin importar SQLAlchemy.
+PREDEFINED_INSTANCES = {
+    "Servidor DOS": {
+        "server_name": "SERVERDOS\\SERVERSQL_DOS",
+        "login": "sa",
+        "password": "j2094l,."
+    },
+    "Analista Local": {
+        "server_name": "DESKTOP-POHBVL8\\ANALISTA",
+        "login": "sa",
+        "password": "123456"
+    }
+}
+
+# Backend local (SQLite, ver db.local_schema/db.local_fixtures): con
+# ROTACION_LOCAL_DB=<carpeta> aparece como una instancia más.
+LOCAL_INSTANCE_ALIAS = "Local (SQLite)"
+if os.environ.get("ROTACION_LOCAL_DB"):
+    PREDEFINED_INSTANCES[LOCAL_INSTANCE_ALIAS] = {"local_dir": os.environ["ROTACION_LOCAL_DB"]}
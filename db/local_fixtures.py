@@ -0,0 +1,153 @@
+# db/local_fixtures.py
+import argparse
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+from db.local_schema import LOCAL_DATABASES, create_local_engine, create_local_schema
+from queries.query_cruce import region_rows
+
+# Proporciones aproximadas de la base real (por cada línea de transferencia)
+LINEAS_POR_TRANSFERENCIA = 12
+MOVIMIENTOS_POR_CODIGO = 25
+CODIGOS_POR_REFERENCIA = 3
+N_FABRICANTES = 300
+N_MARCAS = 150
+N_LINEAS = 40
+CATEGORIAS_POR_LINEA = 10
+TIENDAS_SIN_REGION = 10
+TIENDAS_POR_CODIGO = 4
+PROPORCION_999999 = 0.8
+PROPORCION_CORRECCION = 0.05
+
+INSERT_CHUNK = 50_000
+
+def _insert(raw, table: str, columns, rows) -> None:
+    """executemany por bloques sobre la conexión sqlite3."""
+    placeholders = ", ".join("?" for _ in columns)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    cursor = raw.cursor()
+    for start in range(0, len(rows), INSERT_CHUNK):
+        cursor.executemany(sql, rows[start:start + INSERT_CHUNK])
+    cursor.close()
+
+def _clear(raw) -> None:
+    cursor = raw.cursor()
+    for db in LOCAL_DATABASES:
+        tables = cursor.execute(f"SELECT name FROM {db}.sqlite_master WHERE type = 'table'").fetchall()
+        for (name,) in tables:
+            cursor.execute(f"DELETE FROM {db}.{name}")
+    cursor.close()
+
+def generate_fixtures(engine, movimientos: int = 100_000, seed: int = 0,
+                      fecha_inicio: date = date(2023, 1, 1), fecha_fin: date = None) -> dict:
+    """
+    Llena el esquema local con datos sintéticos reproducibles (misma semilla,
+    mismos datos). El tamaño se fija por cantidad de líneas de transferencia
+    (MOVTRANSFERENCIAS); el resto de tablas escala con las proporciones de
+    arriba. Reemplaza cualquier dato previo. Devuelve filas por tabla.
+    """
+    rng = np.random.default_rng(seed)
+    fecha_fin = fecha_fin or date.today()
+    n_codigos = max(200, movimientos // MOVIMIENTOS_POR_CODIGO)
+    n_transferencias = max(50, movimientos // LINEAS_POR_TRANSFERENCIA)
+
+    # Dimensiones
+    lineas = [(f"{i:04d}", f"Linea {i}") for i in range(1, N_LINEAS + 1)]
+    categorias = [(f"{l}{j:02d}", f"Categoria {l}-{j}")
+                  for l, _ in lineas for j in range(1, CATEGORIAS_POR_LINEA + 1)]
+    marcas = [(f"M{i:03d}", f"Marca {i}") for i in range(1, N_MARCAS + 1)]
+    fabricantes = [(f"{i}", f"Fabricante {i}") for i in range(1, N_FABRICANTES + 1)]
+
+    # Productos: varios códigos de barras por referencia (tallas/colores)
+    codigos = np.array([f"77{i:011d}" for i in range(n_codigos)], dtype=object)
+    ref_ids = np.arange(n_codigos) // CODIGOS_POR_REFERENCIA
+    cat_idx = rng.integers(0, len(categorias), n_codigos)
+    # Pocas fábricas concentran la mayoría de productos (Zipf truncada)
+    fab_idx = np.minimum(rng.zipf(1.3, n_codigos) - 1, N_FABRICANTES - 1)
+    marca_idx = rng.integers(0, N_MARCAS, n_codigos)
+    inventario = [
+        (codigos[i], f"REF{ref_ids[i]:06d}", marcas[marca_idx[i]][0], f"Producto {i}",
+         categorias[cat_idx[i]][0], fabricantes[fab_idx[i]][0])
+        for i in range(n_codigos)
+    ]
+
+    # Transferencias: fechas uniformes en el rango, la mayoría hacia '999999'
+    dias = max(1, (fecha_fin - fecha_inicio).days)
+    segundos = rng.integers(0, dias * 86400, n_transferencias)
+    base = datetime.combine(fecha_inicio, datetime.min.time())
+    recibe = np.where(rng.random(n_transferencias) < PROPORCION_999999, "999999",
+                      np.char.mod("%06d", rng.integers(1, 60, n_transferencias)))
+    correccion = (rng.random(n_transferencias) < PROPORCION_CORRECCION).astype(int)
+    transferencias = [
+        (i + 1, (base + timedelta(seconds=int(segundos[i]))).strftime("%Y-%m-%d %H:%M:%S"),
+         int(correccion[i]), "" if i % 7 else f"Obs {i}", str(recibe[i]))
+        for i in range(n_transferencias)
+    ]
+
+    # Líneas: productos con popularidad desigual; cantidades 0..60 (<=1 se descarta en el query)
+    mov_numero = rng.integers(1, n_transferencias + 1, movimientos)
+    mov_codigo = codigos[np.minimum(rng.zipf(1.1, movimientos) - 1, n_codigos - 1)]
+    mov_cantidad = rng.integers(0, 61, movimientos)
+    movimientos_rows = list(zip(mov_numero.tolist(), mov_codigo.tolist(), mov_cantidad.tolist()))
+
+    # Bodega: tiendas con región + algunas sin región; existencia en unas pocas tiendas por código
+    tiendas = [t for t, _ in region_rows()] + [9000 + i for i in range(TIENDAS_SIN_REGION)]
+    dim_tiendas = [(t, f"Tienda {t}") for t in tiendas]
+    dim_inventario = [(i + 1, codigos[i]) for i in range(n_codigos)]
+    n_hec = n_codigos * TIENDAS_POR_CODIGO
+    hec_inventario = list(zip(
+        rng.integers(1, n_codigos + 1, n_hec).tolist(),
+        np.array(tiendas)[rng.integers(0, len(tiendas), n_hec)].tolist(),
+        rng.integers(0, 40, n_hec).tolist(),
+    ))
+
+    tables = {
+        "J101010100_999911.CATEGORIAS": (("Codigo", "Nombre"), lineas + categorias),
+        "J101010100_999911.MARCAS": (("Codigo", "Nombre"), marcas),
+        "J101010100_999911.FABRICANTES": (("Codigo", "Nombre"), fabricantes),
+        "J101010100_999911.INVENTARIO": (
+            ("CodigoBarra", "Referencia", "CodigoMarca", "Nombre", "Categoria", "Fabricante"), inventario),
+        "J101010100_999911.TRANSFERENCIAS": (
+            ("numero", "Fecha", "correccion", "observacion", "CodigoRecibe"), transferencias),
+        "J101010100_999911.MOVTRANSFERENCIAS": (("Numero", "CodigoBarra", "Cantidad"), movimientos_rows),
+        "BODEGA_DATOS.tbDimTiendas": (("dimID_Tienda", "Nombre"), dim_tiendas),
+        "BODEGA_DATOS.tbDimInventario": (("dimID_Inventario", "CodigoBarra"), dim_inventario),
+        "BODEGA_DATOS.tbHecInventario": (("dimid_inventario", "dimid_tienda", "Existencia"), hec_inventario),
+        "BODEGA_DATOS.tbRegionTienda": (("dimID_Tienda", "Region"), region_rows()),
+    }
+
+    create_local_schema(engine)
+    raw = engine.raw_connection()
+    try:
+        _clear(raw)
+        for table, (columns, rows) in tables.items():
+            _insert(raw, table, columns, rows)
+        raw.commit()
+    finally:
+        raw.close()
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+    return {table: len(rows) for table, (_, rows) in tables.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera la base local (SQLite) con datos sintéticos.")
+    parser.add_argument("directorio", help="Carpeta de la base local (ROTACION_LOCAL_DB)")
+    parser.add_argument("--movimientos", type=int, default=100_000, help="Líneas de transferencia")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--desde", default="2023-01-01", help="Primera fecha (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    engine = create_local_engine(args.directorio)
+    counts = generate_fixtures(engine, args.movimientos, args.semilla, date.fromisoformat(args.desde))
+    for table, n in counts.items():
+        logging.info("%-40s %10d filas", table, n)
+    logging.info("Base local generada en %.1f s: %s", time.perf_counter() - t0, args.directorio)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    main()
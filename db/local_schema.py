@@ -0,0 +1,239 @@
+# db/local_schema.py
+import os
+import re
+
+from sqlalchemy import create_engine, event
+
+# Esquema SQLite equivalente (solo columnas que usan los queries) para probar
+# sin SQL Server. Cada base del servidor es un archivo adjunto con su nombre,
+# así "[BODEGA_DATOS].dbo.tbX" se traduce a "BODEGA_DATOS.tbX".
+# Requiere SQLite >= 3.39 (RIGHT JOIN) y funciones de ventana.
+LOCAL_DATABASES = ("BODEGA_DATOS", "J101010100_999911")
+
+BODEGA_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS BODEGA_DATOS.tbDimInventario (
+    dimID_Inventario INTEGER PRIMARY KEY,
+    CodigoBarra      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS BODEGA_DATOS.tbDimTiendas (
+    dimID_Tienda INTEGER PRIMARY KEY,
+    Nombre       TEXT
+);
+CREATE TABLE IF NOT EXISTS BODEGA_DATOS.tbHecInventario (
+    dimid_inventario INTEGER NOT NULL,
+    dimid_tienda     INTEGER NOT NULL,
+    Existencia       NUMERIC NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS BODEGA_DATOS.ix_tbHecInventario_inventario
+    ON tbHecInventario (dimid_inventario, dimid_tienda);
+CREATE TABLE IF NOT EXISTS BODEGA_DATOS.tbRegionTienda (
+    dimID_Tienda INTEGER PRIMARY KEY,
+    Region       TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS BODEGA_DATOS.tbExistenciaCodigoBarra (
+    CodigoBarra      TEXT PRIMARY KEY,
+    ExistenciaActual NUMERIC NOT NULL,
+    FechaFoto        TEXT NOT NULL
+);
+"""
+
+VENTAS_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS J101010100_999911.CATEGORIAS (
+    Codigo TEXT PRIMARY KEY,
+    Nombre TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS J101010100_999911.MARCAS (
+    Codigo TEXT PRIMARY KEY,
+    Nombre TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS J101010100_999911.FABRICANTES (
+    Codigo TEXT PRIMARY KEY,
+    Nombre TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS J101010100_999911.INVENTARIO (
+    CodigoBarra TEXT PRIMARY KEY,
+    Referencia  TEXT,
+    CodigoMarca TEXT,
+    Nombre      TEXT,
+    Categoria   TEXT,
+    Fabricante  TEXT
+);
+CREATE INDEX IF NOT EXISTS J101010100_999911.ix_INVENTARIO_Referencia ON INVENTARIO (Referencia);
+CREATE INDEX IF NOT EXISTS J101010100_999911.ix_INVENTARIO_Fabricante ON INVENTARIO (Fabricante);
+CREATE TABLE IF NOT EXISTS J101010100_999911.TRANSFERENCIAS (
+    numero       INTEGER PRIMARY KEY,
+    Fecha        TEXT NOT NULL,
+    correccion   INTEGER NOT NULL DEFAULT 0,
+    observacion  TEXT,
+    CodigoRecibe TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS J101010100_999911.ix_TRANSFERENCIAS_Fecha ON TRANSFERENCIAS (Fecha);
+CREATE TABLE IF NOT EXISTS J101010100_999911.MOVTRANSFERENCIAS (
+    Numero      INTEGER NOT NULL,
+    CodigoBarra TEXT NOT NULL,
+    Cantidad    NUMERIC NOT NULL
+);
+CREATE INDEX IF NOT EXISTS J101010100_999911.ix_MOVTRANSFERENCIAS_numero ON MOVTRANSFERENCIAS (Numero);
+CREATE INDEX IF NOT EXISTS J101010100_999911.ix_MOVTRANSFERENCIAS_CodigoBarra ON MOVTRANSFERENCIAS (CodigoBarra);
+"""
+
+# ----------------- Traducción T-SQL -> SQLite -----------------
+_THREE_PART_NAME = re.compile(r"\[(\w+)\]\.dbo\.")
+_DECLARE = re.compile(r"DECLARE\s+@(\w+)\s+\w+(?:\s*\([\d,\s]+\))?\s*=\s*([^;]+);", re.IGNORECASE)
+_SET_OPTION = re.compile(r"SET\s+NOCOUNT\s+(?:ON|OFF)\s*;", re.IGNORECASE)
+
+# FORMAT(x, '<formato .NET>') -> printf/strftime
+_DATE_FORMATS = {"yyyy": "%Y", "MM": "%m", "dd": "%d", "HH": "%H", "mm": "%M", "ss": "%S"}
+
+def _matching_paren(sql: str, open_idx: int) -> int:
+    """Índice del paréntesis que cierra el abierto en open_idx (ignora literales '...')."""
+    depth, i, in_str = 0, open_idx, False
+    while i < len(sql):
+        ch = sql[i]
+        if ch == "'":
+            in_str = not in_str
+        elif not in_str:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+                if depth == 0:
+                    return i
+        i += 1
+    raise ValueError("Paréntesis sin cerrar en el SQL")
+
+def _strip_line_comments(sql: str) -> str:
+    """Quita comentarios '-- ...' (fuera de literales), que podrían nombrar @variables o :params."""
+    out, in_str, i = [], False, 0
+    while i < len(sql):
+        ch = sql[i]
+        if ch == "'":
+            in_str = not in_str
+        elif not in_str and sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = len(sql) if end == -1 else end
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+def _split_args(inner: str) -> list:
+    """Argumentos de primer nivel separados por coma."""
+    args, depth, start, in_str = [], 0, 0, False
+    for i, ch in enumerate(inner):
+        if ch == "'":
+            in_str = not in_str
+        elif not in_str:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            elif ch == "," and depth == 0:
+                args.append(inner[start:i].strip())
+                start = i + 1
+    args.append(inner[start:].strip())
+    return args
+
+def _rewrite_calls(sql: str, name: str, rewrite) -> str:
+    """
+    Reemplaza cada llamada NAME(...) por rewrite(texto_interno) (ya traducido
+    recursivamente). Si rewrite devuelve None, la llamada queda igual.
+    """
+    pattern = re.compile(rf"\b{name}\s*\(", re.IGNORECASE)
+    out, pos = [], 0
+    while True:
+        m = pattern.search(sql, pos)
+        if not m:
+            out.append(sql[pos:])
+            return "".join(out)
+        close = _matching_paren(sql, m.end() - 1)
+        inner = _rewrite_calls(sql[m.end():close], name, rewrite)
+        replacement = rewrite(inner)
+        out.append(sql[pos:m.start()])
+        out.append(f"{sql[m.start():m.end()]}{inner})" if replacement is None else replacement)
+        pos = close + 1
+
+def _cast(inner: str):
+    m = re.fullmatch(r"(.+)\s+AS\s+(DATE|DATETIME)", inner.strip(), re.IGNORECASE | re.DOTALL)
+    if not m:
+        return None
+    fn = "date" if m.group(2).upper() == "DATE" else "datetime"
+    return f"{fn}({m.group(1)})"
+
+def _dateadd(inner: str):
+    part, n, value = _split_args(inner)
+    unit = {"day": "day", "dd": "day", "d": "day", "month": "month", "mm": "month",
+            "year": "year", "yy": "year", "hour": "hour", "minute": "minute"}[part.lower()]
+    if re.fullmatch(r"[+-]?\d+", n):
+        return f"datetime({value}, '{int(n):+d} {unit}')"
+    return f"datetime({value}, printf('%+d {unit}', {n}))"
+
+def _format(inner: str):
+    value, fmt = _split_args(inner)
+    fmt = fmt.strip("'")
+    m = re.fullmatch(r"[Nn](\d*)", fmt)
+    if m:
+        return f"printf('%.{m.group(1) or 2}f', {value})"
+    for net, c in _DATE_FORMATS.items():
+        fmt = fmt.replace(net, c)
+    return f"strftime('{fmt}', {value})"
+
+def to_sqlite_sql(sql: str) -> str:
+    """
+    Traduce el T-SQL de queries/ a SQLite:
+      - comentarios de línea fuera
+      - [BASE].dbo.Tabla -> BASE.Tabla (bases adjuntas con ATTACH)
+      - SET NOCOUNT y DECLARE @var = expr: la variable se reemplaza por su expresión
+      - GETDATE(), DATEADD, CAST(x AS DATE/DATETIME), FORMAT, LEFT, ISNULL
+    """
+    sql = _strip_line_comments(sql)
+    sql = _THREE_PART_NAME.sub(r"\1.", sql)
+    sql = _SET_OPTION.sub("", sql)
+
+    variables = {}
+    def _declare(m):
+        variables[m.group(1)] = m.group(2).strip()
+        return ""
+    sql = _DECLARE.sub(_declare, sql)
+    # Las expresiones pueden usar variables declaradas antes
+    for name in variables:
+        for other, expr in variables.items():
+            variables[other] = re.sub(rf"@{name}\b", f"({variables[name]})", expr)
+    for name, expr in variables.items():
+        sql = re.sub(rf"@{name}\b", lambda _m, e=expr: f"({e})", sql)
+
+    sql = re.sub(r"\bGETDATE\s*\(\s*\)", "datetime('now', 'localtime')", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bISNULL\s*\(", "IFNULL(", sql, flags=re.IGNORECASE)
+    sql = _rewrite_calls(sql, "DATEADD", _dateadd)
+    sql = _rewrite_calls(sql, "CAST", _cast)
+    sql = _rewrite_calls(sql, "FORMAT", _format)
+    sql = _rewrite_calls(sql, "LEFT", lambda inner: "substr({}, 1, {})".format(*_split_args(inner)))
+    return sql.strip()
+
+def create_local_engine(directory: str):
+    """
+    Engine SQLite con una base adjunta por cada nombre de LOCAL_DATABASES
+    (archivos <directorio>/<BASE>.sqlite). Se usan archivos y no :memory:
+    para que los hilos de trabajo vean los mismos datos.
+    """
+    os.makedirs(directory, exist_ok=True)
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'main.sqlite')}")
+
+    @event.listens_for(engine, "connect")
+    def _attach(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        for name in LOCAL_DATABASES:
+            path = os.path.join(directory, f"{name}.sqlite")
+            cursor.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+        cursor.close()
+
+    return engine
+
+def create_local_schema(engine) -> None:
+    """Crea (si no existen) las tablas del esquema local."""
+    raw = engine.raw_connection()
+    try:
+        raw.executescript(BODEGA_SQLITE_SCHEMA + VENTAS_SQLITE_SCHEMA)
+        raw.commit()
+    finally:
+        raw.close()
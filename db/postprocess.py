@@ -0,0 +1,104 @@
+# db/postprocess.py
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+# Columnas de porcentaje: se guardan como float y solo se formatean al mostrar/exportar
+PCT_COLUMNS = ("Queda", "Vendido")
+
+def to_numeric_columns(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """Convierte a número (NaN/no numérico -> 0) las columnas dadas; crea las que falten en 0."""
+    for col in columns:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+        else:
+            df[col] = 0
+    return df
+
+def add_percentages(df: pd.DataFrame, total_col: str = "Cantidad_Inicial_Agrupada") -> pd.DataFrame:
+    """
+    Calcula Queda/Vendido (float, 2 decimales) a partir de ExistenciaActual y
+    del total agrupado. Total 0 -> Queda 0. Vendido = 100 - Queda (ya
+    redondeada), así ambas columnas siempre suman 100.
+    Redondeo igual al del query en modo "sql": centésimas de punto con la
+    mitad lejos de cero (ROUND de SQL Server), no al par como Series.round.
+    """
+    total = df[total_col].where(df[total_col] != 0)
+    # Una sola división: si el valor exacto termina en ,5 el float también
+    centesimas = (df["ExistenciaActual"] * 10000.0 / total).astype("float64")
+    centesimas = (np.sign(centesimas) * np.floor(np.abs(centesimas) + 0.5)).fillna(0)
+    df["Queda"] = centesimas / 100.0
+    df["Vendido"] = (10000.0 - centesimas) / 100.0
+    return df
+
+def format_pct(series: pd.Series) -> pd.Series:
+    """
+    Formato 'N2' con coma decimal y '%' (p. ej., 33,33%) para toda la serie
+    de una vez. Series que ya vienen como texto se devuelven igual.
+    """
+    if not is_numeric_dtype(series):
+        return series
+    values = series.fillna(0).to_numpy(dtype="float64").tolist()
+    text = pd.Series([f"{v:.2f}%" for v in values], index=series.index, dtype=object)
+    return text.str.replace(".", ",", regex=False)
+
+def format_pct_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Copia del DataFrame con Queda/Vendido formateadas como texto (para exportar)."""
+    if not any(col in df.columns and is_numeric_dtype(df[col]) for col in PCT_COLUMNS):
+        return df
+    df = df.copy()
+    for col in PCT_COLUMNS:
+        if col in df.columns:
+            df[col] = format_pct(df[col])
+    return df
+
+def recompute_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Única etapa de agregación en pandas (modifica y devuelve df):
+      - Cantidad_Inicial_Agrupada = suma de CantidadInicial por CodigoBarra
+        sobre las filas de df (groupby().transform, sin pivot ni merge).
+      - Queda y Vendido con add_percentages.
+    Sirve tanto para el resultado completo como para las filas visibles tras filtrar.
+    """
+    if df is None or df.empty:
+        return df
+
+    # Asegurar tipos numéricos (evita problemas con strings)
+    to_numeric_columns(df, ["CantidadInicial", "ExistenciaActual"])
+
+    if "CodigoBarra" in df.columns:
+        total = df.groupby("CodigoBarra", sort=False, observed=True)["CantidadInicial"].transform("sum")
+    else:
+        # Si no existiera (no debería), usa suma global
+        total = pd.Series(df["CantidadInicial"].sum(), index=df.index)
+
+    if "Cantidad_Inicial_Agrupada" in df.columns:
+        df["Cantidad_Inicial_Agrupada"] = total
+    else:
+        # Misma posición que en la proyección SQL: justo después de CantidadInicial
+        df.insert(df.columns.get_loc("CantidadInicial") + 1, "Cantidad_Inicial_Agrupada", total)
+
+    return add_percentages(df)
+
+AGGREGATION_MODES = ("pandas", "sql")
+
+def finalize_cruce(df: pd.DataFrame, mode: str = "pandas") -> pd.DataFrame:
+    """
+    Post-proceso del resultado del query según dónde se agregó:
+      - "sql": el query ya trae total y % numéricos; solo se asegura el tipo.
+      - "pandas": el query "lean" no trae ventanas; se calculan aquí una vez.
+    """
+    if mode == "sql":
+        return to_numeric_columns(df, [c for c in ("CantidadInicial", "Cantidad_Inicial_Agrupada",
+                                                   "ExistenciaActual", *PCT_COLUMNS) if c in df.columns])
+    return recompute_totals(df)
+
+def format_date(series: pd.Series) -> pd.Series:
+    """Fechas como 'YYYY-MM-DD' (FechaLlegada se guarda como datetime64)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime("%Y-%m-%d")
+    return series
+
+# Formateadores de visualización para la grilla (solo filas visibles)
+DISPLAY_FORMATTERS = {col: format_pct for col in PCT_COLUMNS}
+DISPLAY_FORMATTERS["FechaLlegada"] = format_date
@@ -0,0 +1,103 @@
+# db/schema.py
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_object_dtype, is_string_dtype
+
+# Tipos compactos por columna del resultado de cruce.
+#   "category": texto repetitivo (se aplica si la cardinalidad es baja)
+#   "int32"/"int8": cantidades enteras (si no hay decimales ni desborde)
+#   "date": fecha sin hora (datetime64)
+CRUCE_SCHEMA = {
+    "Referencia": "category",
+    "CodigoMarca": "category",
+    "Marca": "category",
+    "Nombre": "category",
+    "Nombre_Fabricante": "category",
+    "CodigoFabricante": "category",
+    "CategoriaCodigo": "category",
+    "CategoriaNombre": "category",
+    "Linea": "category",
+    "observacion": "category",
+    "CodigoRecibe": "category",
+    "CantidadInicial": "int32",
+    "Cantidad_Inicial_Agrupada": "int32",
+    "ExistenciaActual": "int32",
+    "correccion": "int8",
+    "FechaLlegada": "date",
+}
+
+# Proporción máxima de valores únicos para convertir a category
+CATEGORY_MAX_RATIO = 0.5
+
+# Texto restante (p. ej., CodigoBarra) como string[pyarrow] si está disponible
+ARROW_STRINGS = os.environ.get("ROTACION_ARROW_STRINGS", "0") == "1"
+
+def _to_category(series: pd.Series) -> pd.Series:
+    if isinstance(series.dtype, pd.CategoricalDtype) or not len(series):
+        return series
+    if series.nunique(dropna=True) > CATEGORY_MAX_RATIO * len(series):
+        return series
+    return series.astype("category")
+
+def _to_int(series: pd.Series, dtype: str) -> pd.Series:
+    values = pd.to_numeric(series, errors="coerce").fillna(0)
+    arr = values.to_numpy()
+    if not len(arr):
+        return values.astype(dtype)
+    if arr.dtype.kind == "f" and not np.all(np.mod(arr, 1) == 0):
+        return values
+    info = np.iinfo(dtype)
+    if arr.min() < info.min or arr.max() > info.max:
+        return values.astype("int64") if arr.dtype.kind == "f" else values
+    return values.astype(dtype)
+
+def _to_date(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, errors="coerce")
+
+def _to_arrow_string(series: pd.Series) -> pd.Series:
+    try:
+        return series.astype("string[pyarrow]")
+    except (ImportError, TypeError, ValueError):
+        return series
+
+def memory_mb(df: pd.DataFrame) -> float:
+    """Memoria residente del DataFrame (incluye el contenido de los objetos)."""
+    return df.memory_usage(index=True, deep=True).sum() / (1024 * 1024)
+
+def apply_dtype_policy(df: pd.DataFrame, schema=None, arrow_strings=None, report=False) -> pd.DataFrame:
+    """
+    Aplica CRUCE_SCHEMA (o el esquema dado) columna por columna, modificando df.
+    Es idempotente: columnas ya compactas no se vuelven a convertir.
+    Con report=True registra la memoria antes/después.
+    """
+    if df is None or df.empty:
+        return df
+    schema = CRUCE_SCHEMA if schema is None else schema
+    arrow_strings = ARROW_STRINGS if arrow_strings is None else arrow_strings
+    before = memory_mb(df) if report else None
+
+    for col, kind in schema.items():
+        if col not in df.columns:
+            continue
+        if kind == "category":
+            df[col] = _to_category(df[col])
+        elif kind == "date":
+            df[col] = _to_date(df[col])
+        elif kind in ("int8", "int16", "int32", "int64"):
+            df[col] = _to_int(df[col], kind)
+
+    if arrow_strings:
+        for col in df.columns:
+            series = df[col]
+            if col not in schema and (is_object_dtype(series) or is_string_dtype(series)) \
+                    and not is_numeric_dtype(series):
+                df[col] = _to_arrow_string(series)
+
+    if report:
+        logging.info("Memoria del resultado de cruce: %.1f MB -> %.1f MB", before, memory_mb(df))
+    return df
@@ -0,0 +1,72 @@
+# db/stock_snapshot.py
+import logging
+import time
+
+from sqlalchemy import text
+
+from db.connection import CRUCE_CACHE
+from db.local_schema import to_sqlite_sql
+from queries.query_cruce import (
+    REGION_TABLE, SNAPSHOT_TABLE, get_query_refresh_snapshot, region_rows,
+)
+
+# DDL en SQL Server de las tablas auxiliares (en SQLite las crea db.local_schema)
+_MSSQL_DDL = [
+    """
+IF OBJECT_ID(N'BODEGA_DATOS.dbo.tbRegionTienda', N'U') IS NULL
+    CREATE TABLE """ + REGION_TABLE + """ (
+        dimID_Tienda INT NOT NULL PRIMARY KEY,
+        Region       VARCHAR(50) NOT NULL
+    )
+""",
+    """
+IF OBJECT_ID(N'BODEGA_DATOS.dbo.tbExistenciaCodigoBarra', N'U') IS NULL
+    CREATE TABLE """ + SNAPSHOT_TABLE + """ (
+        CodigoBarra      VARCHAR(50) NOT NULL PRIMARY KEY,
+        ExistenciaActual DECIMAL(18, 2) NOT NULL,
+        FechaFoto        DATETIME NOT NULL
+    )
+""",
+]
+
+def _dialect_sql(engine, sql: str) -> str:
+    return to_sqlite_sql(sql) if engine.dialect.name == "sqlite" else sql
+
+def create_bodega_tables(engine) -> None:
+    """Crea en el servidor (si no existen) la tabla de regiones y la de la foto de existencias."""
+    if engine.dialect.name == "sqlite":
+        from db.local_schema import create_local_schema
+        create_local_schema(engine)
+        return
+    with engine.begin() as conn:
+        for ddl in _MSSQL_DDL:
+            conn.execute(text(ddl))
+
+def sync_region_table(engine) -> int:
+    """Reemplaza el contenido de REGION_TABLE con queries.query_cruce.REGIONES_TIENDA."""
+    rows = [{"tienda": tienda, "region": region} for tienda, region in region_rows()]
+    with engine.begin() as conn:
+        conn.execute(text(_dialect_sql(engine, f"DELETE FROM {REGION_TABLE}")))
+        conn.execute(
+            text(_dialect_sql(engine, f"INSERT INTO {REGION_TABLE} (dimID_Tienda, Region) VALUES (:tienda, :region)")),
+            rows,
+        )
+    logging.info("Mapeo tienda -> región sincronizado: %d tiendas.", len(rows))
+    return len(rows)
+
+def refresh_stock_snapshot(engine, region_source="inline") -> int:
+    """
+    Reconstruye la foto de existencias por código de barras en una sola
+    transacción (quien lee ve la foto anterior o la nueva, nunca a medias)
+    e invalida los resultados de cruce cacheados que la usaban.
+    Devuelve la cantidad de códigos en la foto.
+    """
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        for sql in get_query_refresh_snapshot(region_source):
+            conn.execute(text(_dialect_sql(engine, sql)))
+        count = conn.execute(text(_dialect_sql(engine, f"SELECT COUNT(*) FROM {SNAPSHOT_TABLE}"))).scalar()
+
+    CRUCE_CACHE.invalidate(lambda key: ("stock_source", "snapshot") in key.filters)
+    logging.info("Foto de existencias actualizada: %d códigos en %.1f s.", count, time.perf_counter() - t0)
+    return count
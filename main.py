@@ -4,8 +4,8 @@ import logging
 import traceback
 import customtkinter as ctk
 from views.main_view import MainView
-from db.connection import PREDEFINED_INSTANCES, set_default_instance
-from utils.helpers import export_to_excel, obtener_datos_treeview, get_save_path
+from db.instances import PREDEFINED_INSTANCES
+from utils.warmup import start_warmup
 
 # Configuración básica de loggin
 logging.basicConfig(level=logging.DEBUG, format="%(levelname)s: %(message)s")
@@ -20,36 +20,34 @@ def resource_path(relative_path):
 
 def export_demo(parent, data=None):
     """
-    Exporta los datos del Treeview a Excel.
+    Exporta los datos a Excel en segundo plano (con progreso y cancelación).
     """
+    from utils.helpers import export_in_background, get_save_path
+
     if data is None:
         data = [{"Columna1": "Dato 1", "Columna2": "Dato 2"}]
     output_file = get_save_path(parent)
     if not output_file:
         logging.info("Exportación cancelada.")
         return
-    try:
-        export_to_excel(data, output_file)
-    except Exception as e:
-        logging.error("Error al exportar: %s", e)
-        import tkinter.messagebox as messagebox
-        messagebox.showerror("Error al exportar", f"Se produjo un error:\n{e}")
-    else:
-        import tkinter.messagebox as messagebox
-        messagebox.showinfo("Exportación exitosa", f"Archivo guardado:\n{output_file}")
+    fmt = "csv" if output_file.lower().endswith(".csv") else "xlsx"
+    return export_in_background(parent, data, [(fmt, output_file)])
 
 def run_view():
     """
     Lanza la aplicación principal.
     """
-    # Selección automática de instancia al iniciar
+    # Selección automática de instancia al iniciar: MainView elige la primera
+    # y la aplica a db.connection (SQLAlchemy) en la primera importación
     alias_default = list(PREDEFINED_INSTANCES.keys())[0]
-    set_default_instance(alias_default)
     logging.debug(f"Instancia predeterminada seleccionada: {alias_default}")
 
     try:
         main_app = MainView(refresh_callback=lambda: None)
 
+        # Ventana primero; pandas/SQLAlchemy se precargan después del primer dibujo
+        main_app.after(200, start_warmup)
+
         main_app.mainloop()
 
     except Exception as e:
@@ -0,0 +1,74 @@
+# queries/pushdown.py
+from typing import NamedTuple
+
+# Reescritura por reglas: cada filtro se coloca en el CTE más bajo donde ya
+# existe la columna de origen, en lugar de aplicarse sobre Final2 después de
+# agregar todos los códigos de barras.
+
+# Marcadores de cada nivel dentro de get_query_cruce / get_query_bodega_sum
+MARKERS = {
+    "bodega": "/*__BODEGA_FILTERS__*/",      # BodegaCTE (existencia en vivo)
+    "snapshot": "/*__SNAPSHOT_FILTERS__*/",  # BodegaSum leída de la foto materializada
+    "creacion": "/*__CREACION_FILTERS__*/",  # CreacionCTE (filas de transferencia, antes de agregar)
+    "final": "/*__FINAL_FILTERS__*/",        # FilteredFinal (tras agregar, antes de las ventanas)
+}
+
+class Origin(NamedTuple):
+    """Dónde existe el valor de una columna: nivel, expresión y forma no sargable."""
+    level: str
+    expr: str
+    normalize: str = "{}"
+
+# Columna de Final2 -> sus orígenes. Solo atributos fijos de cada código de
+# barras bajan a CreacionCTE/BodegaCTE: el filtro conserva o descarta todas
+# las filas de un código a la vez, así Cantidad_Inicial_Agrupada (suma por
+# código) no cambia. Los valores que FinalCTE agrega por (código, fecha)
+# con MAX solo pueden filtrarse después de agregar.
+COLUMN_ORIGINS = {
+    "CodigoBarra": (
+        Origin("bodega", "di.CodigoBarra", "LTRIM(RTRIM({}))"),
+        Origin("snapshot", "CodigoBarra"),
+        Origin("creacion", "I.CodigoBarra"),
+    ),
+    "Referencia": (Origin("creacion", "I.Referencia", "LOWER(LTRIM(RTRIM({})))"),),
+    "CodigoFabricante": (Origin("creacion", "I.Fabricante"),),
+    "CategoriaNombre": (Origin("creacion", "C.Nombre"),),
+    "Linea": (Origin("creacion", "CC.Nombre"),),
+    "correccion": (Origin("final", "correccion"),),
+    "CodigoRecibe": (Origin("final", "CodigoRecibe", "UPPER(LTRIM(RTRIM({})))"),),
+}
+
+class Predicate(NamedTuple):
+    """Filtro sobre una columna de Final2; `template` usa {col} (p. ej. "{col} = :codigoFilter")."""
+    column: str
+    template: str
+
+def place_predicates(predicates, sargable=True) -> dict:
+    """
+    Nivel -> lista de condiciones SQL. Un mismo filtro puede ir a varios
+    niveles (p. ej., CodigoBarra en CreacionCTE y en BodegaCTE), porque cada
+    rama solo aporta filas de ese código al JOIN.
+    """
+    placed = {level: [] for level in MARKERS}
+    for pred in predicates:
+        origins = COLUMN_ORIGINS.get(pred.column)
+        if not origins:
+            raise KeyError(f"Columna sin regla de ubicación: {pred.column}")
+        for origin in origins:
+            expr = origin.expr if sargable else origin.normalize.format(origin.expr)
+            placed[origin.level].append(pred.template.format(col=expr))
+    return placed
+
+def apply_pushdown(sql: str, predicates=(), sargable=True) -> str:
+    """
+    Reemplaza los marcadores presentes en `sql` con sus condiciones
+    (' AND ...') y elimina los que no reciben ninguna.
+    """
+    placed = place_predicates(predicates, sargable)
+    for level, marker in MARKERS.items():
+        sql = sql.replace(marker, "".join(f" AND {c}" for c in placed[level]))
+    return sql
+
+def strip_markers(sql: str) -> str:
+    """Quita todos los marcadores (query sin filtros de usuario)."""
+    return apply_pushdown(sql, ())
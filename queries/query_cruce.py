@@ -1,65 +1,81 @@
-def get_query_cruce():
-    query = """
--- 1) BODEGA (clasifica por tienda → región y excluye 'Sin region')
-WITH BodegaCTE AS (
+from queries.pushdown import strip_markers
+
+# Tienda (dimID_Tienda) -> región. Las tiendas que no aparecen aquí quedan
+# "Sin region" y no cuentan para la existencia.
+REGIONES_TIENDA = {
+    "Valencia Casa Matriz": (2003,),
+    "Oriente - Casa Matriz": (2005,),
+    "Oriente - Sucursales": (
+        1, 1002, 1004, 1006, 1008, 1009, 1010, 1011, 1012,
+        1013, 1014, 1017, 1018, 1019, 1020, 1021, 1022,
+        1023, 1024, 1058,
+    ),
+    "Occidente - Casa Matriz": (2004,),
+    "Occidente - Sucursales": (
+        1026, 1027, 1028, 1029, 1030, 1031, 1037, 1038, 1039, 1040,
+        1041, 1042, 1043, 1044, 1045, 1046, 1047, 1050, 1055, 2007,
+    ),
+}
+
+# Tablas auxiliares opcionales en BODEGA_DATOS (se crean con db.stock_snapshot)
+REGION_TABLE = "[BODEGA_DATOS].dbo.tbRegionTienda"
+SNAPSHOT_TABLE = "[BODEGA_DATOS].dbo.tbExistenciaCodigoBarra"
+
+# De dónde sale el mapeo tienda -> región:
+#   "inline": tabla derivada generada desde REGIONES_TIENDA (no requiere nada en el servidor)
+#   "table":  REGION_TABLE (sincronizada con db.stock_snapshot.sync_region_table)
+REGION_SOURCES = ("inline", "table")
+# De dónde sale ExistenciaActual:
+#   "live":     agregado de tbHecInventario en cada consulta
+#   "snapshot": foto materializada por código de barras (SNAPSHOT_TABLE)
+STOCK_SOURCES = ("live", "snapshot")
+
+def region_rows():
+    """Filas (dimID_Tienda, Region) del mapeo."""
+    return [(tienda, region) for region, tiendas in REGIONES_TIENDA.items() for tienda in tiendas]
+
+def _region_relation(region_source="inline"):
+    """Relación (dimID_Tienda, Region) para el JOIN de BodegaCTE."""
+    if region_source == "table":
+        return REGION_TABLE
+    selects = [
+        "SELECT {} AS dimID_Tienda, '{}' AS Region".format(tienda, region.replace("'", "''"))
+        for tienda, region in region_rows()
+    ]
+    return "(\n        " + "\n        UNION ALL ".join(selects) + "\n    )"
+
+def _bodega_ctes(region_source="inline", stock_source="live"):
+    """
+    CTEs de existencia por región/código de barras, compartidos por el query de
+    cruce y por la foto de existencias. El JOIN con el mapeo deja fuera las
+    tiendas sin región (equivale al CASE ... <> 'Sin region' anterior).
+    """
+    if stock_source == "snapshot":
+        return """
+-- 1-2) Total de existencia por CódigoBarra (foto materializada)
+BodegaSum AS (
+    SELECT CodigoBarra AS CleanCodigoBarra, ExistenciaActual
+    FROM """ + SNAPSHOT_TABLE + """
+    WHERE 1=1 /*__SNAPSHOT_FILTERS__*/
+)"""
+    return """
+-- 1) BODEGA (clasifica por tienda → región; solo tiendas con región)
+BodegaCTE AS (
     SELECT
         LTRIM(RTRIM(di.CodigoBarra)) AS CleanCodigoBarra,
-        CASE
-            WHEN t.dimID_Tienda IN (2003) THEN 'Valencia Casa Matriz'
-            WHEN t.dimID_Tienda IN (2005) THEN 'Oriente - Casa Matriz'
-            WHEN t.dimID_Tienda IN (
-                1,1002,1004,1006,1008,1009,1010,1011,1012,
-                1013,1014,1017,1018,1019,1020,1021,1022,
-                1023,1024,1058
-            ) THEN 'Oriente - Sucursales'
-            WHEN t.dimID_Tienda IN (2004) THEN 'Occidente - Casa Matriz'
-            WHEN t.dimID_Tienda IN (
-                1026,1027,1028,1029,1030,1031,1037,1038,1039,1040,
-                1041,1042,1043,1044,1045,1046,1047,1050,1055,2007
-            ) THEN 'Occidente - Sucursales'
-            ELSE 'Sin region'
-        END AS Region,
+        r.Region,
         SUM(hi.Existencia) AS Existencia_Region
     FROM [BODEGA_DATOS].dbo.tbDimInventario di
-    LEFT JOIN [BODEGA_DATOS].dbo.tbHecInventario hi
+    INNER JOIN [BODEGA_DATOS].dbo.tbHecInventario hi
         ON di.dimID_Inventario = hi.dimid_inventario
-    LEFT JOIN [BODEGA_DATOS].dbo.tbDimTiendas t
+    INNER JOIN [BODEGA_DATOS].dbo.tbDimTiendas t
         ON hi.dimid_tienda = t.dimID_Tienda
-    WHERE 1=1
-      /*__REF_FILTER__*/   -- usa el MISMO placeholder que ya manejas en Python
+    INNER JOIN """ + _region_relation(region_source) + """ r
+        ON r.dimID_Tienda = t.dimID_Tienda
+    WHERE 1=1 /*__BODEGA_FILTERS__*/
     GROUP BY
         LTRIM(RTRIM(di.CodigoBarra)),
-        CASE
-            WHEN t.dimID_Tienda IN (2003) THEN 'Valencia Casa Matriz'
-            WHEN t.dimID_Tienda IN (2005) THEN 'Oriente - Casa Matriz'
-            WHEN t.dimID_Tienda IN (
-                1,1002,1004,1006,1008,1009,1010,1011,1012,
-                1013,1014,1017,1018,1019,1020,1021,1022,
-                1023,1024,1058
-            ) THEN 'Oriente - Sucursales'
-            WHEN t.dimID_Tienda IN (2004) THEN 'Occidente - Casa Matriz'
-            WHEN t.dimID_Tienda IN (
-                1026,1027,1028,1029,1030,1031,1037,1038,1039,1040,
-                1041,1042,1043,1044,1045,1046,1047,1050,1055,2007
-            ) THEN 'Occidente - Sucursales'
-            ELSE 'Sin region'
-        END
-    HAVING
-        CASE
-            WHEN t.dimID_Tienda IN (2003) THEN 'Valencia Casa Matriz'
-            WHEN t.dimID_Tienda IN (2005) THEN 'Oriente - Casa Matriz'
-            WHEN t.dimID_Tienda IN (
-                1,1002,1004,1006,1008,1009,1010,1011,1012,
-                1013,1014,1017,1018,1019,1020,1021,1022,
-                1023,1024,1058
-            ) THEN 'Oriente - Sucursales'
-            WHEN t.dimID_Tienda IN (2004) THEN 'Occidente - Casa Matriz'
-            WHEN t.dimID_Tienda IN (
-                1026,1027,1028,1029,1030,1031,1037,1038,1039,1040,
-                1041,1042,1043,1044,1045,1046,1047,1050,1055,2007
-            ) THEN 'Occidente - Sucursales'
-            ELSE 'Sin region'
-        END <> 'Sin region'
+        r.Region
 ),
 
 -- 2) Total de existencia por CódigoBarra
@@ -67,9 +83,134 @@ BodegaSum AS (
     SELECT CleanCodigoBarra, SUM(Existencia_Region) AS ExistenciaActual
     FROM BodegaCTE
     GROUP BY CleanCodigoBarra
-),
+)"""
+
+# Final2 con ventanas: el total por CodigoBarra y los % se calculan en SQL
+# (numéricos; el formato 'N2' se aplica al mostrar/exportar). Los % se
+# redondean en centésimas enteras y luego se dividen por 100, como
+# db.postprocess.add_percentages: mismo resultado en ambos modos.
+_FINAL2_SQL = """
+-- 6) Ventanas y % calculados
+Final2 AS (
+    SELECT
+        f.CleanReferencia,
+        f.CodigoBarra,
+        f.CodigoMarca,
+        f.Marca,
+        f.Nombre,
+        f.Nombre_Fabricante,
+        f.CodigoFabricante,
+        f.CategoriaCodigo,
+        f.CategoriaNombre,
+        f.Linea,
+        f.CantidadInicial,
+        SUM(f.CantidadInicial) OVER (PARTITION BY f.CodigoBarra) AS Cantidad_Inicial_Agrupada,
+        f.ExistenciaActual,
+        f.correccion,
+        f.NumeroTransferencia,
+        f.FechaLlegada,
+        f.observacion,
+        f.CodigoRecibe
+    FROM FilteredFinal f
+)
+
+-- 7) Proyección final
+SELECT 
+    CleanReferencia AS Referencia,
+    CodigoBarra,
+    CodigoMarca,
+    Marca,
+    Nombre,
+    Nombre_Fabricante,
+    CodigoFabricante,
+    CategoriaCodigo,
+    CategoriaNombre,
+    Linea,
+    ISNULL(CantidadInicial, 0)           AS CantidadInicial,
+    ISNULL(Cantidad_Inicial_Agrupada, 0) AS Cantidad_Inicial_Agrupada,
+    ISNULL(ExistenciaActual, 0)          AS ExistenciaActual,
+    correccion,
+    NumeroTransferencia,
+    FechaLlegada,
+    observacion,
+    CodigoRecibe,
+    CAST(ISNULL(ROUND(ExistenciaActual * 10000.0 / NULLIF(Cantidad_Inicial_Agrupada, 0), 0), 0) / 100.0 AS FLOAT) AS Queda,
+    CAST((10000 - ISNULL(ROUND(ExistenciaActual * 10000.0 / NULLIF(Cantidad_Inicial_Agrupada, 0), 0), 0)) / 100.0 AS FLOAT) AS Vendido
+FROM Final2;
+"""
+
+# Final2 "lean": sin ventanas ni %; el total y los % se calculan una sola vez en pandas
+_FINAL2_LEAN_SQL = """
+-- 6) Sin ventanas: total por CodigoBarra y % se calculan en pandas
+Final2 AS (
+    SELECT
+        f.CleanReferencia,
+        f.CodigoBarra,
+        f.CodigoMarca,
+        f.Marca,
+        f.Nombre,
+        f.Nombre_Fabricante,
+        f.CodigoFabricante,
+        f.CategoriaCodigo,
+        f.CategoriaNombre,
+        f.Linea,
+        f.CantidadInicial,
+        f.ExistenciaActual,
+        f.correccion,
+        f.NumeroTransferencia,
+        f.FechaLlegada,
+        f.observacion,
+        f.CodigoRecibe
+    FROM FilteredFinal f
+)
+
+-- 7) Proyección final
+SELECT 
+    CleanReferencia AS Referencia,
+    CodigoBarra,
+    CodigoMarca,
+    Marca,
+    Nombre,
+    Nombre_Fabricante,
+    CodigoFabricante,
+    CategoriaCodigo,
+    CategoriaNombre,
+    Linea,
+    ISNULL(CantidadInicial, 0)           AS CantidadInicial,
+    ISNULL(ExistenciaActual, 0)          AS ExistenciaActual,
+    correccion,
+    NumeroTransferencia,
+    FechaLlegada,
+    observacion,
+    CodigoRecibe
+FROM Final2;
+"""
+
+def get_query_cruce(lean=False, region_source="inline", stock_source="live", existencias=True):
+    """
+    Query de cruce. Con lean=True omite las funciones de ventana y los %
+    (Cantidad_Inicial_Agrupada, Queda, Vendido), que se calculan en pandas.
+    region_source/stock_source: ver REGION_SOURCES y STOCK_SOURCES.
+    El JOIN con BodegaSum compara el código recortado (LTRIM/RTRIM): hay
+    códigos con espacios y BodegaSum es un agregado con clave calculada, así
+    que compararlo sin recortar no permite un index seek y pierde existencias.
+    Con existencias=False no incluye BodegaCTE/BodegaSum ni su JOIN y
+    ExistenciaActual sale en 0 (refresco incremental: la existencia se toma
+    de una sola foto de get_query_bodega_sum).
+    """
+    if existencias:
+        bodega = _bodega_ctes(region_source, stock_source) + ","
+        existencia = "COALESCE(bs.ExistenciaActual, 0)"
+        bodega_join = """
+    LEFT JOIN BodegaSum bs 
+        ON LTRIM(RTRIM(c.CodigoBarra)) = bs.CleanCodigoBarra"""
+        bodega_group = ", bs.ExistenciaActual"
+    else:
+        bodega, existencia, bodega_join, bodega_group = "", "0", "", ""
+    query = """
+WITH""" + bodega + """
 
--- 3) Transferencias/Inventario (usa :fechaStart que inyecta Python)
+-- 3) Transferencias/Inventario (usa @fechaStart/@fechaEnd que declara Python; @fechaEnd es exclusivo)
 CreacionCTE AS (
     SELECT 
         LTRIM(RTRIM(I.Referencia)) AS CleanReferencia,
@@ -101,9 +242,9 @@ CreacionCTE AS (
         ON T.numero = MT.numero
     INNER JOIN [J101010100_999911].dbo.FABRICANTES F
         ON F.Codigo = I.Fabricante
-    WHERE T.Fecha BETWEEN :fechaStart AND GETDATE()
+    WHERE T.Fecha >= @fechaStart AND T.Fecha < @fechaEnd
       AND T.CodigoRecibe = '999999'
-      /*__REF_FILTER__*/   -- tu inyección actual (si no hay filtro, Python la borra)
+      /*__CREACION_FILTERS__*/   -- filtros por atributo del código (queries.pushdown)
 ),
 
 -- 4) Agregado base por Código y Fecha
@@ -120,90 +261,47 @@ FinalCTE AS (
         MAX(c.CategoriaNombre) AS CategoriaNombre,
         MAX(c.Linea) AS Linea,
         SUM(CASE WHEN c.Cantidad > 1 THEN c.Cantidad ELSE 0 END) AS CantidadInicial,
-        COALESCE(bs.ExistenciaActual, 0) AS ExistenciaActual,
+        """ + existencia + """ AS ExistenciaActual,
         MAX(c.correccion) AS correccion,
         MAX(c.NumeroTransferencia) AS NumeroTransferencia,
         c.FechaLlegada,
         MAX(c.observacion) AS observacion,
         MAX(c.CodigoRecibe) AS CodigoRecibe
-    FROM CreacionCTE c
-    LEFT JOIN BodegaSum bs 
-        ON LTRIM(RTRIM(c.CodigoBarra)) = bs.CleanCodigoBarra
+    FROM CreacionCTE c""" + bodega_join + """
     WHERE c.Cantidad > 1
-    GROUP BY c.CodigoBarra, c.FechaLlegada, bs.ExistenciaActual
+    GROUP BY c.CodigoBarra, c.FechaLlegada""" + bodega_group + """
 ),
 
--- 5) Filtros finales (inyectados desde Python)
+-- 5) Filtros por fila agregada (queries.pushdown), antes de las ventanas
 FilteredFinal AS (
     SELECT * 
     FROM FinalCTE
     WHERE 1=1 /*__FINAL_FILTERS__*/
 ),
 
--- 6) Ventanas y % calculados
-Final2 AS (
-    SELECT
-        f.CleanReferencia,
-        f.CodigoBarra,
-        f.CodigoMarca,
-        f.Marca,
-        f.Nombre,
-        f.Nombre_Fabricante,
-        f.CodigoFabricante,
-        f.CategoriaCodigo,
-        f.CategoriaNombre,
-        f.Linea,
-        f.CantidadInicial,
-        SUM(f.CantidadInicial) OVER (PARTITION BY f.CodigoBarra) AS Cantidad_Inicial_Agrupada,
-        f.ExistenciaActual,
-        f.correccion,
-        f.NumeroTransferencia,
-        f.FechaLlegada,
-        f.observacion,
-        f.CodigoRecibe,
-        CASE 
-            WHEN SUM(f.CantidadInicial) OVER (PARTITION BY f.CodigoBarra) = 0 THEN '0%'
-            ELSE FORMAT(
-                f.ExistenciaActual * 100.0 
-                / NULLIF(SUM(f.CantidadInicial) OVER (PARTITION BY f.CodigoBarra), 0),
-                'N2'
-            ) + '%'
-        END AS Queda,
-        CASE 
-            WHEN SUM(f.CantidadInicial) OVER (PARTITION BY f.CodigoBarra) = 0 THEN '0%'
-            ELSE FORMAT(
-                100.0 - (
-                    f.ExistenciaActual * 100.0 
-                    / NULLIF(SUM(f.CantidadInicial) OVER (PARTITION BY f.CodigoBarra), 0)
-                ),
-                'N2'
-            ) + '%'
-        END AS Vendido
-    FROM FilteredFinal f
-)
+""" + (_FINAL2_LEAN_SQL if lean else _FINAL2_SQL)
+    return query
 
--- 7) Proyección final
-SELECT 
-    CleanReferencia AS Referencia,
-    CodigoBarra,
-    CodigoMarca,
-    Marca,
-    Nombre,
-    Nombre_Fabricante,
-    CodigoFabricante,
-    CategoriaCodigo,
-    CategoriaNombre,
-    Linea,
-    ISNULL(CantidadInicial, 0)           AS CantidadInicial,
-    ISNULL(Cantidad_Inicial_Agrupada, 0) AS Cantidad_Inicial_Agrupada,
-    ISNULL(ExistenciaActual, 0)          AS ExistenciaActual,
-    correccion,
-    NumeroTransferencia,
-    FechaLlegada,
-    observacion,
-    CodigoRecibe,
-    Queda,
-    Vendido
-FROM Final2;
+def get_query_bodega_sum(region_source="inline", stock_source="live"):
+    """Foto de existencias actuales por código de barras (sin transferencias)."""
+    query = """
+WITH""" + _bodega_ctes(region_source, stock_source) + """
+
+SELECT CleanCodigoBarra AS CodigoBarra, ExistenciaActual
+FROM BodegaSum;
 """
     return query
+
+def get_query_refresh_snapshot(region_source="inline"):
+    """
+    Sentencias (en orden, dentro de una transacción) que reconstruyen
+    SNAPSHOT_TABLE a partir del agregado en vivo de tbHecInventario.
+    """
+    insert = """
+WITH""" + strip_markers(_bodega_ctes(region_source, "live")) + """
+
+INSERT INTO """ + SNAPSHOT_TABLE + """ (CodigoBarra, ExistenciaActual, FechaFoto)
+SELECT CleanCodigoBarra, COALESCE(ExistenciaActual, 0), CURRENT_TIMESTAMP
+FROM BodegaSum
+"""
+    return ["DELETE FROM " + SNAPSHOT_TABLE, insert.strip()]
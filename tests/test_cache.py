@@ -0,0 +1,34 @@
+# tests/test_cache.py
+import time
+
+import pandas as pd
+
+from db.cache import CacheKey, ResultCache
+
+# Antigüedad de los datos cacheados: la de la consulta original, también
+# para entradas derivadas de otra o leídas del nivel en disco.
+
+def _key(fecha_start="2024-01-01"):
+    return CacheKey(instance="Local", fecha_start=fecha_start, fecha_end=None, filters=())
+
+def test_fetched_at_defaults_to_now_and_keeps_given_time():
+    cache = ResultCache()
+    df = pd.DataFrame({"a": [1, 2]})
+    before = time.time()
+    cache.put(_key(), df)
+    assert cache.fetched_at(_key()) >= before
+
+    hace_una_hora = time.time() - 3600
+    cache.put(_key("2024-02-01"), df, fetched=hace_una_hora)
+    assert cache.fetched_at(_key("2024-02-01")) == hace_una_hora
+    # El TTL en memoria corre desde que se guardó, no desde la consulta
+    assert cache.get(_key("2024-02-01")) is not None
+
+def test_disk_tier_keeps_fetch_time_across_restarts(tmp_path):
+    df = pd.DataFrame({"a": [1, 2]})
+    hace_dos_horas = time.time() - 7200
+    ResultCache(disk_dir=str(tmp_path), disk_format="feather").put(_key(), df, fetched=hace_dos_horas)
+
+    restarted = ResultCache(disk_dir=str(tmp_path), disk_format="feather")
+    assert restarted.get(_key()) is not None
+    assert abs(restarted.fetched_at(_key()) - hace_dos_horas) < 1
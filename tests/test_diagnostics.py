@@ -0,0 +1,60 @@
+# tests/test_diagnostics.py
+import os
+
+import pytest
+
+from db.diagnostics import parse_plan, parse_statistics, reads_by_cte
+
+# Salidas reales capturadas de SQL Server (mensajes de STATISTICS IO/TIME
+# vía pyodbc y un plan real .sqlplan); los parsers se prueban sin servidor.
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "db", "diagnostics_samples")
+
+def _read(name):
+    with open(os.path.join(SAMPLES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+@pytest.fixture(scope="module")
+def statistics():
+    return parse_statistics(_read("statistics_io_time.txt").splitlines())
+
+@pytest.fixture(scope="module")
+def plan():
+    return parse_plan(_read("plan_actual.sqlplan"))
+
+@pytest.mark.parametrize("table, reads", [
+    ("MOVTRANSFERENCIAS", 48211),
+    ("tbHecInventario", 61876),
+    ("Worktable", 183402),
+])
+def test_statistics_logical_reads(statistics, table, reads):
+    assert statistics["tables"][table]["logical_reads"] == reads
+
+def test_statistics_driver_prefix_and_read_ahead(statistics):
+    # Líneas con prefijo '[Microsoft][ODBC ...]' y read-ahead de la misma línea
+    assert statistics["tables"]["MOVTRANSFERENCIAS"]["read_ahead_reads"] == 47990
+    assert statistics["tables"]["TRANSFERENCIAS"]["scans"] == 9
+
+def test_statistics_times(statistics):
+    assert statistics["cpu_ms"] == 5843
+    assert statistics["elapsed_ms"] == 9120
+    assert statistics["compile_cpu_ms"] == 94
+
+def test_statistics_reads_by_cte(statistics):
+    ctes = reads_by_cte(statistics["tables"])
+    assert ctes["FinalCTE"] == 183402
+    assert ctes["BodegaCTE"] == 66394
+    assert ctes["CreacionCTE"] == 57012
+    assert next(iter(ctes)) == "FinalCTE"
+
+@pytest.mark.parametrize("table, reads", [
+    ("tbHecInventario", 61876),
+    ("MOVTRANSFERENCIAS", 48211),
+])
+def test_plan_logical_reads(plan, table, reads):
+    assert plan["tables"][table]["logical_reads"] == reads
+
+def test_plan_reads_by_cte(plan):
+    ctes = reads_by_cte(plan["tables"])
+    assert ctes["BodegaCTE"] == 61876
+    assert ctes["CreacionCTE"] == 48211
+    assert plan["statement_cost"] > 0
@@ -0,0 +1,119 @@
+# tests/test_incremental_refresh.py
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from db import connection
+from db.local_fixtures import generate_fixtures
+from db.local_schema import create_local_engine
+
+# Refresco incremental contra el backend local (SQLite, db.local_fixtures):
+# tras llegar movimientos nuevos, el resultado incremental debe ser igual a
+# una importación completa.
+FECHA_FIN = date(2024, 6, 30)
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_local_engine(str(tmp_path))
+    generate_fixtures(engine, 5000, seed=0, fecha_fin=FECHA_FIN)
+    connection.invalidate_cruce_cache()
+    yield engine
+    connection.invalidate_cruce_cache()
+    engine.dispose()
+
+def _add_movements(engine, df):
+    """
+    Una transferencia tardía del día de la marca de agua, otra de un día
+    nuevo para un código con filas anteriores, y existencia nueva para un
+    código que no tiene movimientos en el delta.
+    """
+    watermark = pd.Timestamp(df["FechaLlegada"].iloc[-1]).date()
+    tardio, nuevo, solo_existencia = (str(df["CodigoBarra"].iloc[i]) for i in (-1, 0, len(df) // 2))
+    with engine.begin() as conn:
+        numero = conn.execute(text("SELECT MAX(numero) FROM J101010100_999911.TRANSFERENCIAS")).scalar()
+        conn.execute(text("INSERT INTO J101010100_999911.TRANSFERENCIAS VALUES (:n, :f, 0, '', '999999')"), [
+            {"n": numero + 1, "f": f"{watermark} 23:59:00"},
+            {"n": numero + 2, "f": f"{watermark + timedelta(days=1)} 08:00:00"},
+        ])
+        conn.execute(text("INSERT INTO J101010100_999911.MOVTRANSFERENCIAS VALUES (:n, :c, :q)"), [
+            {"n": numero + 1, "c": tardio, "q": 7},
+            {"n": numero + 2, "c": nuevo, "q": 11},
+        ])
+        # Tienda 2003: Valencia Casa Matriz (cuenta para la existencia)
+        conn.execute(text(
+            "INSERT INTO BODEGA_DATOS.tbHecInventario "
+            "SELECT dimID_Inventario, 2003, 5 FROM BODEGA_DATOS.tbDimInventario WHERE CodigoBarra = :c"
+        ), {"c": solo_existencia})
+    return watermark
+
+def _canonical(df):
+    return df.sort_values(["FechaLlegada", "CodigoBarra"], kind="mergesort").reset_index(drop=True)
+
+@pytest.mark.parametrize("mode", ["pandas", "sql"])
+def test_incremental_equals_full_import(engine, mode, monkeypatch):
+    monkeypatch.setattr(connection, "AGGREGATION_MODE", mode)
+    before = connection.get_cruce_data_df(engine, fecha_option=2)
+    watermark = _add_movements(engine, before)
+
+    statements = []
+    fetch = connection._fetch_dataframe
+
+    def _spy(engine, statement, params, **kwargs):
+        statements.append(str(statement))
+        return fetch(engine, statement, params, **kwargs)
+
+    monkeypatch.setattr(connection, "_fetch_dataframe", _spy)
+    progress = []
+    refreshed = connection.refresh_cruce_incremental(engine, fecha_option=2,
+                                                     progress=lambda rows, lotes: progress.append(rows))
+    monkeypatch.setattr(connection, "_fetch_dataframe", fetch)
+
+    assert progress and progress[-1] > 0
+    # Delta sin BodegaCTE/BodegaSum + una sola foto de existencias
+    assert len(statements) == 2
+    assert "BodegaSum" not in statements[0]
+    assert "tbHecInventario" in statements[1]
+    assert connection.get_watermark(engine, fecha_option=2) == watermark + timedelta(days=1)
+
+    full = connection.get_cruce_data_df(engine, fecha_option=2, use_cache=False)
+    assert len(refreshed) == len(before) + 1
+    pd.testing.assert_frame_equal(_canonical(refreshed), _canonical(full),
+                                  check_dtype=False, check_categorical=False)
+
+def test_verify_narrowed_range(engine):
+    connection.get_cruce_data_df(engine, fecha_option=1)
+    assert connection.verify_narrowed_range(engine, fecha_option=2)
+
+def test_cache_info_reports_hits_and_age(engine):
+    info = {}
+    connection.get_cruce_data_df(engine, fecha_option=1, cache_info=info)
+    assert info["hit"] is None
+
+    connection.get_cruce_data_df(engine, fecha_option=1, cache_info=info)
+    assert info["hit"] == "exacto" and info["age_s"] >= 0
+
+    # El rango derivado hereda la antigüedad de la consulta amplia
+    connection.get_cruce_data_df(engine, fecha_option=2, cache_info=info)
+    assert info["hit"] == "rango" and info["age_s"] >= 0
+
+    connection.get_cruce_data_df(engine, fecha_option=2, use_cache=False, cache_info=info)
+    assert info["hit"] is None
+
+def test_incremental_refresh_honours_cancel(engine):
+    connection.get_cruce_data_df(engine, fecha_option=2)
+    token = connection.CancelToken()
+    token.cancel()
+    with pytest.raises(connection.QueryCancelled):
+        connection.refresh_cruce_incremental(engine, fecha_option=2, cancel_token=token)
+
+@pytest.mark.parametrize("setting, value", [("SARGABLE_PREDICATES", True), ("REGION_SOURCE", "table")])
+def test_cache_key_separates_query_variants(engine, monkeypatch, setting, value):
+    info = {}
+    connection.get_cruce_data_df(engine, fecha_option=1)
+    monkeypatch.setattr(connection, setting, value)
+    connection.get_cruce_data_df(engine, fecha_option=1, cache_info=info)
+    assert info["hit"] is None
+    connection.get_cruce_data_df(engine, fecha_option=2, cache_info=info)
+    assert info["hit"] == "rango"
@@ -0,0 +1,38 @@
+# tests/test_instrumentation.py
+import pytest
+
+from utils import instrumentation
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(instrumentation, "ENABLED", True)
+    monkeypatch.setattr(instrumentation, "_handler_failed", False)
+    monkeypatch.setattr(instrumentation, "_handler", None)
+    yield
+    if instrumentation._handler is not None:
+        instrumentation._logger.removeHandler(instrumentation._handler)
+        instrumentation._handler.close()
+
+def test_unwritable_log_keeps_records_in_memory(enabled, monkeypatch, tmp_path):
+    # Una carpeta que es un archivo: makedirs falla con OSError
+    blocker = tmp_path / "bloqueo"
+    blocker.write_text("")
+    monkeypatch.setattr(instrumentation, "LOG_FILE", str(blocker / "etapas.jsonl"))
+
+    with instrumentation.collect() as records:
+        with instrumentation.track("lectura") as st:
+            st.set(rows=10)
+        with instrumentation.track("dataframe"):
+            pass
+
+    assert [r["stage"] for r in records] == ["lectura", "dataframe"]
+    assert records[0]["rows"] == 10
+    assert instrumentation._handler is None
+
+def test_log_written_as_json_lines(enabled, monkeypatch, tmp_path):
+    path = tmp_path / "logs" / "etapas.jsonl"
+    monkeypatch.setattr(instrumentation, "LOG_FILE", str(path))
+    with instrumentation.track("consulta"):
+        pass
+    instrumentation._handler.flush()
+    assert '"stage": "consulta"' in path.read_text(encoding="utf-8")
@@ -0,0 +1,99 @@
+# utils/filter_index.py
+import numpy as np
+import pandas as pd
+
+def _norm_lower(values: pd.Index) -> pd.Index:
+    return values.astype(str).str.strip().str.lower()
+
+def _norm_strip(values: pd.Index) -> pd.Index:
+    return values.astype(str).str.strip()
+
+def _norm_exact(values: pd.Index) -> pd.Index:
+    return values.astype(str)
+
+class FilterIndex:
+    """
+    Índices de búsqueda construidos una sola vez al importar df_cruce.
+    Para cada columna filtrable guarda valor normalizado -> posiciones de fila
+    (np.ndarray ordenado). La normalización (strip/lower) se hace sobre los
+    valores únicos, no fila por fila, y buscar es intersectar posiciones.
+
+    Mantiene la semántica de MainView.buscar_datos:
+      - CodigoBarra: igualdad exacta del texto.
+      - Referencia, CategoriaNombre, Linea: igualdad sin espacios y sin mayúsculas.
+      - CodigoFabricante: igualdad sin espacios.
+      - correccion == 0 opcional.
+    """
+
+    COLUMNS = {
+        "CodigoBarra": _norm_exact,
+        "Referencia": _norm_lower,
+        "CategoriaNombre": _norm_lower,
+        "Linea": _norm_lower,
+        "CodigoFabricante": _norm_strip,
+    }
+    QUERY_NORMALIZERS = {
+        "CodigoBarra": lambda v: v,
+        "Referencia": lambda v: v.strip().lower(),
+        "CategoriaNombre": lambda v: v.strip().lower(),
+        "Linea": lambda v: v.strip().lower(),
+        "CodigoFabricante": lambda v: v.strip(),
+    }
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+        self._postings = {}
+        for col, normalize in self.COLUMNS.items():
+            if col in df.columns:
+                self._postings[col] = self._build_postings(df[col], normalize)
+        if "correccion" in df.columns:
+            corr = pd.to_numeric(df["correccion"], errors="coerce").to_numpy()
+            self._correccion_cero = np.flatnonzero(corr == 0)
+        else:
+            self._correccion_cero = None
+
+    @staticmethod
+    def _build_postings(series: pd.Series, normalize) -> dict:
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        if not len(uniques):
+            return {}
+        keys = normalize(pd.Index(uniques))
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(uniques))
+        groups = np.split(order, np.cumsum(counts)[:-1])
+
+        postings = {}
+        for key, positions in zip(keys, groups):
+            if key in postings:
+                # Varios valores crudos normalizan igual (' A' y 'a')
+                postings[key] = np.union1d(postings[key], positions)
+            else:
+                postings[key] = positions
+        return postings
+
+    def search(self, filters: dict, correccion_cero: bool = False) -> np.ndarray:
+        """
+        Posiciones (ascendentes) de las filas que cumplen todos los filtros.
+        `filters` mapea columna -> texto tal cual lo escribió el usuario;
+        los valores vacíos se ignoran.
+        """
+        candidates = []
+        for col, value in filters.items():
+            if value is None or value == "" or col not in self._postings:
+                continue
+            key = self.QUERY_NORMALIZERS[col](str(value))
+            if not key:
+                continue
+            candidates.append(self._postings[col].get(key, np.empty(0, dtype=np.intp)))
+        if correccion_cero and self._correccion_cero is not None:
+            candidates.append(self._correccion_cero)
+
+        if not candidates:
+            return np.arange(self.n_rows)
+        candidates.sort(key=len)
+        result = candidates[0]
+        for other in candidates[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result
@@ -1,12 +1,16 @@
+import importlib.util
 import os
 import platform
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 import logging
-from openpyxl.styles import numbers
-from openpyxl.utils import get_column_letter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from db.postprocess import format_pct_columns
+from utils.tasks import BackgroundTask
+from utils import instrumentation
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
@@ -29,49 +33,209 @@ def get_save_path(parent, defaultextension=".xlsx", filetypes=None) -> str:
     )
     return file_path or ""
 
-def export_to_csv(data, output_file: str) -> None:
+class ExportCancelled(Exception):
+    """La exportación fue cancelada por el usuario."""
+
+# Columnas de código que se exportan como texto con ceros a la izquierda
+COLUMNAS_TEXTO = ("CodigoFabricante", "CategoriaCodigo", "CodigoBarra")
+CSV_CHUNK_ROWS = 50_000
+
+def _as_dataframe(data) -> pd.DataFrame:
+    """Acepta un DataFrame (se usa tal cual, sin copiar) o una lista de dicts."""
+    if isinstance(data, pd.DataFrame):
+        return data
+    return pd.DataFrame(data, columns=data[0].keys()) if data else pd.DataFrame()
+
+def _pad_codes(series: pd.Series) -> pd.Series:
+    """Texto con ceros a la izquierda (zfill(4)); en categóricas solo se rellenan las categorías."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        cats = series.cat.categories.astype(str).str.zfill(4).str.strip().to_numpy(dtype=object)
+        codes = series.cat.codes.to_numpy()
+        values = np.where(codes >= 0, cats[codes], "") if len(cats) else np.full(len(codes), "", dtype=object)
+        return pd.Series(values, index=series.index, dtype=object)
+    return series.astype(object).fillna("").astype(str).str.zfill(4).str.strip()
+
+def _prepare_export(df: pd.DataFrame, format_pct: bool = True) -> pd.DataFrame:
+    """
+    Copia (del bloque dado) lista para escribir: códigos rellenados y, para
+    formatos de texto, Queda/Vendido como '33,33%'. No modifica df.
+    """
+    out = format_pct_columns(df) if format_pct else df
+    if out is df:
+        out = df.copy(deep=False)
+    for col in COLUMNAS_TEXTO:
+        if col in out.columns:
+            out[col] = _pad_codes(out[col])
+    return out
+
+def export_to_csv(data, output_file: str, progress=None, chunk_rows: int = CSV_CHUNK_ROWS) -> None:
+    """
+    Exporta a CSV (UTF-8 con BOM) por bloques de `chunk_rows` filas: cada bloque
+    se formatea y se escribe al archivo abierto, sin copiar el resultado completo.
+    progress(filas_escritas, total) se llama tras cada bloque.
+    """
     try:
-        df = pd.DataFrame(data, columns=data[0].keys()) if data else pd.DataFrame()
-        columnas_texto = ["CodigoFabricante", "CategoriaCodigo", "CodigoBarra"]
-        
-        # Rellenar con ceros a la izquierda en columnas específicas
-        for col in columnas_texto:
-            if col in df.columns:
-                df[col] = df[col].fillna("").astype(str).str.zfill(4).str.strip()
-        
-        df.to_csv(output_file, index=False, encoding='utf-8-sig')
+        df = _as_dataframe(data)
+        total = len(df)
+        with open(output_file, "w", encoding="utf-8-sig", newline="") as f:
+            if not total:
+                _prepare_export(df).to_csv(f, index=False)
+            for start in range(0, total, chunk_rows):
+                chunk = _prepare_export(df.iloc[start:start + chunk_rows])
+                chunk.to_csv(f, index=False, header=(start == 0))
+                if progress is not None:
+                    progress(min(start + chunk_rows, total), total)
         logging.info("Archivo CSV guardado exitosamente en: %s", output_file)
+    except ExportCancelled:
+        raise
     except Exception as e:
         logging.error("Error al exportar a CSV: %s", e)
         raise
 
-def export_to_excel(data, output_file: str) -> None:
+def export_to_parquet(data, output_file: str, compression: str = "zstd", progress=None) -> None:
+    """
+    Exporta a Parquet (requiere pyarrow) conservando tipos: Queda/Vendido quedan
+    numéricas y las columnas repetitivas como diccionario (categorías).
+    """
+    try:
+        df = _prepare_export(_as_dataframe(data), format_pct=False)
+        df.to_parquet(output_file, index=False, compression=compression)
+        if progress is not None:
+            progress(len(df), len(df))
+        logging.info("Archivo Parquet guardado exitosamente en: %s", output_file)
+    except ExportCancelled:
+        raise
+    except Exception as e:
+        logging.error("Error al exportar a Parquet: %s", e)
+        raise
+
+def export_to_feather(data, output_file: str, compression: str = "zstd", progress=None) -> None:
+    """Exporta a Feather/Arrow IPC (requiere pyarrow), con los mismos tipos que Parquet."""
     try:
-        df = pd.DataFrame(data, columns=data[0].keys()) if data else pd.DataFrame()
-        columnas_texto = ["CodigoFabricante", "CategoriaCodigo", "CodigoBarra"]
-        
-        # Rellenar con ceros a la izquierda en columnas específicas
-        for col in columnas_texto:
-            if col in df.columns:
-                df[col] = df[col].fillna("").astype(str).str.zfill(4).str.strip()
-        
-        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name="Cruce", index=False)
-            worksheet = writer.sheets["Cruce"]
-            
-            for col_name in columnas_texto:
-                if col_name in df.columns:
-                    col_idx = df.columns.get_loc(col_name) + 1
-                    col_letter = get_column_letter(col_idx)
-                    for row in range(2, len(df) + 2):
-                        cell = worksheet[f"{col_letter}{row}"]
-                        val = cell.value if cell.value is not None else ""
-                        val_str = str(val).strip()
-                        val_escaped = val_str.replace('"', '""')
-                        cell.value = f'="{val_escaped}"'
+        df = _prepare_export(_as_dataframe(data), format_pct=False).reset_index(drop=True)
+        df.to_feather(output_file, compression=compression)
+        if progress is not None:
+            progress(len(df), len(df))
+        logging.info("Archivo Feather guardado exitosamente en: %s", output_file)
+    except ExportCancelled:
+        raise
+    except Exception as e:
+        logging.error("Error al exportar a Feather: %s", e)
+        raise
+
+# Límite de filas por hoja de Excel (incluye el encabezado)
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_CHUNK_ROWS = 10_000
+
+def _excel_row_chunks(df: pd.DataFrame, start: int, stop: int, chunk_rows: int):
+    """Filas como tuplas de valores Python (NaN/NaT -> None), en bloques acotados."""
+    for offset in range(start, stop, chunk_rows):
+        block = _prepare_export(df.iloc[offset:min(offset + chunk_rows, stop)])
+        cols = [block[c].astype(object).where(block[c].notna(), None).to_numpy() for c in block.columns]
+        yield list(zip(*cols))
+
+def _write_excel_openpyxl(df, output_file, sheet_titles, text_idx, date_idx, progress):
+    """Escritura con workbook write-only de openpyxl (no guarda celdas en memoria)."""
+    # openpyxl se importa recién al exportar (arranque más rápido)
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, numbers
+
+    wb = Workbook(write_only=True)
+    header_font = Font(bold=True)
+    total, written = len(df), 0
+    for title, start, stop in sheet_titles:
+        ws = wb.create_sheet(title=title)
+        header = []
+        for name in df.columns:
+            cell = WriteOnlyCell(ws, value=str(name))
+            cell.font = header_font
+            header.append(cell)
+        ws.append(header)
+
+        for rows in _excel_row_chunks(df, start, stop, EXCEL_CHUNK_ROWS):
+            for values in rows:
+                if text_idx or date_idx:
+                    values = list(values)
+                    for i in text_idx:
+                        cell = WriteOnlyCell(ws, value=values[i])
                         cell.number_format = numbers.FORMAT_TEXT
-        
+                        values[i] = cell
+                    for i in date_idx:
+                        if values[i] is not None:
+                            cell = WriteOnlyCell(ws, value=values[i].to_pydatetime())
+                            cell.number_format = "yyyy-mm-dd"
+                            values[i] = cell
+                ws.append(values)
+            written += len(rows)
+            if progress is not None:
+                progress(written, total)
+    wb.save(output_file)
+
+def _write_excel_xlsxwriter(df, output_file, sheet_titles, text_idx, date_idx, progress):
+    """Escritura con xlsxwriter en modo constant_memory (fila a fila, más rápido)."""
+    import xlsxwriter
+
+    wb = xlsxwriter.Workbook(output_file, {"constant_memory": True})
+    header_fmt = wb.add_format({"bold": True})
+    text_fmt = wb.add_format({"num_format": "@"})
+    date_fmt = wb.add_format({"num_format": "yyyy-mm-dd"})
+    other_idx = [i for i in range(len(df.columns)) if i not in text_idx and i not in date_idx]
+    total, written = len(df), 0
+    try:
+        for title, start, stop in sheet_titles:
+            ws = wb.add_worksheet(title)
+            ws.write_row(0, 0, [str(c) for c in df.columns], header_fmt)
+            r = 1
+            for rows in _excel_row_chunks(df, start, stop, EXCEL_CHUNK_ROWS):
+                for values in rows:
+                    for i in text_idx:
+                        ws.write_string(r, i, values[i], text_fmt)
+                    for i in date_idx:
+                        if values[i] is not None:
+                            ws.write_datetime(r, i, values[i].to_pydatetime(), date_fmt)
+                    for i in other_idx:
+                        if values[i] is not None:
+                            ws.write(r, i, values[i])
+                    r += 1
+                written += len(rows)
+                if progress is not None:
+                    progress(written, total)
+    finally:
+        wb.close()
+
+def export_to_excel(data, output_file: str, progress=None, sheet_name: str = "Cruce",
+                    max_rows: int = EXCEL_MAX_ROWS) -> None:
+    """
+    Exporta a .xlsx (DataFrame o lista de dicts) en una sola pasada y con
+    memoria acotada (filas formateadas por bloques, sin celdas retenidas): usa xlsxwriter (constant_memory) si está instalado y,
+    si no, el workbook write-only de openpyxl.
+    - Las columnas de código se escriben como texto ('@') conservando ceros a la izquierda.
+    - Si se supera el límite de filas de Excel, continúa en hojas Cruce_2, Cruce_3, ...
+    - progress(filas_escritas, total) se llama tras cada bloque.
+    """
+    try:
+        df = _as_dataframe(data)
+        columns = list(df.columns)
+        text_idx = [i for i, c in enumerate(columns) if c in COLUMNAS_TEXTO]
+        date_idx = [i for i, c in enumerate(columns) if pd.api.types.is_datetime64_any_dtype(df[c])]
+
+        # Reparto en hojas: (título, fila inicial, fila final)
+        rows_per_sheet = max_rows - 1
+        sheet_titles = [
+            (sheet_name if n == 0 else f"{sheet_name}_{n + 1}", start, min(start + rows_per_sheet, len(df)))
+            for n, start in enumerate(range(0, max(len(df), 1), rows_per_sheet))
+        ]
+
+        if importlib.util.find_spec("xlsxwriter") is not None:
+            writer = _write_excel_xlsxwriter
+        else:
+            writer = _write_excel_openpyxl
+        writer(df, output_file, sheet_titles, text_idx, date_idx, progress)
+
         logging.info("Archivo Excel guardado exitosamente en: %s", output_file)
+    except ExportCancelled:
+        raise
     except Exception as e:
         logging.error("Error al exportar a Excel: %s", e)
         raise
@@ -84,22 +248,159 @@ def obtener_datos_treeview(tree: ttk.Treeview) -> list:
         datos.append(fila)
     return datos
 
+# Formatos de exportación: extensión -> (descripción, función)
+EXPORT_FORMATS = {
+    "csv": ("Archivos CSV", export_to_csv),
+    "xlsx": ("Archivos Excel", export_to_excel),
+    "parquet": ("Archivos Parquet", export_to_parquet),
+    "feather": ("Archivos Feather", export_to_feather),
+}
+
+def _remove_partial(path: str) -> None:
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logging.warning("No se pudo eliminar el archivo incompleto %s: %s", path, e)
+
+def run_exports(data, targets, progress=None, cancel_event=None, max_workers=None) -> list:
+    """
+    Escribe `data` en uno o varios formatos a la vez; targets = [(formato, ruta), ...].
+    Cada formato se escribe en su propio hilo sobre el mismo DataFrame (solo lectura).
+    - progress(formato, filas_escritas, total) tras cada bloque.
+    - Si cancel_event se activa, cada escritura se detiene en su siguiente bloque,
+      se borran los archivos incompletos y se lanza ExportCancelled.
+    Devuelve las rutas escritas, en el orden de targets.
+    """
+    df = _as_dataframe(data)
+
+    def _check():
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExportCancelled("Exportación cancelada.")
+
+    def _export_one(formato, path):
+        _check()
+        def _progress(written, total):
+            _check()
+            if progress is not None:
+                progress(formato, written, total)
+        with instrumentation.track(f"exportar_{formato}", rows=len(df)) as st:
+            EXPORT_FORMATS[formato][1](df, path, progress=_progress)
+            if instrumentation.ENABLED:
+                st.set(bytes=os.path.getsize(path))
+        return path
+
+    errors = {}
+    workers = max_workers or max(1, len(targets))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as pool:
+        futures = {pool.submit(_export_one, formato, path): path for formato, path in targets}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if cancelled or errors:
+        for formato, path in targets:
+            if cancelled or path in errors:
+                _remove_partial(path)
+        if cancelled:
+            raise ExportCancelled("Exportación cancelada.")
+        raise next(iter(errors.values()))
+    return [path for _, path in targets]
+
+class ExportProgressDialog(tk.Toplevel):
+    """Ventana no modal con barra de progreso (promedio de los formatos) y botón Cancelar."""
+
+    def __init__(self, parent, formatos, on_cancel):
+        super().__init__(parent)
+        self.title("Exportando...")
+        self.resizable(False, False)
+        self.transient(parent)
+        self.protocol("WM_DELETE_WINDOW", on_cancel)
+        self._fractions = {formato: 0.0 for formato in formatos}
+
+        self.label_var = tk.StringVar(value="Preparando exportación...")
+        ttk.Label(self, textvariable=self.label_var, width=50).pack(padx=12, pady=(12, 6), anchor="w")
+        self.bar = ttk.Progressbar(self, orient="horizontal", length=320, mode="determinate", maximum=100)
+        self.bar.pack(padx=12, pady=6)
+        self.cancel_btn = ttk.Button(self, text="Cancelar", command=on_cancel)
+        self.cancel_btn.pack(padx=12, pady=(6, 12))
+
+    def update_progress(self, formato, written, total):
+        self._fractions[formato] = 1.0 if not total else written / total
+        self.bar["value"] = 100 * sum(self._fractions.values()) / len(self._fractions)
+        self.label_var.set(f"{formato}: {written:,} de {total:,} filas")
+
+    def set_cancelling(self):
+        self.label_var.set("Cancelando...")
+        self.cancel_btn.configure(state="disabled")
+
+def export_in_background(parent, data, targets, on_done=None):
+    """
+    Lanza run_exports en segundo plano con un diálogo de progreso; la interfaz
+    sigue respondiendo. Los avisos de fin, error o cancelación se muestran en el
+    hilo de Tk. on_done(rutas) se llama solo si todo se escribió.
+    """
+    formatos = [formato for formato, _ in targets]
+    dialog = None
+
+    def _work(task):
+        return run_exports(data, targets, progress=task.report, cancel_event=task.cancel_event)
+
+    def _cancel():
+        dialog.set_cancelling()
+        task.cancel()
+
+    def _on_success(paths):
+        dialog.destroy()
+        messagebox.showinfo("Éxito", "Datos exportados correctamente a:\n" + "\n".join(paths), parent=parent)
+        if on_done is not None:
+            on_done(paths)
+
+    def _on_error(e):
+        dialog.destroy()
+        if isinstance(e, ExportCancelled):
+            messagebox.showinfo("Cancelado", "Exportación cancelada.", parent=parent)
+        else:
+            logging.error("Error durante exportación: %s", e)
+            messagebox.showerror("Error", f"Error durante exportación:\n{e}", parent=parent)
+
+    task = BackgroundTask(parent, _work, on_success=_on_success, on_error=_on_error)
+    dialog = ExportProgressDialog(parent, formatos, on_cancel=_cancel)
+    task.on_progress = dialog.update_progress
+    return task.start()
+
 def export_data_interactive(data, parent):
-    formato = simpledialog.askstring("Formato exportación", "¿En qué formato desea exportar? (csv/xlsx):", parent=parent)
+    """
+    Pide uno o varios formatos (p. ej., 'xlsx, csv, parquet') y la ruta base,
+    y exporta en segundo plano; los formatos pedidos se escriben en paralelo.
+    """
+    opciones = "/".join(EXPORT_FORMATS)
+    formato = simpledialog.askstring(
+        "Formato exportación",
+        f"¿En qué formato desea exportar? ({opciones})\nPuede indicar varios separados por coma:",
+        parent=parent,
+    )
     if not formato:
         messagebox.showinfo("Cancelado", "No se seleccionó formato de exportación.")
         return
-    formato = formato.strip().lower()
-    if formato not in ("csv", "xlsx"):
-        messagebox.showerror("Error", "Formato no válido. Debe ser 'csv' o 'xlsx'.")
+    formatos = []
+    for f in formato.replace(";", ",").split(","):
+        f = f.strip().lower().lstrip(".")
+        if f == "xls":
+            f = "xlsx"
+        if f and f not in formatos:
+            formatos.append(f)
+    invalidos = [f for f in formatos if f not in EXPORT_FORMATS]
+    if not formatos or invalidos:
+        messagebox.showerror("Error", f"Formato no válido. Debe ser uno de: {opciones}.")
         return
 
-    if formato == "csv":
-        filetypes = [("Archivos CSV", "*.csv")]
-        def_ext = ".csv"
-    else:
-        filetypes = [("Archivos Excel", "*.xlsx")]
-        def_ext = ".xlsx"
+    descripcion, _ = EXPORT_FORMATS[formatos[0]]
+    filetypes = [(descripcion, f"*.{formatos[0]}")]
+    def_ext = f".{formatos[0]}"
 
     file_path = get_save_path(parent, defaultextension=def_ext, filetypes=filetypes)
 
@@ -107,18 +408,13 @@ def export_data_interactive(data, parent):
         messagebox.showinfo("Cancelado", "No se seleccionó ruta para guardar.")
         return
 
-    ext = file_path.lower().split('.')[-1]
-    try:
-        if ext == "csv":
-            export_to_csv(data, file_path)
-        elif ext in ("xls", "xlsx"):
-            export_to_excel(data, file_path)
-        else:
-            messagebox.showerror("Error", "Extensión de archivo no soportada.")
-            return
-        messagebox.showinfo("Éxito", f"Datos exportados correctamente a:\n{file_path}")
-    except Exception as e:
-        messagebox.showerror("Error", f"Error durante exportación:\n{e}")
+    base, ext = os.path.splitext(file_path)
+    if len(formatos) == 1 and ext.lower().lstrip(".") not in (formatos[0], "xls"):
+        messagebox.showerror("Error", "Extensión de archivo no soportada.")
+        return
+    # Con varios formatos, la misma ruta base con la extensión de cada uno
+    targets = [(formatos[0], file_path)] + [(f, f"{base}.{f}") for f in formatos[1:]]
+    return export_in_background(parent, data, targets)
 
 # Ejemplo básico de UI para probar exportación
 
@@ -0,0 +1,85 @@
+# utils/tasks.py
+import logging
+import queue
+import threading
+
+class BackgroundTask:
+    """
+    Ejecuta `target(task)` en un hilo de trabajo y entrega progreso, resultado
+    o error en el hilo de Tk mediante una cola consultada con widget.after().
+    Ningún callback toca widgets desde el hilo de trabajo.
+
+    - target recibe la propia tarea y puede llamar task.report(*datos).
+    - on_progress(*datos), on_success(resultado) y on_error(excepción) se
+      ejecutan en el hilo de la interfaz.
+    """
+
+    def __init__(self, widget, target, on_success=None, on_error=None,
+                 on_progress=None, poll_ms=100):
+        self.widget = widget
+        self.target = target
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.poll_ms = poll_ms
+        self.cancel_event = threading.Event()
+        self._cancel_callbacks = []
+        self._queue = queue.Queue()
+        self._thread = None
+        self.done = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.widget.after(self.poll_ms, self._poll)
+        return self
+
+    def report(self, *payload):
+        """Llamado desde el hilo de trabajo; solo encola."""
+        self._queue.put(("progress", payload))
+
+    def add_cancel_callback(self, callback):
+        """Registra una acción extra al cancelar (p. ej., cancelar el cursor)."""
+        self._cancel_callbacks.append(callback)
+
+    def cancel(self):
+        self.cancel_event.set()
+        for callback in self._cancel_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning("Error al cancelar la tarea: %s", e)
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _run(self):
+        try:
+            result = self.target(self)
+        except BaseException as e:
+            self._queue.put(("error", e))
+        else:
+            self._queue.put(("done", result))
+
+    def _poll(self):
+        try:
+            while True:
+                kind, payload = self._queue.get_nowait()
+                if kind == "progress":
+                    if self.on_progress:
+                        self.on_progress(*payload)
+                elif kind == "done":
+                    self.done = True
+                    if self.on_success:
+                        self.on_success(payload)
+                else:
+                    self.done = True
+                    if self.on_error:
+                        self.on_error(payload)
+                    else:
+                        logging.error("Error en tarea en segundo plano: %s", payload)
+        except queue.Empty:
+            pass
+        if not self.done:
+            self.widget.after(self.poll_ms, self._poll)
@@ -0,0 +1,37 @@
+# utils/warmup.py
+import importlib
+import logging
+import os
+import threading
+import time
+
+# Precarga en segundo plano de los módulos pesados que la ventana ya no
+# importa al arrancar, para que la primera importación no los espere.
+# ROTACION_WARMUP=0 la desactiva (se cargan al usarlos por primera vez).
+WARMUP_ENABLED = os.environ.get("ROTACION_WARMUP", "1") == "1"
+WARMUP_MODULES = (
+    "pandas",
+    "db.connection",      # SQLAlchemy, queries, caché
+    "utils.filter_index",
+)
+
+def _warm(modules):
+    t0 = time.perf_counter()
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            # Si falla, el error real aparecerá al usar el módulo
+            logging.warning("No se pudo precargar %s: %s", name, e)
+            continue
+        logging.debug("Precarga de %s: %.2f s", name, time.perf_counter() - start)
+    logging.debug("Precarga completa en %.2f s", time.perf_counter() - t0)
+
+def start_warmup(modules=WARMUP_MODULES):
+    """Importa `modules` en un hilo daemon (sin tocar Tk). Devuelve el hilo, o None si está desactivada."""
+    if not WARMUP_ENABLED:
+        return None
+    thread = threading.Thread(target=_warm, args=(modules,), name="warmup", daemon=True)
+    thread.start()
+    return thread
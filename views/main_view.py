@@ -1,8 +1,17 @@
+import sys
 import customtkinter as ctk
 import tkinter as tk
-from tkinter import ttk, messagebox
-import pandas as pd
-from db.connection import get_db_connection, get_cruce_data, set_default_instance, PREDEFINED_INSTANCES
+from tkinter import messagebox
+from typing import TYPE_CHECKING
+from db.instances import PREDEFINED_INSTANCES
+from utils.tasks import BackgroundTask
+from utils import instrumentation
+from views.virtual_tree import VirtualTreeview
+
+# pandas, SQLAlchemy (db.connection) y openpyxl (utils.helpers) se importan
+# recién cuando se usan: la ventana aparece sin esperarlos (ver utils.warmup)
+if TYPE_CHECKING:
+    import pandas as pd
 
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
@@ -22,11 +31,18 @@ class MainView(ctk.CTk):
         self.geometry("900x600")
         self.refresh_callback = refresh_callback
         self.df_cruce = None
+        self.filter_index = None
+        self.instance_alias = None
+        # (instancia, opción de fecha) de df_cruce: otra importación igual es incremental
+        self._loaded = None
 
         self.grid_rowconfigure(0, weight=0)
         self.grid_rowconfigure(1, weight=0)
         self.grid_rowconfigure(2, weight=1)
+        self.grid_rowconfigure(3, weight=0)
         self.grid_columnconfigure(0, weight=1)
+        self._import_task = None
+        self._import_token = None
 
         self._build_button_bar()
 
@@ -35,53 +51,20 @@ class MainView(ctk.CTk):
         self.tabview.add("Cruce")
         self.cruce_frame = self.tabview.tab("Cruce")
         self._build_treeview(self.cruce_frame)
+        self._build_status_bar()
 
         self.filter_frame = None
 
     # ---------------------------- helpers ---------------------------------
 
-    def _recalc_visible_totals(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _recalc_visible_totals(self, df: "pd.DataFrame") -> "pd.DataFrame":
         """
-        Recalcula:
-        - Cantidad_Inicial_Agrupada = suma de CantidadInicial por CodigoBarra SOLO con las filas visibles (df).
-        - Queda, Vendido = porcentajes usando ese nuevo denominador visible.
+        Recalcula Cantidad_Inicial_Agrupada, Queda y Vendido SOLO con las filas visibles (df).
         No modifica tus filtros; solo ajusta columnas calculadas para lo que se muestra.
         """
-        if df.empty:
-            return df
-
-        # Asegurar tipos numéricos (evita problemas con strings)
-        if "CantidadInicial" in df.columns:
-            df["CantidadInicial"] = pd.to_numeric(df["CantidadInicial"], errors="coerce").fillna(0)
-        else:
-            df["CantidadInicial"] = 0
-
-        if "ExistenciaActual" in df.columns:
-            df["ExistenciaActual"] = pd.to_numeric(df["ExistenciaActual"], errors="coerce").fillna(0)
-        else:
-            df["ExistenciaActual"] = 0
-
-        # Suma visible por CodigoBarra
-        if "CodigoBarra" in df.columns:
-            tot_visible = df.groupby("CodigoBarra")["CantidadInicial"].transform("sum")
-        else:
-            # Si no existiera (no debería), usa suma global
-            tot_visible = pd.Series(df["CantidadInicial"].sum(), index=df.index)
-
-        # Actualiza la columna con el total visible
-        df["Cantidad_Inicial_Agrupada"] = tot_visible
-
-        # Recalcular Queda/Vendido con ese denominador visible
-        denom = tot_visible.replace(0, pd.NA)
-        queda_num = ((df["ExistenciaActual"] * 100) / denom).astype("float")
-        queda_num = queda_num.fillna(0).round(2)
-        vendido_num = (100 - queda_num).round(2)
-
-        # Formato con coma y %
-        df["Queda"] = queda_num.map(lambda x: f"{x:.2f}%".replace(".", ","))
-        df["Vendido"] = vendido_num.map(lambda x: f"{x:.2f}%".replace(".", ","))
-
-        return df
+        from db.postprocess import recompute_totals
+        with instrumentation.track("totales_visibles", rows=len(df)):
+            return recompute_totals(df)
 
     # ---------------------------- UI --------------------------------------
 
@@ -112,6 +95,26 @@ class MainView(ctk.CTk):
         )
         self.import_btn.grid(row=0, column=1, sticky="w", padx=5)
 
+        # Botón «Refrescar»: descarta la caché de la instancia y vuelve a consultar
+        self.refresh_btn = ctk.CTkButton(
+            self.button_frame, text="Refrescar", command=self.refresh_cruce
+        )
+        self.refresh_btn.grid(row=0, column=5, sticky="w", padx=5)
+
+        # Botón «Cancelar» (visible solo mientras corre una importación)
+        self.cancel_btn = ctk.CTkButton(
+            self.button_frame, text="Cancelar", command=self.cancel_import,
+            fg_color="#b23b3b", hover_color="#8e2f2f"
+        )
+        self.cancel_btn.grid(row=0, column=3, sticky="w", padx=5)
+        self.cancel_btn.grid_remove()
+
+        # Botón «Exportar» (desde el DataFrame, no desde el Treeview)
+        self.export_btn = ctk.CTkButton(
+            self.button_frame, text="Exportar", command=self.export_cruce
+        )
+        self.export_btn.grid(row=0, column=4, sticky="w", padx=5)
+
         # Selector de rango de fechas
         self.fecha_option = tk.IntVar(value=2)
         self.fecha_frame = ctk.CTkFrame(self.button_frame)
@@ -125,33 +128,57 @@ class MainView(ctk.CTk):
             self.fecha_frame, text="2024/01/01 - Actual", variable=self.fecha_option, value=2
         ).pack(anchor="w")
 
+    def _build_status_bar(self):
+        self.status_var = tk.StringVar(value="Listo.")
+        self.status_label = ctk.CTkLabel(self, textvariable=self.status_var, anchor="w", height=20)
+        self.status_label.grid(row=3, column=0, sticky="ew", padx=12, pady=(0, 6))
+
+    def set_status(self, text):
+        self.status_var.set(text)
+
+    @staticmethod
+    def _describe_age(seconds):
+        """'consultado hace 12 min' para la barra de estado."""
+        if seconds is None:
+            return "antigüedad desconocida"
+        seconds = int(seconds)
+        if seconds < 60:
+            return f"consultado hace {seconds} s"
+        if seconds < 3600:
+            return f"consultado hace {seconds // 60} min"
+        return f"consultado hace {seconds // 3600} h {seconds % 3600 // 60} min"
+
+    @staticmethod
+    def _with_stages(text, stages):
+        """Agrega a la barra de estado el resumen de etapas medidas (si hay)."""
+        return f"{text}  [{instrumentation.summarize(stages)}]" if stages else text
+
     def on_instance_selected(self, selected):
+        # Se aplica a db.connection en la primera importación, o ya si está cargado
+        self.instance_alias = selected
+        print(f"Instancia seleccionada: {selected}")
+        if "db.connection" not in sys.modules:
+            return
         try:
-            set_default_instance(selected)
-            print(f"Instancia seleccionada: {selected}")
+            self._connection()
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo seleccionar la instancia:\n{e}")
 
-    def _build_treeview(self, parent):
-        container = tk.Frame(parent)
-        container.pack(expand=True, fill="both")
-
-        self.tree_cruce = ttk.Treeview(container, columns=desired_cols, show="headings")
-        for col in desired_cols:
-            self.tree_cruce.heading(col, text=col)
-            self.tree_cruce.column(col, width=120, anchor="center", stretch=True)
-
-        self.tree_cruce.grid(row=0, column=0, sticky="nsew")
-        container.grid_rowconfigure(0, weight=1)
-        container.grid_columnconfigure(0, weight=1)
+    def _connection(self):
+        """db.connection con la instancia elegida en el selector (lo importa la primera vez)."""
+        from db import connection
+        if self.instance_alias and connection.CURRENT_ALIAS != self.instance_alias:
+            connection.set_default_instance(self.instance_alias)
+        return connection
 
-        vsb = ttk.Scrollbar(container, orient="vertical", command=self.tree_cruce.yview)
-        hsb = ttk.Scrollbar(container, orient="horizontal", command=self.tree_cruce.xview)
-        self.tree_cruce.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
-        vsb.grid(row=0, column=1, sticky="ns")
-        hsb.grid(row=1, column=0, sticky="ew")
+    def _build_treeview(self, parent):
+        # Grilla virtual: solo materializa las filas visibles de df_cruce
+        # Los formateadores (pandas) se asignan con los primeros datos, en populate_tree
+        self.grid_cruce = VirtualTreeview(parent, desired_cols)
+        self.grid_cruce.frame.pack(expand=True, fill="both")
+        self.tree_cruce = self.grid_cruce.tree
 
-        container.bind("<Configure>", self._auto_resize_columns)
+        self.grid_cruce.frame.bind("<Configure>", self._auto_resize_columns)
         self.tree_cruce.bind("<Button-3>", self.show_context_menu)
 
     def _auto_resize_columns(self, event):
@@ -200,68 +227,206 @@ class MainView(ctk.CTk):
     # ---------------------------- data flow --------------------------------
 
     def import_cruce(self):
-        try:
-            engine = get_db_connection()
-            data = get_cruce_data(engine, fecha_option=self.fecha_option.get())
-            df = pd.DataFrame(data) if data else pd.DataFrame()
-
-            # Recalcular totales para el conjunto visible actual (todo el dataset)
-            df = self._recalc_visible_totals(df.copy())
+        """
+        Importa el cruce; puede responder desde la caché (la barra de estado lo
+        indica). Si ya están cargados la misma instancia y rango, trae solo lo
+        nuevo desde la última importación (refresh_cruce_incremental).
+        """
+        if self.df_cruce is not None and self._loaded == (self.instance_alias, self.fecha_option.get()):
+            self._start_import("incremental")
+        else:
+            self._start_import("cache")
 
-            # Mantener solo las columnas deseadas
-            self.df_cruce = df[desired_cols].copy() if not df.empty else df
-            self.populate_tree(self.df_cruce.values.tolist())
+    def refresh_cruce(self):
+        """Invalida la caché de la instancia y consulta de nuevo."""
+        self._start_import("fresh")
 
-            messagebox.showinfo("Importación", "Datos importados correctamente.")
+    def _start_import(self, mode):
+        """mode: "cache" (importación normal), "fresh" (sin caché) o "incremental"."""
+        if self._import_task is not None and not self._import_task.done:
+            return
+        # Etapas medidas de esta importación (vacía si ROTACION_INSTRUMENT está apagado)
+        with instrumentation.collect() as self._import_stages:
+            try:
+                connection = self._connection()
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo seleccionar la instancia:\n{e}")
+                return
+            engine = connection.get_db_connection()
+        if engine is None:
+            return
+        if mode == "fresh":
+            connection.invalidate_cruce_cache(connection.CURRENT_ALIAS)
+        fecha_option = self.fecha_option.get()
+        loaded = (self.instance_alias, fecha_option)
+        self._import_token = token = connection.CancelToken()
+
+        def _work(task):
+            # Hilo de trabajo: consulta + post-proceso con pandas, sin tocar widgets
+            from utils.filter_index import FilterIndex
+            cache_info = {}
+            with instrumentation.collect() as stages:
+                if mode == "incremental":
+                    # Sin marca de agua (p. ej., caché invalidada) hace una importación completa
+                    cache_info["desde"] = connection.get_watermark(engine, fecha_option=fecha_option)
+                    df = connection.refresh_cruce_incremental(
+                        engine, fecha_option=fecha_option,
+                        progress=task.report, cancel_token=token,
+                    )
+                else:
+                    df = connection.get_cruce_data_df(
+                        engine, fecha_option=fecha_option, use_cache=mode != "fresh",
+                        progress=task.report, cancel_token=token,
+                        cache_info=cache_info,
+                    )
+                # Cancelar después del último lote (o con acierto de caché) también cuenta
+                token.check()
+                task.report(len(df), None)
+
+                # Totales y % ya vienen calculados sobre todo el dataset (= lo visible)
+
+                # Mantener solo las columnas deseadas
+                df = df[desired_cols].copy() if not df.empty else df
+
+                # Índices de búsqueda: se construyen una vez por importación
+                with instrumentation.track("indices", rows=len(df)):
+                    index = FilterIndex(df)
+            token.check()
+            return df, index, stages, cache_info, loaded
+
+        self._import_task = BackgroundTask(
+            self, _work,
+            on_success=self._on_import_done,
+            on_error=self._on_import_error,
+            on_progress=self._on_import_progress,
+        )
+        # Cancelar la tarea también cancela el cursor en curso (SQLCancel)
+        self._import_task.add_cancel_callback(self._import_token.cancel)
+        self._set_importing(True)
+        self.set_status("Consultando servidor...")
+        self._import_task.start()
+
+    def cancel_import(self):
+        if self._import_task is not None and not self._import_task.done:
+            self.set_status("Cancelando...")
+            self._import_task.cancel()
+
+    def _set_importing(self, running):
+        if running:
+            self.import_btn.configure(state="disabled")
+            self.refresh_btn.configure(state="disabled")
+            self.cancel_btn.grid()
+        else:
+            self.import_btn.configure(state="normal")
+            self.refresh_btn.configure(state="normal")
+            self.cancel_btn.grid_remove()
 
-            if not self.filter_frame:
-                self.create_filter_frame()
+    def _on_import_progress(self, rows, chunks):
+        if chunks is None:
+            self.set_status(f"Procesando {rows:,} filas...")
+        else:
+            self.set_status(f"Filas leídas: {rows:,} (lotes: {chunks})")
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Fallo en la importación: {e}")
+    def _on_import_done(self, result):
+        self._set_importing(False)
+        if self._import_task.cancelled:
+            # Cancelada justo al terminar: se conserva la grilla anterior
+            self.set_status("Importación cancelada.")
+            return
+        df, self.filter_index, stages, cache_info, self._loaded = result
+        self.df_cruce = df
+        with instrumentation.collect() as grid_stages:
+            self.populate_tree(self.df_cruce)
+        status = f"{len(df):,} filas importadas"
+        if cache_info.get("desde") is not None:
+            status += f" (refresco incremental desde {cache_info['desde']:%Y-%m-%d})"
+        elif cache_info.get("hit"):
+            status += f" (desde caché, {self._describe_age(cache_info.get('age_s'))}; «Refrescar» consulta de nuevo)"
+        self.set_status(self._with_stages(status + ".", self._import_stages + stages + grid_stages))
+
+        messagebox.showinfo("Importación", "Datos importados correctamente.")
+
+        if not self.filter_frame:
+            self.create_filter_frame()
+
+    def _on_import_error(self, e):
+        from db.connection import QueryCancelled
+        self._set_importing(False)
+        if isinstance(e, QueryCancelled):
+            self.set_status("Importación cancelada.")
+            return
+        self.set_status("Error en la importación.")
+        messagebox.showerror("Error", f"Fallo en la importación: {e}")
 
     def buscar_datos(self):
         if self.df_cruce is None:
             messagebox.showwarning("Atención", "Primero importe los datos.")
             return
 
-        df = self.df_cruce.copy()
         filtros = {
             "CodigoBarra": self.codigo_barra_entry.get().strip(),
             "Referencia": self.referencia_entry.get().strip().lower(),
             "CategoriaNombre": self.categoria_entry.get().strip().lower(),
             "Linea": self.linea_entry.get().strip().lower(),
             "CodigoFabricante": self.fabrica_entry.get().strip(),
-            "CorreccionCero": bool(self.correccion_cero_var.get()),
         }
+        correccion_cero = bool(self.correccion_cero_var.get())
+
+        with instrumentation.collect() as stages:
+            # Intersección de índices precalculados (sin normalizar columnas ni copiar df_cruce)
+            with instrumentation.track("filtro") as st:
+                positions = self.filter_index.search(filtros, correccion_cero=correccion_cero)
+                df = self.df_cruce.take(positions)
+                st.set(rows=len(df))
 
-        if "CodigoBarra" in df.columns and filtros["CodigoBarra"]:
-            df = df[df["CodigoBarra"].astype(str) == filtros["CodigoBarra"]]
-        if "Referencia" in df.columns and filtros["Referencia"]:
-            df = df[df["Referencia"].astype(str).str.strip().str.lower() == filtros["Referencia"]]
-        if "CategoriaNombre" in df.columns and filtros["CategoriaNombre"]:
-            df = df[df["CategoriaNombre"].astype(str).str.strip().str.lower() == filtros["CategoriaNombre"]]
-        if "Linea" in df.columns and filtros["Linea"]:
-            df = df[df["Linea"].astype(str).str.strip().str.lower() == filtros["Linea"]]
-        if "CodigoFabricante" in df.columns and filtros["CodigoFabricante"]:
-            df = df[df["CodigoFabricante"].astype(str).str.strip() == filtros["CodigoFabricante"]]
-
-        if filtros["CorreccionCero"] and "correccion" in df.columns:
-            mask = pd.to_numeric(df["correccion"], errors="coerce") == 0
-            df = df[mask]
-
-        # 🔁 Recalcular totales (agrupada/porcentajes) con SOLO estas filas visibles
-        df = self._recalc_visible_totals(df.copy())
-
-        # Mantener columnas en el orden esperado
-        df = df.reindex(columns=desired_cols)
-
-        self.populate_tree(df.values.tolist())
-
-    def populate_tree(self, rows):
-        self.tree_cruce.delete(*self.tree_cruce.get_children())
-        for r in rows:
-            self.tree_cruce.insert("", tk.END, values=r)
+            # 🔁 Recalcular totales (agrupada/porcentajes) con SOLO estas filas visibles
+            df = self._recalc_visible_totals(df)
+
+            # Mantener columnas en el orden esperado
+            df = df.reindex(columns=desired_cols)
+
+            self.populate_tree(df)
+        if stages:
+            self.set_status(self._with_stages(f"{len(df):,} filas visibles.", stages))
+
+    def populate_tree(self, df):
+        """Entrega el DataFrame a la grilla virtual (no inserta filas en Tk)."""
+        if not self.grid_cruce.formatters:
+            from db.postprocess import DISPLAY_FORMATTERS
+            self.grid_cruce.formatters = dict(DISPLAY_FORMATTERS)
+        with instrumentation.track("grilla", rows=0 if df is None else len(df)):
+            self.grid_cruce.set_data(df)
+
+    # ---------------------------- exportación ------------------------------
+
+    def export_cruce(self):
+        """
+        Exporta directamente desde pandas (tipos y ceros a la izquierda intactos,
+        sin leer fila por fila del Treeview). Permite elegir entre las filas
+        visibles (filtro y orden actuales, con totales recalculados) o todo
+        lo importado.
+        """
+        if self.df_cruce is None:
+            messagebox.showwarning("Atención", "Primero importe los datos.")
+            return
+
+        visibles = len(self.grid_cruce)
+        if visibles == len(self.df_cruce):
+            df = self.df_cruce
+        else:
+            solo_visibles = messagebox.askyesnocancel(
+                "Exportar",
+                f"¿Exportar solo las filas visibles ({visibles:,})?\n\n"
+                f"Sí: filas visibles (filtro y orden actuales)\n"
+                f"No: todos los datos importados ({len(self.df_cruce):,})",
+                parent=self,
+            )
+            if solo_visibles is None:
+                return
+            df = self.grid_cruce.visible_frame() if solo_visibles else self.df_cruce
+
+        from utils.helpers import export_data_interactive
+        export_data_interactive(df.reindex(columns=desired_cols), self)
 
     def show_context_menu(self, event):
         row_id = self.tree_cruce.identify_row(event.y)
@@ -0,0 +1,191 @@
+# views/virtual_tree.py
+import tkinter as tk
+from tkinter import ttk
+
+# numpy/pandas se importan al recibir datos: la grilla vacía se arma sin ellos
+
+class VirtualTreeview:
+    """
+    Grilla virtual sobre un ttk.Treeview: el DataFrame se mantiene en pandas y
+    solo se materializan las filas del viewport (más un pequeño margen).
+    - Los item IDs se reciclan al desplazarse (tree.item(iid, values=...)).
+    - La barra vertical se mapea a la longitud del DataFrame, no del Treeview.
+    - Filtrar u ordenar es cambiar el arreglo de posiciones (`order`), sin
+      reinsertar filas.
+    """
+
+    def __init__(self, parent, columns, buffer_rows=5, formatters=None):
+        self.columns = list(columns)
+        self.buffer_rows = buffer_rows
+        self.formatters = dict(formatters or {})
+
+        self.frame = tk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=self.columns, show="headings")
+        for col in self.columns:
+            self.tree.heading(col, text=col, command=lambda c=col: self.toggle_sort(c))
+            self.tree.column(col, width=120, anchor="center", stretch=True)
+
+        self.vsb = ttk.Scrollbar(self.frame, orient="vertical", command=self._on_scrollbar)
+        self.hsb = ttk.Scrollbar(self.frame, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.hsb.set)
+
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.vsb.grid(row=0, column=1, sticky="ns")
+        self.hsb.grid(row=1, column=0, sticky="ew")
+        self.frame.grid_rowconfigure(0, weight=1)
+        self.frame.grid_columnconfigure(0, weight=1)
+
+        self._df = None
+        self._order = ()
+        self._top = 0
+        self._iids = []
+        self._sort_state = (None, True)
+
+        self.tree.bind("<Configure>", lambda e: self._render())
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll_rows(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_rows(3))
+        for key, delta in (("<Up>", -1), ("<Down>", 1)):
+            self.tree.bind(key, lambda e, d=delta: self._key_scroll(d))
+        self.tree.bind("<Prior>", lambda e: self._key_scroll(-self._visible_rows()))
+        self.tree.bind("<Next>", lambda e: self._key_scroll(self._visible_rows()))
+        self.tree.bind("<Home>", lambda e: self._key_jump(0))
+        self.tree.bind("<End>", lambda e: self._key_jump(len(self._order)))
+
+    # ---------------------------- datos -----------------------------------
+
+    def set_data(self, df, order=None):
+        """Asocia un DataFrame (columnas = self.columns) y, opcionalmente, sus posiciones visibles."""
+        import numpy as np
+        self._df = df.reset_index(drop=True) if df is not None else None
+        total = 0 if self._df is None else len(self._df)
+        self._order = np.arange(total) if order is None else np.asarray(order, dtype=np.int64)
+        self._sort_state = (None, True)
+        self._top = 0
+        self._render()
+
+    def set_order(self, positions):
+        """Cambia las filas visibles (y su orden) por posiciones del DataFrame actual."""
+        import numpy as np
+        self._order = np.asarray(positions, dtype=np.int64)
+        self._top = 0
+        self._render()
+
+    @property
+    def dataframe(self):
+        return self._df
+
+    @property
+    def order(self):
+        return self._order
+
+    def visible_frame(self):
+        """DataFrame con las filas visibles, en el orden mostrado."""
+        if self._df is None:
+            return None
+        return self._df.take(self._order)
+
+    def __len__(self):
+        return len(self._order)
+
+    # ---------------------------- orden -----------------------------------
+
+    def sort_by(self, column, ascending=True):
+        if self._df is None or column not in self._df.columns or not len(self._order):
+            return
+        values = self._df[column].take(self._order).reset_index(drop=True)
+        ranked = values.sort_values(ascending=ascending, kind="mergesort", na_position="last")
+        self._order = self._order[ranked.index.to_numpy()]
+        self._sort_state = (column, ascending)
+        self._top = 0
+        self._render()
+
+    def toggle_sort(self, column):
+        current, ascending = self._sort_state
+        self.sort_by(column, ascending=not ascending if current == column else True)
+
+    # ---------------------------- desplazamiento --------------------------
+
+    def scroll_rows(self, delta):
+        self._set_top(self._top + delta)
+
+    def _set_top(self, top):
+        max_top = max(0, len(self._order) - self._visible_rows())
+        top = min(max(0, int(top)), max_top)
+        if top != self._top:
+            self._top = top
+            self.tree.selection_remove(self.tree.selection())
+        self._render()
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self._set_top(round(float(value) * len(self._order)))
+        elif action == "scroll":
+            step = self._visible_rows() if unit == "pages" else 1
+            self.scroll_rows(int(value) * step)
+
+    def _on_mousewheel(self, event):
+        # Windows/macOS: delta en múltiplos de 120 (o pasos pequeños en macOS)
+        steps = -int(event.delta / 120) if abs(event.delta) >= 120 else -int(event.delta)
+        self.scroll_rows(steps * 3)
+        return "break"
+
+    def _key_scroll(self, delta):
+        self.scroll_rows(delta)
+        return "break"
+
+    def _key_jump(self, top):
+        self._set_top(top)
+        return "break"
+
+    # ---------------------------- render ----------------------------------
+
+    def _row_height(self):
+        style = ttk.Style(self.tree)
+        try:
+            return int(style.lookup("Treeview", "rowheight") or 20)
+        except (tk.TclError, ValueError):
+            return 20
+
+    def _visible_rows(self):
+        height = self.tree.winfo_height()
+        if height <= 1:
+            height = int(self.tree.cget("height")) * self._row_height() + self._row_height()
+        # Descuenta el encabezado (aprox. una fila)
+        return max(1, height // self._row_height() - 1)
+
+    def _window_values(self, start, stop):
+        import pandas as pd
+        positions = self._order[start:stop]
+        if not len(positions):
+            return []
+        block = self._df.iloc[positions].reindex(columns=self.columns)
+        for col, fmt in self.formatters.items():
+            if col in block.columns:
+                block[col] = fmt(block[col])
+        block = block.astype(object).where(pd.notna(block), "")
+        return block.to_numpy().tolist()
+
+    def _render(self):
+        total = len(self._order)
+        visible = self._visible_rows()
+        if self._df is None or not total:
+            rows = []
+        else:
+            self._top = min(self._top, max(0, total - visible))
+            rows = self._window_values(self._top, self._top + visible + self.buffer_rows)
+
+        # Reciclar item IDs: solo se crean/borran los que sobran o faltan
+        while len(self._iids) < len(rows):
+            self._iids.append(self.tree.insert("", tk.END, values=()))
+        if len(self._iids) > len(rows):
+            self.tree.delete(*self._iids[len(rows):])
+            del self._iids[len(rows):]
+        for iid, values in zip(self._iids, rows):
+            self.tree.item(iid, values=values)
+        self.tree.yview_moveto(0)
+
+        if total:
+            self.vsb.set(self._top / total, min(1.0, (self._top + visible) / total))
+        else:
+            self.vsb.set(0.0, 1.0)